@@ -0,0 +1,73 @@
+"""
+Message Archive cho RealChat - tầng lưu trữ lạnh cho lịch sử tin nhắn cũ
+
+- Tin nhắn cũ hơn ARCHIVE_AFTER_DAYS được chuyển khỏi "messages" / "message_buckets"
+  sang "message_archive" theo segment: mỗi segment chứa tối đa ARCHIVE_SEGMENT_SIZE tin
+  của một phòng / hội thoại, mã hóa BSON (giữ nguyên ObjectId, datetime) rồi nén zlib
+- Các index nóng (sender/timestamp, recipient/timestamp, room_id, timestamp) chỉ còn
+  dữ liệu gần đây nên vừa RAM; archive chỉ có index (scope, max_id)
+- get_room_messages / get_private_messages tự đọc tiếp archive khi tầng nóng hết tin
+- Tin nhắn 1-1 chưa đọc không bị archive (get_unread_messages vẫn thấy);
+  tin đã archive là chỉ đọc (không mark-read / xóa được)
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from bson import Binary, decode, encode
+from metrics import registry
+import zlib
+
+CODEC = "bson+zlib"
+
+
+def encode_segment(scope: Optional[str], messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Document segment chứa các tin nhắn (cùng scope) đã nén"""
+    raw = encode({"messages": messages})
+    data = zlib.compress(raw, 6)
+    archive_stats.raw_bytes += len(raw)
+    archive_stats.compressed_bytes += len(data)
+    return {
+        "scope": scope,
+        "min_id": min(m["_id"] for m in messages),
+        "max_id": max(m["_id"] for m in messages),
+        "start": min(m["timestamp"] for m in messages),
+        "end": max(m["timestamp"] for m in messages),
+        "count": len(messages),
+        "codec": CODEC,
+        "data": Binary(data),
+        "archived_at": datetime.now(timezone.utc),
+    }
+
+
+def decode_segment(segment: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Giải nén segment thành danh sách tin nhắn"""
+    archive_stats.segments_read += 1
+    return decode(zlib.decompress(segment["data"]))["messages"]
+
+
+class ArchiveStats:
+    def __init__(self):
+        self.archived = 0
+        self.segments_written = 0
+        self.segments_read = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.runs = 0
+        self.last_run: Optional[datetime] = None
+
+
+archive_stats = ArchiveStats()
+
+registry.counter(
+    "realchat_archive_messages_total", "Messages moved to the cold archive",
+    callback=lambda: {(): archive_stats.archived},
+)
+registry.counter(
+    "realchat_archive_segments_total", "Archive segments by operation",
+    ("operation",),
+    callback=lambda: {("write",): archive_stats.segments_written, ("read",): archive_stats.segments_read},
+)
+registry.counter(
+    "realchat_archive_bytes_total", "Archived message bytes before and after compression",
+    ("stage",),
+    callback=lambda: {("raw",): archive_stats.raw_bytes, ("compressed",): archive_stats.compressed_bytes},
+)
@@ -0,0 +1,3 @@
+"""
+Benchmarks Package - Đo hiệu năng các thành phần backend
+"""
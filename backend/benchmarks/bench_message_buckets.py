@@ -0,0 +1,161 @@
+"""
+Benchmark: đọc lịch sử phòng với MESSAGE_STORAGE="document" và "bucketed".
+
+Seed tin nhắn của nhiều phòng xen kẽ nhau (như thực tế: tin của một phòng nằm rải rác),
+gom thành bucket bằng migrate_message_buckets rồi so sánh trên cùng dữ liệu:
+- index keys / documents mà MongoDB phải đọc cho một trang (explain executionStats)
+- số page WiredTiger được yêu cầu từ cache mỗi trang (serverStatus, xấp xỉ read IOPS)
+- kích thước dữ liệu + index của mỗi kiểu lưu trữ (collStats, footprint trong cache)
+- độ trễ get_room_messages (trang mới nhất và trang cũ hơn qua cursor `before`)
+
+Cần MongoDB thật. Chạy từ thư mục backend:
+    python -m benchmarks.bench_message_buckets --mongodb-url mongodb://localhost:27017 \
+        --rooms 200 --messages-per-room 2000 --page-size 50 --iterations 500
+"""
+import argparse
+import asyncio
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+import database
+from config import settings
+from database import get_room_messages
+from migrate_message_buckets import migrate_to_buckets
+from benchmarks.common import measure_async, print_table
+
+
+async def seed(database_: AsyncIOMotorDatabase, rooms: List[ObjectId], per_room: int, batch: int = 5000):
+    """Ghi tin nhắn xen kẽ giữa các phòng, mỗi giây một vòng qua tất cả phòng"""
+    started = datetime.now(timezone.utc) - timedelta(seconds=per_room)
+    documents: List[Dict[str, Any]] = []
+    for i in range(per_room):
+        timestamp = started + timedelta(seconds=i)
+        for room_id in rooms:
+            documents.append({
+                "_id": ObjectId(),
+                "sender": f"user{i % 50}",
+                "recipient": None,
+                "room_id": room_id,
+                "content": f"benchmark message {i} " + "x" * random.randint(10, 120),
+                "message_type": "TEXT",
+                "is_read": False,
+                "timestamp": timestamp,
+                "seq": i + 1,
+            })
+            if len(documents) >= batch:
+                await database_["messages"].insert_many(documents)
+                documents = []
+    if documents:
+        await database_["messages"].insert_many(documents)
+
+
+async def explain_page(database_: AsyncIOMotorDatabase, storage: str, room_id: ObjectId, page_size: int) -> Dict[str, int]:
+    """Keys/documents examined cho query trang mới nhất"""
+    if storage == "document":
+        command = {"find": "messages", "filter": {"room_id": room_id}, "sort": {"timestamp": -1}, "limit": page_size}
+    else:
+        command = {
+            "find": "message_buckets", "filter": {"room_id": room_id}, "sort": {"max_id": -1},
+            "limit": page_size // settings.MESSAGE_BUCKET_SIZE + 1,
+        }
+    result = await database_.command("explain", command, verbosity="executionStats")
+    stats = result["executionStats"]
+    return {"keys": stats["totalKeysExamined"], "docs": stats["totalDocsExamined"]}
+
+
+async def cache_pages_requested(client: AsyncIOMotorClient) -> int:
+    status = await client.admin.command("serverStatus")
+    return status.get("wiredTiger", {}).get("cache", {}).get("pages requested from the cache", 0)
+
+
+async def collection_footprint(database_: AsyncIOMotorDatabase, name: str) -> Dict[str, float]:
+    stats = await database_.command("collStats", name)
+    return {
+        "count": stats.get("count", 0),
+        "data_mb": stats.get("size", 0) / 1048576,
+        "storage_mb": stats.get("storageSize", 0) / 1048576,
+        "index_mb": stats.get("totalIndexSize", 0) / 1048576,
+    }
+
+
+async def run(args: argparse.Namespace):
+    client = AsyncIOMotorClient(args.mongodb_url)
+    db_name = f"realchat_bench_{uuid.uuid4().hex[:8]}"
+    database.db.client = client
+    database.db.db = client[db_name]
+    await database.db._create_indexes()
+    settings.MESSAGE_BUCKET_SIZE = args.bucket_size
+
+    rooms = [ObjectId() for _ in range(args.rooms)]
+    total = args.rooms * args.messages_per_room
+    try:
+        print(f"Seeding {total} messages ({args.rooms} rooms x {args.messages_per_room}) ...")
+        await seed(database.db.db, rooms, args.messages_per_room)
+        print("Bucketing ...")
+        await migrate_to_buckets(database.db.db, args.bucket_size, timedelta(hours=settings.MESSAGE_BUCKET_SPAN_HOURS))
+
+        # Cursor `before` cho trang cũ: tin ở khoảng giữa lịch sử mỗi phòng
+        middle = {}
+        for room_id in rooms[:50]:
+            message = await database.db.db["messages"].find_one(
+                {"room_id": room_id, "seq": args.messages_per_room // 2}, projection={"_id": 1}
+            )
+            middle[room_id] = str(message["_id"])
+        sample = list(middle)
+
+        results = []
+        for storage in ("document", "bucketed"):
+            settings.MESSAGE_STORAGE = storage
+            explain = await explain_page(database.db.db, storage, rooms[0], args.page_size)
+
+            pages_before = await cache_pages_requested(client)
+            latest = await measure_async(
+                lambda i: get_room_messages(str(random.choice(sample)), args.page_size), args.iterations, warmup=20
+            )
+            pages_latest = (await cache_pages_requested(client) - pages_before) / (args.iterations + 20)
+
+            older = await measure_async(
+                lambda i: get_room_messages(str(sample[i % len(sample)]), args.page_size, before=middle[sample[i % len(sample)]]),
+                args.iterations, warmup=20,
+            )
+            footprint = await collection_footprint(
+                database.db.db, "messages" if storage == "document" else "message_buckets"
+            )
+            results.append((storage, explain, pages_latest, latest, older, footprint))
+            print_table(
+                f"{storage}: {args.page_size}-message pages",
+                [("latest page", latest), ("older page (before cursor)", older)],
+            )
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+    print(f"\n{'storage':<10}{'keys/page':>11}{'docs/page':>11}{'WT pages/page':>15}"
+          f"{'docs':>10}{'data MB':>10}{'index MB':>10}{'p50 latest':>12}{'p50 older':>11}")
+    for storage, explain, pages, latest, older, footprint in results:
+        print(
+            f"{storage:<10}{explain['keys']:>11}{explain['docs']:>11}{pages:>15.1f}"
+            f"{footprint['count']:>10}{footprint['data_mb']:>10.1f}{footprint['index_mb']:>10.1f}"
+            f"{latest['p50_ms']:>12.3f}{older['p50_ms']:>11.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-url", default="mongodb://localhost:27017")
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--messages-per-room", type=int, default=2000)
+    parser.add_argument("--bucket-size", type=int, default=settings.MESSAGE_BUCKET_SIZE)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark: middleware ASGI thuần so với BaseHTTPMiddleware cũ
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_middleware --iterations 20000
+"""
+import argparse
+import asyncio
+from typing import Callable
+
+from fastapi import FastAPI, HTTPException, Request, status
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from middleware import RateLimitMiddleware, SecurityHeadersMiddleware, rate_limiter
+from benchmarks.common import call_asgi, make_scope, measure_async, print_table
+
+
+# ============ LEGACY IMPLEMENTATION (để so sánh) ============
+
+class LegacyRateLimitMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next: Callable):
+        client_ip = request.client.host
+        if request.url.path in ["/health", "/", "/docs", "/openapi.json"]:
+            return await call_next(request)
+        if not rate_limiter.is_allowed(client_ip):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests. Please try again later."
+            )
+        return await call_next(request)
+
+
+class LegacySecurityHeadersMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next: Callable):
+        response = await call_next(request)
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+        return response
+
+
+def build_app(security_cls, rate_limit_cls) -> FastAPI:
+    """App tối thiểu với cùng thứ tự middleware như main.py"""
+    app = FastAPI()
+    app.add_middleware(security_cls)
+    app.add_middleware(rate_limit_cls)
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"status": "ok"}
+
+    return app
+
+
+async def run(iterations: int, clients: int):
+    legacy_app = build_app(LegacySecurityHeadersMiddleware, LegacyRateLimitMiddleware)
+    asgi_app = build_app(SecurityHeadersMiddleware, RateLimitMiddleware)
+
+    # Xoay vòng IP để không chạm giới hạn và giữ danh sách timestamp ngắn
+    scopes = [make_scope("GET", "/api/ping", client=(f"10.0.{i // 256}.{i % 256}", 1234)) for i in range(clients)]
+    default_max_requests = rate_limiter.max_requests
+    rate_limiter.max_requests = 10 ** 9
+
+    def hit(app):
+        async def once(i):
+            if i % clients == 0:
+                rate_limiter.requests.clear()
+            status_code, _, _ = await call_asgi(app, dict(scopes[i % clients]))
+            assert status_code == 200
+        return once
+
+    rows = [
+        ("BaseHTTPMiddleware (cũ)", await measure_async(hit(legacy_app), iterations)),
+        ("ASGI thuần (mới)", await measure_async(hit(asgi_app), iterations)),
+    ]
+
+    # Đường 429: prebuilt response so với HTTPException trong middleware
+    rate_limiter.max_requests = 0
+    blocked_scope = make_scope("GET", "/api/ping", client=("10.9.9.9", 1234))
+
+    async def blocked_new(i):
+        status_code, _, _ = await call_asgi(asgi_app, dict(blocked_scope))
+        assert status_code == 429
+
+    async def blocked_legacy(i):
+        try:
+            await call_asgi(legacy_app, dict(blocked_scope))
+        except HTTPException:
+            # BaseHTTPMiddleware để lọt HTTPException ra ngoài (thành 500 trên server)
+            pass
+
+    rows.append(("429 qua HTTPException (cũ)", await measure_async(blocked_legacy, iterations)))
+    rows.append(("429 dựng sẵn (mới)", await measure_async(blocked_new, iterations)))
+    rate_limiter.max_requests = default_max_requests
+
+    print_table(f"Middleware overhead ({iterations} requests)", rows)
+    base = rows[0][1]["ops_per_sec"]
+    new = rows[1][1]["ops_per_sec"]
+    print(f"\nSpeedup (2xx path): {new / base:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations, args.clients))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmark: số round trip MongoDB và độ trễ của các route phòng, trước (cũ) và sau khi
+gộp thành find-and-modify / await song song.
+
+Đếm round trip bằng pymongo CommandListener trên client riêng; cần MongoDB thật
+(chênh lệch rõ nhất khi trỏ tới Atlas, nơi mỗi round trip tốn vài ms).
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_round_trips --mongodb-url mongodb://localhost:27017 --iterations 500
+"""
+import argparse
+import asyncio
+import itertools
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+import database
+from database import (
+    create_room, create_invitation_link, get_invitation_link, get_room, join_room,
+    leave_room, save_message, use_invitation_link, validate_invitation_link,
+)
+from models import InvitationLinkJoin, MessageRoom
+from routes.rooms import join_via_invite, join_chat_room, leave_chat_room, send_room_message
+from benchmarks.common import measure_async, print_table
+
+# Lệnh nội bộ của driver, không phải round trip do route gây ra
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue"}
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Đếm số lệnh gửi tới MongoDB"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# ============ LEGACY HANDLERS (trước khi gộp round trip) ============
+
+async def legacy_join_via_invite(invite_code: str, username: str):
+    is_valid, error = await validate_invitation_link(invite_code)
+    assert is_valid, error
+    link = await get_invitation_link(invite_code)
+    room_id = link.get("room_id")
+    room = await get_room(room_id)
+    assert room
+    await join_room(room_id, username)
+    await use_invitation_link(invite_code, username)
+    await save_message(sender="SYSTEM", room_id=room_id, content=f"{username} joined", message_type="SYSTEM")
+
+
+async def legacy_join_chat_room(room_id: str, username: str):
+    room = await get_room(room_id)
+    assert room
+    if await join_room(room_id, username):
+        await save_message(sender="SYSTEM", room_id=room_id, content=f"{username} joined", message_type="SYSTEM")
+
+
+async def legacy_leave_chat_room(room_id: str, username: str):
+    room = await get_room(room_id)
+    assert room
+    if await leave_room(room_id, username):
+        await save_message(sender="SYSTEM", room_id=room_id, content=f"{username} left", message_type="SYSTEM")
+
+
+async def legacy_send_room_message(room_id: str, sender: str):
+    room = await get_room(room_id)
+    assert sender in room.get("members", [])
+    await save_message(sender=sender, room_id=room_id, content="benchmark", message_type="TEXT")
+
+
+# ============ RUNNER ============
+
+async def measure_case(
+    counter: CommandCounter, func: Callable[[int], Awaitable[Any]], iterations: int, warmup: int
+) -> Dict[str, float]:
+    # Chỉ số tăng liên tục qua cả warmup để mỗi lần gọi dùng username mới
+    sequence = itertools.count()
+    before = counter.count
+    result = await measure_async(lambda i: func(next(sequence)), iterations, warmup=warmup)
+    result["round_trips"] = (counter.count - before) / (iterations + warmup)
+    return result
+
+
+async def run(args: argparse.Namespace):
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(args.mongodb_url, event_listeners=[counter])
+    db_name = f"realchat_bench_{uuid.uuid4().hex[:8]}"
+    database.db.client = client
+    database.db.db = client[db_name]
+    await database.db._create_indexes()
+
+    total = args.iterations + args.warmup
+    owner = "bench_owner"
+    room = await create_room(f"Bench {db_name}", owner, members=[owner])
+    room_id = str(room["_id"])
+    link = await create_invitation_link(room_id, room["room_name"], owner, owner, expires_in_hours=24)
+    code = link["invite_code"]
+
+    cases: List[Tuple[str, Callable[[int], Awaitable[Any]], Callable[[int], Awaitable[Any]]]] = [
+        (
+            "POST /invite/join",
+            lambda i: legacy_join_via_invite(code, f"legacy_invite_{i}"),
+            lambda i: join_via_invite(InvitationLinkJoin(invite_code=code, username=f"new_invite_{i}")),
+        ),
+        (
+            "POST /{room_id}/join",
+            lambda i: legacy_join_chat_room(room_id, f"legacy_member_{i}"),
+            lambda i: join_chat_room(room_id, f"new_member_{i}"),
+        ),
+        (
+            "POST /{room_id}/leave",
+            lambda i: legacy_leave_chat_room(room_id, f"legacy_member_{i}"),
+            lambda i: leave_chat_room(room_id, f"new_member_{i}"),
+        ),
+        (
+            "POST /{room_id}/messages",
+            lambda i: legacy_send_room_message(room_id, owner),
+            lambda i: send_room_message(room_id, MessageRoom(room_id=room_id, sender=owner, content="benchmark")),
+        ),
+    ]
+
+    summary = []
+    try:
+        for name, legacy, new in cases:
+            legacy_result = await measure_case(counter, legacy, args.iterations, args.warmup)
+            new_result = await measure_case(counter, new, args.iterations, args.warmup)
+            print_table(f"{name} ({total} calls each)", [("before", legacy_result), ("after", new_result)])
+            summary.append((name, legacy_result, new_result))
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+    print(f"\n{'endpoint':<28}{'RT before':>10}{'RT after':>10}{'p50 before':>12}{'p50 after':>11}")
+    for name, legacy_result, new_result in summary:
+        print(
+            f"{name:<28}{legacy_result['round_trips']:>10.1f}{new_result['round_trips']:>10.1f}"
+            f"{legacy_result['p50_ms']:>12.3f}{new_result['p50_ms']:>11.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-url", default="mongodb://localhost:27017")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark: search index - tốc độ chuẩn hóa/tách từ, tốc độ index và độ trễ truy vấn
+trên hàng triệu tin nhắn tiếng Việt tổng hợp (từ vựng phân bố Zipf, có dấu).
+
+Phần tách từ chạy không cần MongoDB (--tokenize-only); phần index/truy vấn cần MongoDB thật.
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_search --mongodb-url mongodb://localhost:27017 \
+        --messages 1000000 --rooms 100 --queries 500
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import database
+from config import settings
+from database import _search_index_messages, search_messages
+from search import tokenize
+from benchmarks.common import measure_async, measure_sync, print_table
+
+SYLLABLES = (
+    "anh em chị bạn tôi mình người việt nam tiếng nói học làm việc đi về nhà trường công ty "
+    "hôm nay ngày mai sáng chiều tối đêm ăn uống cà phê trà sữa cơm phở bún bánh mì gặp hẹn "
+    "được không có rồi chưa nhé nha ạ vâng dạ ừ thôi xong đẹp vui buồn nhanh chậm mới cũ lớn "
+    "nhỏ nhiều ít quá lắm rất hơn nhất cuộc họp dự án báo cáo khách hàng đơn hàng giao nhận "
+    "thanh toán chuyển khoản điện thoại máy tính mạng lỗi sửa cập nhật phiên bản đường phố "
+    "quận huyện thành phố hà nội sài gòn đà nẵng huế cần thơ hải phòng biển núi sông hồ"
+).split()
+
+
+class Corpus:
+    """Sinh câu tiếng Việt: từ phổ biến xuất hiện nhiều hơn (trọng số 1/rank)"""
+
+    def __init__(self, seed: int = 42):
+        self.random = random.Random(seed)
+        self.weights = [1 / (rank + 1) for rank in range(len(SYLLABLES))]
+
+    def sentence(self) -> str:
+        words = self.random.choices(SYLLABLES, self.weights, k=self.random.randint(4, 20))
+        return " ".join(words).capitalize()
+
+
+def make_messages(corpus: Corpus, rooms: List[ObjectId], count: int, started: datetime) -> List[Dict[str, Any]]:
+    return [
+        {
+            "_id": ObjectId(),
+            "sender": f"user{i % 50}",
+            "recipient": None,
+            "room_id": rooms[i % len(rooms)],
+            "content": corpus.sentence(),
+            "message_type": "TEXT",
+            "is_read": False,
+            "timestamp": started + timedelta(milliseconds=i),
+        }
+        for i in range(count)
+    ]
+
+
+def bench_tokenize(corpus: Corpus, iterations: int):
+    sentences = [corpus.sentence() for _ in range(10000)]
+    result = measure_sync(lambda i: tokenize(sentences[i % len(sentences)]), iterations)
+    print_table("Tokenize + fold (no database)", [("tokenize(sentence)", result)])
+
+
+async def run(args: argparse.Namespace):
+    corpus = Corpus()
+    bench_tokenize(corpus, 200000)
+    if args.tokenize_only:
+        return
+
+    client = AsyncIOMotorClient(args.mongodb_url)
+    db_name = f"realchat_bench_{uuid.uuid4().hex[:8]}"
+    database.db.client = client
+    database.db.db = client[db_name]
+    await database.db._create_indexes()
+    settings.SEARCH_ENABLED = True
+
+    rooms = [ObjectId() for _ in range(args.rooms)]
+    started = datetime.now(timezone.utc) - timedelta(days=30)
+    try:
+        # Index theo lô (như rebuild_search_index), ghi kèm tin nhắn để truy vấn lấy được nội dung
+        indexed = 0
+        index_seconds = 0.0
+        while indexed < args.messages:
+            batch = make_messages(corpus, rooms, min(args.batch, args.messages - indexed), started + timedelta(seconds=indexed))
+            await database.db.db["messages"].insert_many(batch)
+            t0 = time.perf_counter()
+            await _search_index_messages(batch)
+            index_seconds += time.perf_counter() - t0
+            indexed += len(batch)
+            if indexed % (args.batch * 100) == 0:
+                print(f"  indexed {indexed} messages ({indexed / index_seconds:.0f} msg/s)")
+        print(f"\nBatch indexing: {indexed} messages in {index_seconds:.1f}s -> {indexed / index_seconds:.0f} msg/s")
+
+        # Index từng tin (đường save_message)
+        singles = make_messages(corpus, rooms, args.single + 50, datetime.now(timezone.utc))
+        single = await measure_async(lambda i: _search_index_messages([singles[i]]), args.single, warmup=50)
+        print_table("Incremental indexing (one message per call)", [("_search_index_messages([m])", single)])
+
+        stats = await database.db.db.command("collStats", "search_postings")
+        print(
+            f"\nsearch_postings: {stats.get('count', 0)} postings, data {stats.get('size', 0) / 1048576:.1f} MB, "
+            f"indexes {stats.get('totalIndexSize', 0) / 1048576:.1f} MB"
+        )
+
+        scopes = [f"room:{room_id}" for room_id in rooms]
+        rng = random.Random(7)
+        queries = {
+            "1 common term": lambda: SYLLABLES[rng.randint(0, 4)],
+            "1 rare term": lambda: SYLLABLES[rng.randint(len(SYLLABLES) - 20, len(SYLLABLES) - 1)],
+            "2 terms (folded)": lambda: f"{rng.choice(SYLLABLES[:30])} {rng.choice(SYLLABLES[30:])}",
+            "3 terms (folded)": lambda: " ".join(rng.sample(SYLLABLES[:60], 3)),
+        }
+        rows = []
+        for name, make_query in queries.items():
+            async def query(i, make_query=make_query):
+                await search_messages(rng.choice(scopes), make_query(), settings.SEARCH_PAGE_SIZE)
+            rows.append((name, await measure_async(query, args.queries, warmup=20)))
+        print_table(f"Query latency ({args.messages} messages, {args.rooms} rooms, page {settings.SEARCH_PAGE_SIZE})", rows)
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-url", default="mongodb://localhost:27017")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=settings.SEARCH_REBUILD_BATCH_SIZE)
+    parser.add_argument("--single", type=int, default=2000, help="Số lần index từng tin riêng lẻ")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--tokenize-only", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: serialize lịch sử tin nhắn qua response_model (cũ) so với FastJSONResponse (mới)
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_serialization --sizes 50 500 5000
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from bson.objectid import ObjectId
+from fastapi import FastAPI
+
+from models import MessageResponse
+from responses import FastJSONResponse
+from utils import format_message_response
+from benchmarks.common import call_asgi, make_scope, measure_async, print_table
+
+
+def make_messages(count: int) -> List[Dict[str, Any]]:
+    """Tạo document tin nhắn giống dữ liệu đọc từ Mongo"""
+    room_id = ObjectId()
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "_id": ObjectId(),
+            "sender": f"user{i % 20}",
+            "recipient": None,
+            "room_id": room_id,
+            "content": f"Tin nhắn thử nghiệm số {i} - tiếng Việt có dấu",
+            "message_type": "TEXT",
+            "is_read": bool(i % 2),
+            "timestamp": start + timedelta(seconds=i),
+        }
+        for i in range(count)
+    ]
+
+
+def build_app(messages: List[Dict[str, Any]]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/legacy", response_model=List[MessageResponse])
+    async def legacy():
+        return [format_message_response(m) for m in messages]
+
+    @app.get("/fast", response_model=List[MessageResponse])
+    async def fast():
+        return FastJSONResponse([format_message_response(m) for m in messages])
+
+    return app
+
+
+async def run(sizes: List[int], iterations: int):
+    for size in sizes:
+        app = build_app(make_messages(size))
+        legacy_scope = make_scope("GET", "/legacy")
+        fast_scope = make_scope("GET", "/fast")
+
+        # Hai đường phải trả về cùng một payload
+        _, _, legacy_body = await call_asgi(app, dict(legacy_scope))
+        _, _, fast_body = await call_asgi(app, dict(fast_scope))
+        assert json.loads(legacy_body) == json.loads(fast_body)
+
+        async def legacy_path(i):
+            await call_asgi(app, dict(legacy_scope))
+
+        async def fast_path(i):
+            await call_asgi(app, dict(fast_scope))
+
+        runs = max(10, iterations // size)
+        rows = [
+            ("response_model + jsonable_encoder", await measure_async(legacy_path, runs, warmup=5)),
+            ("FastJSONResponse (orjson)", await measure_async(fast_path, runs, warmup=5)),
+        ]
+        print_table(f"History response, {size} messages ({runs} requests)", rows)
+        print(f"Speedup: {rows[1][1]['ops_per_sec'] / rows[0][1]['ops_per_sec']:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--iterations", type=int, default=200000, help="Tổng số message serialize mỗi case")
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
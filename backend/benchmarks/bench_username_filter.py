@@ -0,0 +1,90 @@
+"""
+Benchmark: username Bloom filter ở quy mô 1 triệu user - bộ nhớ, tỉ lệ false positive,
+thời gian build và lookup, so với set() Python chứa cùng username.
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_username_filter --users 1000000 --probes 1000000 --fp-rate 0.01
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Dict, List
+
+from username_filter import BloomFilter
+
+
+def make_usernames(prefix: str, count: int) -> List[str]:
+    return [f"{prefix}{i:07d}" for i in range(count)]
+
+
+def bench_bloom(users: List[str], absent: List[str], fp_rate: float) -> Dict[str, float]:
+    started = time.perf_counter()
+    bloom = BloomFilter(len(users), fp_rate)
+    for name in users:
+        bloom.add(name)
+    build_s = time.perf_counter() - started
+
+    # Không được có false negative
+    assert all(name in bloom for name in users[:10000])
+
+    started = time.perf_counter()
+    false_positives = sum(1 for name in absent if name in bloom)
+    lookup_s = time.perf_counter() - started
+    return {
+        "bytes": bloom.memory_bytes,
+        "hashes": bloom.hashes,
+        "build_s": build_s,
+        "lookup_ns": lookup_s / len(absent) * 1e9,
+        "fp_rate": false_positives / len(absent),
+    }
+
+
+def bench_set(users: List[str], absent: List[str]) -> Dict[str, float]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    # Copy chuỗi để đo cả bộ nhớ của chính username (như khi nạp từ MongoDB)
+    names = {"".join(name) for name in users}
+    build_s = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    sum(1 for name in absent if name in names)
+    lookup_s = time.perf_counter() - started
+    return {
+        "bytes": current,
+        "build_s": build_s,
+        "lookup_ns": lookup_s / len(absent) * 1e9,
+        "fp_rate": 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--probes", type=int, default=1_000_000, help="Số username không tồn tại dùng để đo false positive")
+    parser.add_argument("--fp-rate", type=float, nargs="+", default=[0.01, 0.001])
+    args = parser.parse_args()
+
+    users = make_usernames("user", args.users)
+    absent = make_usernames("ghost", args.probes)
+    print(f"{args.users} users, {args.probes} absent probes")
+    print(f"\n{'structure':<22}{'memory MB':>12}{'build s':>10}{'lookup ns':>12}{'measured FP':>14}")
+
+    for fp_rate in args.fp_rate:
+        result = bench_bloom(users, absent, fp_rate)
+        label = f"bloom p={fp_rate} k={result['hashes']}"
+        print(
+            f"{label:<22}{result['bytes'] / 1048576:>12.2f}"
+            f"{result['build_s']:>10.2f}{result['lookup_ns']:>12.0f}{result['fp_rate']:>14.4%}"
+        )
+
+    result = bench_set(users, absent)
+    print(
+        f"{'set() (exact)':<22}{result['bytes'] / 1048576:>12.2f}"
+        f"{result['build_s']:>10.2f}{result['lookup_ns']:>12.0f}{result['fp_rate']:>14.4%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
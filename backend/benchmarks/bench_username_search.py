@@ -0,0 +1,88 @@
+"""
+Benchmark: prefix username index ở quy mô 1 triệu user - bộ nhớ, thời gian build và độ trễ
+top-K, so với lọc tuần tự cả danh sách (cách client đang làm với GET /api/users/).
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_username_search --users 1000000 --queries 100000 --limit 10
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from typing import List
+
+from search import fold
+from username_index import UsernameIndex
+from benchmarks.common import measure_sync, print_table
+
+GIVEN_NAMES = ["an", "bình", "châu", "dũng", "đức", "giang", "hà", "hùng", "khánh", "linh",
+               "minh", "nam", "ngọc", "phúc", "quân", "sơn", "thảo", "trang", "tuấn", "vy"]
+
+
+def make_usernames(count: int, seed: int = 42) -> List[str]:
+    """Username kiểu thực tế: tên tiếng Việt (có dấu, hoa/thường) hoặc ascii + số"""
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        base = rng.choice(GIVEN_NAMES)
+        if i % 3 == 0:
+            base = base.capitalize()
+        elif i % 3 == 1:
+            base = fold(base)
+        names.append(f"{base}_{i:07d}"[:20])
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    usernames = make_usernames(args.users)
+    started = time.perf_counter()
+    UsernameIndex().reset(usernames)
+    build_s = time.perf_counter() - started
+
+    # Đo bộ nhớ ở lần build riêng (tracemalloc làm chậm đáng kể)
+    tracemalloc.start()
+    index = UsernameIndex()
+    index.reset(usernames)
+    traced_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.users} users: build {build_s:.2f}s, memory {traced_bytes / 1048576:.1f} MB "
+          f"(traced), {index.bytes / 1048576:.1f} MB (index estimate), "
+          f"{traced_bytes / args.users:.0f} B/user")
+
+    rng = random.Random(7)
+    prefixes = {
+        length: [fold(rng.choice(usernames))[:length] for _ in range(1000)]
+        for length in (1, 2, 3, 5)
+    }
+    rows = []
+    for length, queries in prefixes.items():
+        rows.append((f"index, prefix len {length}", measure_sync(
+            lambda i, queries=queries: index.search(queries[i % len(queries)], args.limit), args.queries
+        )))
+    rows.append(("index, diacritic query 'Đức'", measure_sync(lambda i: index.search("Đức", args.limit), args.queries)))
+
+    # Cách hiện tại: duyệt toàn bộ danh sách (ít lần hơn vì rất chậm)
+    folded = [fold(name) for name in usernames]
+    scans = max(1, min(args.queries // 1000, 50))
+    rows.append(("linear scan, prefix len 3", measure_sync(
+        lambda i: [n for n, f in zip(usernames, folded) if f.startswith(prefixes[3][i % 1000])][:args.limit],
+        scans, warmup=1,
+    )))
+    print_table(f"Top-{args.limit} prefix search", rows)
+
+    # Chèn user mới (create_user)
+    extra = make_usernames(10000, seed=99)
+    started = time.perf_counter()
+    for name in extra:
+        index.add(name + "x")
+    print(f"\nInsert into {len(index)}-entry index: {(time.perf_counter() - started) / len(extra) * 1e6:.1f} us/user")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Tiện ích dùng chung cho các benchmark (gọi ASGI app trực tiếp, không cần server)
+"""
+import asyncio
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+def make_scope(
+    method: str = "GET",
+    path: str = "/",
+    headers: Optional[Iterable[Tuple[bytes, bytes]]] = None,
+    client: Tuple[str, int] = ("127.0.0.1", 50000),
+    query_string: bytes = b"",
+) -> Dict[str, Any]:
+    """Tạo ASGI HTTP scope tối thiểu"""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("latin-1"),
+        "query_string": query_string,
+        "root_path": "",
+        "headers": list(headers or []),
+        "client": client,
+        "server": ("127.0.0.1", 8000),
+    }
+
+
+async def call_asgi(app, scope: Dict[str, Any], body: bytes = b"") -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """Gọi ASGI app một lần, trả về (status, headers, body)"""
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Không bao giờ disconnect trong benchmark
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    status_code = 0
+    response_headers: List[Tuple[bytes, bytes]] = []
+    chunks: List[bytes] = []
+
+    async def send(message):
+        nonlocal status_code, response_headers
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+            response_headers = list(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status_code, response_headers, b"".join(chunks)
+
+
+async def measure_async(
+    func: Callable[[int], Awaitable[Any]], iterations: int, warmup: int = 200
+) -> Dict[str, float]:
+    """Chạy func(i) tuần tự, trả về throughput và phân vị độ trễ (ms)"""
+    for i in range(warmup):
+        await func(i)
+
+    samples: List[float] = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        await func(i)
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return summarize(samples, elapsed)
+
+
+def measure_sync(func: Callable[[int], Any], iterations: int, warmup: int = 50) -> Dict[str, float]:
+    """Phiên bản đồng bộ của measure_async"""
+    for i in range(warmup):
+        func(i)
+
+    samples: List[float] = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return summarize(samples, elapsed)
+
+
+def percentile(sorted_samples: List[float], pct: float) -> float:
+    """Phân vị theo nearest-rank trên danh sách đã sắp xếp"""
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, int(round(pct / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+def summarize(samples: List[float], elapsed: float) -> Dict[str, float]:
+    """Tổng hợp mẫu thời gian (giây) thành ops/s và p50/p95/p99 (ms)"""
+    ordered = sorted(samples)
+    return {
+        "count": len(samples),
+        "ops_per_sec": len(samples) / elapsed if elapsed > 0 else 0.0,
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p95_ms": percentile(ordered, 95) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+    }
+
+
+def print_table(title: str, rows: List[Tuple[str, Dict[str, float]]]):
+    """In bảng kết quả"""
+    print(f"\n{title}")
+    print(f"{'case':<40}{'ops/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in rows:
+        print(
+            f"{name:<40}{result['ops_per_sec']:>12.0f}{result['p50_ms']:>10.3f}"
+            f"{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}"
+        )
@@ -0,0 +1,315 @@
+"""
+WebSocket soak harness: mở hàng nghìn client tới /api/messages/ws/{username},
+bơm traffic 1-1 và phòng, đo độ trễ gửi→nhận và theo dõi RSS/ConnectionManager.
+
+Server + mongod phải đang chạy (nên nâng rate limit và ulimit -n):
+    ulimit -n 65535
+    RATE_LIMIT_MAX_REQUESTS=100000000 python -m uvicorn main:app --port 8000
+
+Chạy từ thư mục backend:
+    python -m benchmarks.ws_soak --clients 5000 --duration 120 \\
+        --private-rate 200 --room-rate 20 --server-pid $(pgrep -f "uvicorn main:app")
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.common import summarize
+
+
+def read_rss_bytes(pid: int) -> Optional[int]:
+    """RSS hiện tại của process (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class SoakClient:
+    """Một WebSocket client mô phỏng"""
+
+    def __init__(self, harness: "SoakHarness", username: str):
+        self.harness = harness
+        self.username = username
+        self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self.reader: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        self.ws = await self.harness.session.ws_connect(
+            f"{self.harness.ws_url}/api/messages/ws/{self.username}", heartbeat=None
+        )
+        self.reader = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            self.harness.on_message(json.loads(msg.data))
+
+    async def send_private(self, recipient: str, soak_id: str):
+        await self.ws.send_json({
+            "type": "message",
+            "recipient": recipient,
+            "content": "soak",
+            "soak_id": soak_id,
+        })
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await asyncio.gather(self.reader, return_exceptions=True)
+
+
+class SoakHarness:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.base_url = args.base_url.rstrip("/")
+        self.ws_url = self.base_url.replace("http://", "ws://").replace("https://", "wss://")
+        self.run_id = uuid.uuid4().hex[:6]
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.clients: List[SoakClient] = []
+        self.usernames = [f"sk{self.run_id}u{i}" for i in range(max(2, args.users or args.clients))]
+        self.room_ids: List[str] = []
+        self.room_members: Dict[str, List[str]] = {}
+
+        self.pending: Dict[str, float] = {}
+        self.private_latency: List[float] = []
+        self.room_latency: List[float] = []
+        self.sent = {"private": 0, "room": 0}
+        self.received = {"private": 0, "room": 0}
+        self.errors: Dict[str, int] = {"connect": 0, "send": 0}
+        self.timeline: List[Dict[str, Any]] = []
+        self.started = time.perf_counter()
+
+    # ---------- message tracking ----------
+
+    def on_message(self, data: Dict[str, Any]):
+        now = time.perf_counter()
+        soak_id = data.get("soak_id")
+        if soak_id is not None:
+            sent_at = self.pending.get(soak_id)
+            if sent_at is not None:
+                self.private_latency.append(now - sent_at)
+                self.received["private"] += 1
+            return
+        content = data.get("content") or ""
+        if data.get("type") == "room_message" and content.startswith("soak:"):
+            sent_at = self.pending.get(content)
+            if sent_at is not None:
+                self.room_latency.append(now - sent_at)
+                self.received["room"] += 1
+
+    # ---------- setup ----------
+
+    async def setup(self):
+        connector = aiohttp.TCPConnector(limit=0)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+        rooms = max(1, self.args.rooms)
+        for i in range(rooms):
+            members = random.sample(self.usernames, min(self.args.room_size, len(self.usernames)))
+            async with self.session.post(
+                f"{self.base_url}/api/rooms/?username={members[0]}",
+                json={"room_name": f"Soak {self.run_id} {i}", "members": members},
+            ) as response:
+                if response.status == 201:
+                    room = await response.json()
+                    self.room_ids.append(room["_id"])
+                    self.room_members[room["_id"]] = room["members"]
+        print(f"→ Created {len(self.room_ids)} rooms ({self.args.room_size} members each)")
+
+        # Ramp up kết nối theo --ramp (connections/s)
+        semaphore = asyncio.Semaphore(self.args.connect_concurrency)
+        interval = 1.0 / self.args.ramp if self.args.ramp > 0 else 0.0
+
+        async def open_client(index: int):
+            client = SoakClient(self, self.usernames[index % len(self.usernames)])
+            async with semaphore:
+                try:
+                    await client.connect()
+                    self.clients.append(client)
+                except Exception:
+                    self.errors["connect"] += 1
+
+        tasks = []
+        for i in range(self.args.clients):
+            tasks.append(asyncio.create_task(open_client(i)))
+            if interval:
+                await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+        print(f"→ Connected {len(self.clients)}/{self.args.clients} clients ({self.errors['connect']} failed)")
+
+    # ---------- traffic ----------
+
+    async def private_traffic(self, deadline: float):
+        if self.args.private_rate <= 0 or len(self.clients) < 2:
+            return
+        interval = 1.0 / self.args.private_rate
+        seq = 0
+        while time.perf_counter() < deadline:
+            sender = random.choice(self.clients)
+            recipient = random.choice(self.usernames)
+            soak_id = f"p{seq}"
+            seq += 1
+            self.pending[soak_id] = time.perf_counter()
+            try:
+                await sender.send_private(recipient, soak_id)
+                self.sent["private"] += 1
+            except Exception:
+                self.errors["send"] += 1
+            await asyncio.sleep(interval)
+
+    async def room_traffic(self, deadline: float):
+        if self.args.room_rate <= 0 or not self.room_ids:
+            return
+        interval = 1.0 / self.args.room_rate
+        seq = 0
+
+        async def post(room_id: str, content: str):
+            sender = random.choice(self.room_members[room_id])
+            self.pending[content] = time.perf_counter()
+            try:
+                async with self.session.post(
+                    f"{self.base_url}/api/rooms/{room_id}/messages",
+                    json={"room_id": room_id, "sender": sender, "content": content},
+                ) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        self.errors["send"] += 1
+                        return
+                self.sent["room"] += 1
+            except Exception:
+                self.errors["send"] += 1
+
+        tasks = []
+        while time.perf_counter() < deadline:
+            tasks.append(asyncio.create_task(post(random.choice(self.room_ids), f"soak:{self.run_id}:{seq}")))
+            seq += 1
+            await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+
+    async def sample(self):
+        """Lấy mẫu RSS server và kích thước ConnectionManager"""
+        point: Dict[str, Any] = {
+            "t": round(time.perf_counter() - self.started, 2),
+            "client_sockets": len(self.clients),
+            "sent": dict(self.sent),
+            "received": dict(self.received),
+        }
+        if self.args.server_pid:
+            point["server_rss_bytes"] = read_rss_bytes(self.args.server_pid)
+        try:
+            async with self.session.get(f"{self.base_url}/health") as response:
+                health = await response.json()
+                point["manager"] = health.get("websocket")
+        except Exception:
+            point["manager"] = None
+        self.timeline.append(point)
+        rss = point.get("server_rss_bytes")
+        print(
+            f"  t={point['t']:>7}s manager={point['manager']} "
+            f"rss={rss / 1048576 if rss else 0:.1f}MB sent={self.sent} received={self.received}"
+        )
+
+    async def sampler(self, stop: asyncio.Event):
+        while not stop.is_set():
+            await self.sample()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.args.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> Dict[str, Any]:
+        await self.setup()
+        await self.sample()
+        baseline_manager = self.timeline[0].get("manager")
+
+        stop = asyncio.Event()
+        sampler_task = asyncio.create_task(self.sampler(stop))
+        deadline = time.perf_counter() + self.args.duration
+        await asyncio.gather(self.private_traffic(deadline), self.room_traffic(deadline))
+        await asyncio.sleep(self.args.drain)
+        stop.set()
+        await sampler_task
+
+        # Đóng hết client và kiểm tra ConnectionManager có về 0 không (phát hiện leak)
+        await asyncio.gather(*[client.close() for client in self.clients])
+        self.clients = []
+        await asyncio.sleep(1.0)
+        await self.sample()
+        await self.session.close()
+
+        return {
+            "meta": {
+                "clients": self.args.clients,
+                "users": len(self.usernames),
+                "rooms": len(self.room_ids),
+                "room_size": self.args.room_size,
+                "duration_s": self.args.duration,
+                "private_rate": self.args.private_rate,
+                "room_rate": self.args.room_rate,
+            },
+            "private_latency": summarize(self.private_latency, self.args.duration),
+            "room_latency": summarize(self.room_latency, self.args.duration),
+            "sent": self.sent,
+            "received": self.received,
+            "errors": self.errors,
+            "manager_before": baseline_manager,
+            "manager_after_close": self.timeline[-1].get("manager"),
+            "timeline": self.timeline,
+        }
+
+
+def print_report(report: Dict[str, Any]):
+    print("\nLatency (send → receive)")
+    print(f"{'traffic':<10}{'deliveries':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in ("private", "room"):
+        stats = report[f"{name}_latency"]
+        print(f"{name:<10}{stats['count']:>12}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    print(f"\nErrors: {report['errors']}")
+    print(f"ConnectionManager before: {report['manager_before']}  after close: {report['manager_after_close']}")
+    after = report["manager_after_close"] or {}
+    before = report["manager_before"] or {}
+    if after.get("sockets", 0) > before.get("sockets", 0):
+        print("⚠️  Socket count did not return to baseline - possible connection leak")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--clients", type=int, default=1000, help="Số WebSocket client")
+    parser.add_argument("--users", type=int, default=0, help="Số username khác nhau (mặc định = clients)")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--room-size", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--private-rate", type=float, default=100.0, help="Tin nhắn 1-1 mỗi giây")
+    parser.add_argument("--room-rate", type=float, default=10.0, help="Tin nhắn phòng mỗi giây")
+    parser.add_argument("--ramp", type=float, default=500.0, help="Kết nối mới mỗi giây (0 = không giới hạn)")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--sample-interval", type=float, default=5.0)
+    parser.add_argument("--drain", type=float, default=2.0, help="Số giây chờ tin nhắn cuối tới nơi")
+    parser.add_argument("--server-pid", type=int, help="PID server để đọc RSS từ /proc")
+    parser.add_argument("--output", help="Ghi kết quả JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(SoakHarness(args).run())
+    print_report(report)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
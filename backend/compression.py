@@ -0,0 +1,219 @@
+"""
+Compression Middleware cho RealChat - gzip/brotli theo Accept-Encoding
+
+- Chỉ nén response JSON/text lớn hơn COMPRESSION_MIN_SIZE
+- Response có ETag được cache bytes đã nén (LRU), nên trang lịch sử phòng
+  đang "nóng" không bị nén lại mỗi request
+- Thống kê CPU và tỉ lệ nén nằm trong compression_stats
+"""
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+from metrics import registry
+import gzip
+import time
+
+try:
+    import brotli
+except ImportError:  # brotli là tùy chọn, fallback về gzip
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Chọn encoding tốt nhất client chấp nhận (br > gzip), bỏ qua q=0"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        token, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(token.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionStats:
+    """Bộ đếm thống kê nén (xuất qua /metrics)"""
+
+    def __init__(self):
+        self.responses: Dict[str, int] = defaultdict(int)
+        self.bytes_in: Dict[str, int] = defaultdict(int)
+        self.bytes_out: Dict[str, int] = defaultdict(int)
+        self.cpu_seconds: Dict[str, float] = defaultdict(float)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.skipped = 0
+
+    def record(self, encoding: str, size_in: int, size_out: int, cpu_seconds: float):
+        self.responses[encoding] += 1
+        self.bytes_in[encoding] += size_in
+        self.bytes_out[encoding] += size_out
+        self.cpu_seconds[encoding] += cpu_seconds
+
+    def ratio(self, encoding: str) -> float:
+        """Tỉ lệ nén trung bình (bytes gốc / bytes nén)"""
+        out = self.bytes_out.get(encoding, 0)
+        return self.bytes_in.get(encoding, 0) / out if out else 0.0
+
+
+compression_stats = CompressionStats()
+
+registry.counter(
+    "realchat_compression_responses_total", "Responses compressed", ("encoding",),
+    callback=lambda: {(enc,): n for enc, n in compression_stats.responses.items()},
+)
+registry.counter(
+    "realchat_compression_bytes_in_total", "Uncompressed bytes fed to the compressor", ("encoding",),
+    callback=lambda: {(enc,): n for enc, n in compression_stats.bytes_in.items()},
+)
+registry.counter(
+    "realchat_compression_bytes_out_total", "Compressed bytes produced", ("encoding",),
+    callback=lambda: {(enc,): n for enc, n in compression_stats.bytes_out.items()},
+)
+registry.counter(
+    "realchat_compression_cpu_seconds_total", "Time spent compressing", ("encoding",),
+    callback=lambda: {(enc,): n for enc, n in compression_stats.cpu_seconds.items()},
+)
+registry.gauge(
+    "realchat_compression_ratio", "Average compression ratio (input/output bytes)", ("encoding",),
+    callback=lambda: {(enc,): compression_stats.ratio(enc) for enc in compression_stats.responses},
+)
+registry.counter(
+    "realchat_compression_cache_total", "Compressed body cache lookups", ("result",),
+    callback=lambda: {("hit",): compression_stats.cache_hits, ("miss",): compression_stats.cache_misses},
+)
+
+
+class CompressedBodyCache:
+    """LRU cache bytes đã nén, key theo (path, query, ETag, encoding)"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, bytes, bytes, str], bytes]" = OrderedDict()
+
+    def get(self, key) -> Optional[bytes]:
+        body = self._entries.get(key)
+        if body is not None:
+            self._entries.move_to_end(key)
+        return body
+
+    def put(self, key, body: bytes):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = body
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CompressionMiddleware:
+    """Nén response theo Accept-Encoding (ASGI thuần)"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, cache_size: int = 256):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = CompressedBodyCache(cache_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False):
+                # Streaming response: không buffer, gửi nguyên trạng
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            headers: List[Tuple[bytes, bytes]] = list(start_message.get("headers", []))
+            if not self._should_compress(start_message["status"], headers, body):
+                compression_stats.skipped += 1
+                await send(start_message)
+                await send(message)
+                return
+
+            etag = next((value for name, value in headers if name.lower() == b"etag"), None)
+            cache_key = None
+            compressed = None
+            if etag is not None:
+                cache_key = (scope["path"], scope.get("query_string", b""), etag, encoding)
+                compressed = self.cache.get(cache_key)
+
+            if compressed is not None:
+                compression_stats.cache_hits += 1
+            else:
+                started = time.perf_counter()
+                compressed = _compress(body, encoding)
+                compression_stats.record(encoding, len(body), len(compressed), time.perf_counter() - started)
+                if cache_key is not None:
+                    compression_stats.cache_misses += 1
+                    self.cache.put(cache_key, compressed)
+
+            vary = [value for name, value in headers if name.lower() == b"vary"]
+            vary.append(b"Accept-Encoding")
+            headers = [
+                (name, value) for name, value in headers
+                if name.lower() not in (b"content-length", b"vary")
+            ]
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+            headers.append((b"vary", b", ".join(vary)))
+            start_message["headers"] = headers
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _should_compress(self, status_code: int, headers: List[Tuple[bytes, bytes]], body: bytes) -> bool:
+        if status_code != 200 or len(body) < self.minimum_size:
+            return False
+        content_type = b""
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered == b"content-encoding":
+                return False
+            if lowered == b"content-type":
+                content_type = value
+        return content_type.startswith(COMPRESSIBLE_TYPES)
@@ -1,15 +1,26 @@
 """
 Cấu hình cho ứng dụng RealChat
 """
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Literal, Optional
 
 
 class Settings(BaseSettings):
     """Cài đặt ứng dụng"""
     
-    # MongoDB Atlas - Load from environment variables
-    MONGODB_URL: str
+    # Storage engine: "mongodb", "sqlite" (file SQLite nhúng, cho triển khai nhỏ một máy)
+    # hoặc "memory" (trong bộ nhớ, không cần database; dev / đo overhead API)
+    STORAGE_ENGINE: Literal["mongodb", "sqlite", "memory"] = "mongodb"
+    
+    # SQLite (STORAGE_ENGINE="sqlite"): file database, số connection đọc,
+    # số thao tác ghi tối đa gom vào một transaction
+    SQLITE_PATH: str = "realchat.db"
+    SQLITE_READ_CONNECTIONS: int = 4
+    SQLITE_WRITE_BATCH_SIZE: int = 256
+    
+    # MongoDB Atlas - Load from environment variables (bắt buộc với STORAGE_ENGINE="mongodb")
+    MONGODB_URL: Optional[str] = None
     DATABASE_NAME: str = "realchat_db"
     
     # JWT - Load from environment variables
@@ -21,6 +32,92 @@ class Settings(BaseSettings):
     HOST: str = "127.0.0.1"
     PORT: int = 8000
     DEBUG: bool = True
+    # Số worker process (python main.py; bỏ qua khi DEBUG reload). Chỉ hỗ trợ 1: ETag, room cache,
+    # replay buffer, offline queue, socket đang kết nối và horizon của sync nằm trong bộ nhớ process
+    WORKERS: int = 1
+    
+    # Rate limiting (theo IP)
+    RATE_LIMIT_MAX_REQUESTS: int = 100
+    RATE_LIMIT_WINDOW: int = 60  # seconds
+    
+    # Compression (gzip/brotli cho response lớn)
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024  # bytes
+    COMPRESSION_CACHE_SIZE: int = 256  # số response nén được cache
+    
+    # Event loop monitor (lag + phát hiện code blocking)
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL_MS: int = 100
+    LOOP_BLOCK_THRESHOLD_MS: int = 200
+    
+    # Gửi tin nhắn theo lô (POST /api/messages/send-batch)
+    MESSAGE_BATCH_MAX_SIZE: int = 5000  # số tin tối đa mỗi request
+    
+    # Thêm / xóa thành viên phòng hàng loạt (POST /api/rooms/{room_id}/members/import|remove)
+    ROOM_MEMBERS_BULK_MAX_SIZE: int = 10000  # số username tối đa mỗi request
+    
+    # Room history cache (ring buffer tin nhắn mới nhất của phòng, LRU theo phòng)
+    ROOM_CACHE_ENABLED: bool = True
+    ROOM_CACHE_MESSAGES_PER_ROOM: int = 100
+    ROOM_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    
+    # Lưu trữ tin nhắn phòng: "document" (mỗi tin một document) hoặc "bucketed"
+    # (nối vào document bucket của phòng; chuyển dữ liệu cũ bằng migrate_message_buckets.py)
+    MESSAGE_STORAGE: Literal["document", "bucketed"] = "document"
+    MESSAGE_BUCKET_SIZE: int = 200  # số tin tối đa mỗi bucket
+    MESSAGE_BUCKET_SPAN_HOURS: int = 24  # khoảng thời gian tối đa mỗi bucket
+    
+    # Archive tin nhắn cũ sang "message_archive" (nén), lịch sử tự đọc tiếp từ archive
+    ARCHIVE_ENABLED: bool = False
+    ARCHIVE_AFTER_DAYS: int = 90
+    ARCHIVE_INTERVAL_MINUTES: int = 60
+    ARCHIVE_BATCH_SIZE: int = 20000  # số tin đọc mỗi lượt (lớn hơn -> segment lớn, nén tốt hơn)
+    ARCHIVE_SEGMENT_SIZE: int = 500  # số tin tối đa mỗi segment
+    
+    # Tìm kiếm tin nhắn (inverted index, bỏ dấu tiếng Việt)
+    SEARCH_ENABLED: bool = True
+    SEARCH_PAGE_SIZE: int = 20
+    SEARCH_MAX_CANDIDATES: int = 5000  # số tin gần nhất khớp term hiếm nhất được xếp hạng
+    SEARCH_REBUILD_BATCH_SIZE: int = 1000
+    
+    # WebSocket replay buffer (gửi lại tin bị lỡ khi kết nối lại)
+    REPLAY_BUFFER_PER_STREAM: int = 200
+    REPLAY_MAX_STREAMS: int = 10000
+    
+    # Delta sync (change log cho /api/sync)
+    CHANGELOG_RETENTION_DAYS: int = 7
+    SYNC_PAGE_SIZE: int = 500
+    
+    # Offline delivery queue (tin nhắn cho người nhận không có WebSocket, gửi bù khi kết nối)
+    OFFLINE_QUEUE_ENABLED: bool = True
+    OFFLINE_QUEUE_FLUSH_MS: int = 50  # gom entry rồi ghi một lần insert_many
+    OFFLINE_QUEUE_BATCH_SIZE: int = 500  # số entry tối đa mỗi lần ghi / mỗi frame gửi bù
+    OFFLINE_QUEUE_TTL_HOURS: int = 72  # entry chưa ack quá hạn sẽ bị MongoDB xóa
+    OFFLINE_QUEUE_MAX_RETRIES: int = 5  # số lần ghi lại một lô lỗi (backoff tăng dần) trước khi bỏ
+    
+    # Username filter (Bloom filter: "chắc chắn không tồn tại" không cần query MongoDB).
+    # Với WORKERS > 1 filter không biết user vừa đăng ký ở worker khác nên luôn query database
+    USERNAME_FILTER_ENABLED: bool = True
+    USERNAME_FILTER_CAPACITY: int = 1_000_000
+    USERNAME_FILTER_FP_RATE: float = 0.01
+    USERNAME_FILTER_REFRESH_SECONDS: int = 30  # nạp user do process khác tạo; 0 = tắt
+    
+    # Tìm username theo tiền tố (index trong bộ nhớ, làm mới cùng chu kỳ với username filter)
+    USERNAME_SEARCH_ENABLED: bool = True
+    USERNAME_SEARCH_MAX_RESULTS: int = 20
+    
+    # Admin / Profiler (tắt mặc định, bật khi cần điều tra production)
+    ADMIN_TOKEN: Optional[str] = None
+    PROFILER_ENABLED: bool = False
+    PROFILER_INTERVAL_MS: int = 5
+    PROFILER_MAX_SECONDS: int = 60
+    PROFILER_SIGNAL_SECONDS: int = 30
+    PROFILER_OUTPUT_DIR: str = "profiles"
+    
+    # Tracing (span cho route, database, WebSocket fanout; export Chrome trace JSON)
+    TRACING_ENABLED: bool = False
+    TRACE_BUFFER_SIZE: int = 20000  # số span giữ trong ring buffer
+    TRACE_OUTPUT_DIR: str = "traces"
     
     # CORS
     CORS_ORIGINS: list = [
@@ -32,6 +129,19 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
         case_sensitive = True
+    
+    @model_validator(mode="after")
+    def check_storage_engine(self):
+        """Các tính năng dựa trên collection riêng của MongoDB chỉ bật với engine mongodb"""
+        if self.STORAGE_ENGINE == "mongodb":
+            if not self.MONGODB_URL:
+                raise ValueError("MONGODB_URL là bắt buộc khi STORAGE_ENGINE=mongodb")
+            return self
+        self.MESSAGE_STORAGE = "document"
+        self.ARCHIVE_ENABLED = False
+        self.SEARCH_ENABLED = False
+        self.OFFLINE_QUEUE_ENABLED = False
+        return self
 
 
 settings = Settings()
@@ -2,10 +2,21 @@
 MongoDB Database Connection và CRUD Operations
 """
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
-from pymongo.errors import DuplicateKeyError
-from datetime import datetime, timezone
-from typing import Optional, List, Dict, Any, Tuple
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Iterable, Set, Tuple
 from config import settings
+from storage import StorageEngine, INBOX_ROOM, INBOX_DIRECT
+from etags import change_versions, USERS_KEY, ROOMS_KEY, room_key, conversation_key
+from tracing import traced
+from username_filter import username_filter
+from username_index import username_index
+from room_cache import room_cache
+from replay import message_stream, replay_buffer
+from archive import archive_stats, decode_segment, encode_segment
+from search import idf, query_terms, score, search_stats, term_frequencies
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,6 +38,7 @@ class MongoDB:
             # Tạo collections và indexes
             await self._create_collections()
             await self._create_indexes()
+            await self._ensure_inbox()
             
             logger.info("✅ Connected to MongoDB successfully")
         except Exception as e:
@@ -41,7 +53,7 @@ class MongoDB:
 
     async def _create_collections(self):
         """Tạo các collections nếu chưa tồn tại"""
-        collections = ["users", "messages", "rooms", "room_members", "files", "invitation_links"]
+        collections = ["users", "messages", "rooms", "room_members", "files", "invitation_links", "inbox", "counters", "changes", "pending_deliveries", "message_buckets", "message_archive", "search_postings", "search_terms"]
         for collection in collections:
             try:
                 await self.db.create_collection(collection)
@@ -50,6 +62,13 @@ class MongoDB:
                 # Collection có thể đã tồn tại, bỏ qua
                 pass
 
+    async def _ensure_inbox(self):
+        """Dựng inbox read model lần đầu cho database đã có dữ liệu"""
+        if await self.db["inbox"].estimated_document_count() > 0:
+            return
+        if await self.db["rooms"].estimated_document_count() or await self.db["messages"].estimated_document_count():
+            await rebuild_inbox()
+
     async def _create_indexes(self):
         """Tạo indexes để tối ưu hiệu năng"""
         try:
@@ -57,6 +76,7 @@ class MongoDB:
             users = self.db["users"]
             await users.create_index("username", unique=True)
             await users.create_index("email", unique=True, sparse=True)
+            await users.create_index("created_at")
 
             # Messages collection
             messages = self.db["messages"]
@@ -65,6 +85,21 @@ class MongoDB:
             await messages.create_index("room_id")
             await messages.create_index([("timestamp", -1)])
 
+            # Message buckets (MESSAGE_STORAGE="bucketed")
+            buckets = self.db["message_buckets"]
+            await buckets.create_index([("room_id", 1), ("max_id", -1)])
+            await buckets.create_index("messages._id")
+            await buckets.create_index("end")
+
+            # Message archive (tầng lạnh): đọc theo scope từ segment mới tới cũ
+            archive = self.db["message_archive"]
+            await archive.create_index([("scope", 1), ("max_id", -1)])
+
+            # Search index: posting theo (scope, term), mới nhất trước
+            postings = self.db["search_postings"]
+            await postings.create_index([("scope", 1), ("term", 1), ("message_id", -1)], unique=True)
+            await postings.create_index("message_id")
+
             # Rooms collection
             rooms = self.db["rooms"]
             await rooms.create_index("room_name", unique=True)
@@ -81,6 +116,26 @@ class MongoDB:
             await invitation_links.create_index("room_id")
             await invitation_links.create_index([("expires_at", 1)])
 
+            # Inbox read model
+            inbox = self.db["inbox"]
+            await inbox.create_index([("owner", 1), ("kind", 1), ("conversation_id", 1)], unique=True)
+            await inbox.create_index([("owner", 1), ("last_activity", -1)])
+            await inbox.create_index([("kind", 1), ("conversation_id", 1)])
+
+            # Change log (delta sync), tự xóa sau CHANGELOG_RETENTION_DAYS
+            changes = self.db["changes"]
+            await changes.create_index("seq", unique=True)
+            await changes.create_index([("users", 1), ("seq", 1)])
+            await changes.create_index([("room_id", 1), ("seq", 1)])
+            await changes.create_index(
+                "created_at", expireAfterSeconds=settings.CHANGELOG_RETENTION_DAYS * 86400
+            )
+
+            # Offline delivery queue: đọc theo (username, _id), tự xóa khi tới expires_at
+            pending = self.db["pending_deliveries"]
+            await pending.create_index([("username", 1), ("_id", 1)])
+            await pending.create_index("expires_at", expireAfterSeconds=0)
+
             logger.info("✅ Indexes created successfully")
         except Exception as e:
             logger.error(f"Error creating indexes: {e}")
@@ -90,73 +145,709 @@ class MongoDB:
 db = MongoDB()
 
 
+# ============ MONGODB STORAGE ENGINE ============
+# Engine mặc định (STORAGE_ENGINE="mongodb"). Ngoài dữ liệu chính, các thao tác ghi
+# cập nhật luôn inbox read model, change log và search index (các phần chỉ có ở MongoDB).
+
+class MongoStorage(StorageEngine):
+    """Lưu trữ bằng MongoDB (Motor)"""
+    
+    name = "mongodb"
+
+    async def connect(self):
+        await db.connect_db()
+
+    async def close(self):
+        await db.close_db()
+
+    # ---------- users ----------
+
+    async def create_user(self, user: Dict[str, Any]):
+        try:
+            result = await db.db["users"].insert_one(user)
+        except DuplicateKeyError:
+            raise ValueError(f"Username '{user['username']}' hoặc email đã tồn tại")
+        user["_id"] = result.inserted_id
+
+    async def user_exists(self, username: str) -> bool:
+        return await db.db["users"].find_one({"username": username}, projection={"_id": 1}) is not None
+
+    async def existing_usernames(self, usernames: List[str]) -> Set[str]:
+        cursor = db.db["users"].find({"username": {"$in": usernames}}, projection={"_id": 0, "username": 1})
+        return {user["username"] async for user in cursor}
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return await db.db["users"].find_one({"username": username})
+
+    async def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        from bson.objectid import ObjectId
+        return await db.db["users"].find_one({"_id": ObjectId(user_id)})
+
+    async def get_all_users(self) -> List[Dict[str, Any]]:
+        users = []
+        cursor = db.db["users"].find({}, {"password_hash": 0})
+        async for user in cursor:
+            users.append(user)
+        return users
+
+    async def get_online_users(self) -> List[Dict[str, Any]]:
+        users = []
+        cursor = db.db["users"].find({"is_online": True}, {"password_hash": 0})
+        async for user in cursor:
+            users.append(user)
+        return users
+
+    async def update_user_online_status(self, username: str, is_online: bool) -> bool:
+        result = await db.db["users"].update_one(
+            {"username": username},
+            {
+                "$set": {
+                    "is_online": is_online,
+                    "last_login": datetime.now(timezone.utc) if is_online else None,
+                    "updated_at": datetime.now(timezone.utc),
+                }
+            },
+        )
+        return result.modified_count > 0
+
+    async def count_users(self) -> int:
+        return await db.db["users"].estimated_document_count()
+
+    async def iter_usernames(self, since: Optional[datetime] = None) -> AsyncIterator[Tuple[str, Optional[datetime]]]:
+        query = {"created_at": {"$gte": since}} if since is not None else {}
+        async for user in db.db["users"].find(query, projection={"username": 1, "created_at": 1}):
+            yield user["username"], user.get("created_at")
+
+    # ---------- messages ----------
+
+    async def save_message(self, message: Dict[str, Any]):
+        from bson.objectid import ObjectId
+        stream = message_stream(message)
+        if stream:
+            message["seq"] = await _next_seq(stream)
+        message["_id"] = ObjectId()
+        # Ghi tin nhắn trước: inbox, change log và search index chỉ được trỏ tới tin đã lưu
+        if _bucketed(message["room_id"]):
+            await _bucket_append(message)
+        else:
+            await db.db["messages"].insert_one(message)
+        await asyncio.gather(
+            _inbox_on_messages([message]),
+            _log_change(CHANGE_MESSAGE, {"message": _inbox_preview(message)}, **_message_audience(message)),
+            _search_index_messages([message]),
+        )
+
+    async def save_messages(self, messages: List[Dict[str, Any]]):
+        from bson.objectid import ObjectId
+        # Mỗi stream xin một dải seq liên tiếp bằng một $inc, thay vì một lần cho mỗi tin
+        counts: Dict[str, int] = {}
+        for message in messages:
+            stream = message_stream(message)
+            if stream:
+                counts[stream] = counts.get(stream, 0) + 1
+        streams = list(counts)
+        lasts = await asyncio.gather(*(_next_seq(stream, counts[stream]) for stream in streams))
+        next_seqs = {stream: last - counts[stream] + 1 for stream, last in zip(streams, lasts)}
+        for message in messages:
+            stream = message_stream(message)
+            if stream:
+                message["seq"] = next_seqs[stream]
+                next_seqs[stream] += 1
+            message["_id"] = ObjectId()
+        
+        documents = [m for m in messages if not _bucketed(m["room_id"])]
+        bucketed = [m for m in messages if _bucketed(m["room_id"])]
+        
+        async def append_buckets():
+            # Tuần tự để các tin của cùng một phòng vào bucket theo đúng thứ tự
+            for message in bucketed:
+                await _bucket_append(message)
+        
+        # Ghi tin nhắn trước: inbox, change log và search index chỉ được trỏ tới tin đã lưu
+        writes = [append_buckets()]
+        if documents:
+            writes.append(db.db["messages"].insert_many(documents, ordered=False))
+        await asyncio.gather(*writes)
+        await asyncio.gather(
+            _inbox_on_messages(messages),
+            _log_changes([
+                (CHANGE_MESSAGE, {"message": _inbox_preview(m)}, _message_audience(m)) for m in messages
+            ]),
+            _search_index_messages(messages),
+        )
+
+    async def get_stream_seqs(self, streams: List[str]) -> Dict[str, int]:
+        seqs = {}
+        async for counter in db.db["counters"].find({"_id": {"$in": streams}}):
+            seqs[counter["_id"]] = counter["seq"]
+        return seqs
+
+    async def get_private_messages(self, user1: str, user2: str, limit: int) -> List[Dict[str, Any]]:
+        messages = []
+        cursor = db.db["messages"].find(
+            {
+                "$or": [
+                    {"$and": [{"sender": user1}, {"recipient": user2}]},
+                    {"$and": [{"sender": user2}, {"recipient": user1}]},
+                ]
+            }
+        ).sort([("timestamp", -1), ("_id", -1)]).limit(limit)  # _id: tin cùng timestamp (gửi theo lô)
+        
+        async for msg in cursor:
+            messages.append(msg)
+        
+        messages.reverse()  # Sắp xếp tăng dần
+        if len(messages) < limit and settings.ARCHIVE_ENABLED:
+            older = await _get_archived_messages(
+                conversation_key(user1, user2), limit - len(messages), messages[0]["_id"] if messages else None
+            )
+            messages = older + messages
+        return messages
+
+    async def get_room_messages(self, room_id: str, limit: int, before: Optional[str]) -> List[Dict[str, Any]]:
+        from bson.objectid import ObjectId
+        try:
+            if _bucketed(room_id):
+                messages = await _get_bucketed_room_messages(ObjectId(room_id), limit, ObjectId(before) if before else None)
+            else:
+                messages = []
+                query: Dict[str, Any] = {"room_id": ObjectId(room_id)}
+                if before:
+                    query["_id"] = {"$lt": ObjectId(before)}
+                cursor = db.db["messages"].find(query).sort([("timestamp", -1), ("_id", -1)]).limit(limit)
+                
+                async for msg in cursor:
+                    messages.append(msg)
+                messages.reverse()
+            
+            # Tầng nóng hết tin: đọc tiếp phần cũ hơn từ archive
+            if len(messages) < limit and settings.ARCHIVE_ENABLED:
+                boundary = messages[0]["_id"] if messages else (ObjectId(before) if before else None)
+                older = await _get_archived_messages(room_key(room_id), limit - len(messages), boundary)
+                messages = older + messages
+            return messages
+        except Exception as e:
+            logger.error(f"Error getting room messages for {room_id}: {e}")
+            return []
+
+    async def mark_message_as_read(self, message_id: str) -> Optional[Dict[str, Any]]:
+        from bson.objectid import ObjectId
+        previous = await db.db["messages"].find_one_and_update(
+            {"_id": ObjectId(message_id)},
+            {"$set": {"is_read": True, "updated_at": datetime.now(timezone.utc)}},
+            projection={"sender": 1, "recipient": 1, "room_id": 1, "is_read": 1},
+        )
+        if not previous and settings.MESSAGE_STORAGE == "bucketed":
+            previous = await _bucket_mark_read(ObjectId(message_id))
+        if previous and not previous.get("is_read"):
+            await asyncio.gather(
+                _inbox_on_direct_read(previous),
+                _log_change(CHANGE_READ, {"message_ids": [message_id]}, **_message_audience(previous)),
+            )
+        return previous
+
+    async def delete_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        from bson.objectid import ObjectId
+        previous = await db.db["messages"].find_one_and_delete(
+            {"_id": ObjectId(message_id)},
+            projection={"sender": 1, "recipient": 1, "room_id": 1},
+        )
+        if not previous and settings.MESSAGE_STORAGE == "bucketed":
+            previous = await db.db["message_buckets"].find_one_and_update(
+                {"messages._id": ObjectId(message_id)},
+                {"$pull": {"messages": {"_id": ObjectId(message_id)}}},
+                projection={"room_id": 1},
+            )
+        if previous:
+            await asyncio.gather(
+                _log_change(CHANGE_MESSAGE_DELETED, {"message_id": message_id}, **_message_audience(previous)),
+                _search_unindex_message(ObjectId(message_id)),
+            )
+        return previous
+
+    async def get_unread_messages(self, username: str) -> List[Dict[str, Any]]:
+        messages = []
+        cursor = db.db["messages"].find(
+            {"recipient": username, "is_read": False}
+        ).sort("timestamp", -1)
+        
+        async for msg in cursor:
+            messages.append(msg)
+        
+        return messages
+
+    # ---------- rooms ----------
+
+    async def create_room(self, room: Dict[str, Any]):
+        try:
+            result = await db.db["rooms"].insert_one(room)
+        except DuplicateKeyError:
+            raise ValueError(f"Phòng '{room['room_name']}' đã tồn tại")
+        room["_id"] = result.inserted_id
+        await asyncio.gather(
+            _inbox_add_room_members(room, room["members"]),
+            _log_change(
+                CHANGE_ROOM, {"room": _room_snapshot(room), "joined": room["members"]},
+                users=room["members"], room_id=str(room["_id"]),
+            ),
+        )
+
+    async def get_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        from bson.objectid import ObjectId
+        try:
+            return await db.db["rooms"].find_one({"_id": ObjectId(room_id)})
+        except Exception as e:
+            logger.error(f"Error getting room {room_id}: {e}")
+            return None
+
+    async def get_all_rooms(self) -> List[Dict[str, Any]]:
+        rooms = []
+        cursor = db.db["rooms"].find({}).sort("created_at", -1)
+        async for room in cursor:
+            rooms.append(room)
+        return rooms
+
+    async def join_room(self, room_id: str, username: str) -> bool:
+        from bson.objectid import ObjectId
+        result = await db.db["rooms"].update_one(
+            {"_id": ObjectId(room_id)},
+            {
+                "$addToSet": {"members": username},
+                "$set": {"updated_at": datetime.utcnow()},
+            },
+        )
+        return result.modified_count > 0
+
+    async def leave_room(self, room_id: str, username: str) -> bool:
+        from bson.objectid import ObjectId
+        result = await db.db["rooms"].update_one(
+            {"_id": ObjectId(room_id)},
+            {
+                "$pull": {"members": username},
+                "$set": {"updated_at": datetime.now(timezone.utc)},
+            },
+        )
+        return result.modified_count > 0
+
+    async def add_room_member(self, room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        from bson.objectid import ObjectId
+        try:
+            previous = await db.db["rooms"].find_one_and_update(
+                {"_id": ObjectId(room_id)},
+                {
+                    "$addToSet": {"members": username},
+                    "$set": {"updated_at": datetime.now(timezone.utc)},
+                },
+            )
+        except Exception as e:
+            logger.error(f"Error joining room {room_id}: {e}")
+            return None, False
+        if not previous:
+            return None, False
+        # Inbox và audience của change log dùng id dạng str(ObjectId), không phải chuỗi từ route
+        room_id = str(previous["_id"])
+        members = previous.get("members", [])
+        joined = username not in members
+        if joined:
+            previous["members"] = members + [username]
+            await asyncio.gather(
+                _inbox_add_room_members(previous, [username]),
+                _log_change(
+                    CHANGE_MEMBERSHIP, {"room_id": room_id, "username": username, "action": "join"},
+                    users=[username], room_id=room_id,
+                ),
+            )
+        return previous, joined
+
+    async def remove_room_member(self, room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        from bson.objectid import ObjectId
+        try:
+            previous = await db.db["rooms"].find_one_and_update(
+                {"_id": ObjectId(room_id)},
+                {
+                    "$pull": {"members": username},
+                    "$set": {"updated_at": datetime.now(timezone.utc)},
+                },
+            )
+        except Exception as e:
+            logger.error(f"Error leaving room {room_id}: {e}")
+            return None, False
+        if not previous:
+            return None, False
+        # Inbox và audience của change log dùng id dạng str(ObjectId), không phải chuỗi từ route
+        room_id = str(previous["_id"])
+        members = previous.get("members", [])
+        left = username in members
+        if left:
+            previous["members"] = [m for m in members if m != username]
+            await asyncio.gather(
+                db.db["inbox"].delete_one({"owner": username, "kind": INBOX_ROOM, "conversation_id": room_id}),
+                _log_change(
+                    CHANGE_MEMBERSHIP, {"room_id": room_id, "username": username, "action": "leave"},
+                    users=[username], room_id=room_id,
+                ),
+            )
+        return previous, left
+
+    async def add_room_members(self, room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        from bson.objectid import ObjectId
+        try:
+            previous = await db.db["rooms"].find_one_and_update(
+                {"_id": ObjectId(room_id)},
+                {
+                    "$addToSet": {"members": {"$each": usernames}},
+                    "$set": {"updated_at": datetime.now(timezone.utc)},
+                },
+            )
+        except Exception as e:
+            logger.error(f"Error adding members to room {room_id}: {e}")
+            return None, []
+        if not previous:
+            return None, []
+        # Inbox và audience của change log dùng id dạng str(ObjectId), không phải chuỗi từ route
+        room_id = str(previous["_id"])
+        members = set(previous.get("members", []))
+        added = [username for username in dict.fromkeys(usernames) if username not in members]
+        previous["members"] = previous.get("members", []) + added
+        if added:
+            await asyncio.gather(
+                _inbox_add_room_members(previous, added),
+                # Một change tóm tắt cho cả lô (như CHANGE_ROOM khi tạo phòng)
+                _log_change(
+                    CHANGE_MEMBERSHIP, {"room_id": room_id, "usernames": added, "action": "join"},
+                    users=added, room_id=room_id,
+                ),
+            )
+        return previous, added
+
+    async def remove_room_members(self, room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        from bson.objectid import ObjectId
+        try:
+            previous = await db.db["rooms"].find_one_and_update(
+                {"_id": ObjectId(room_id)},
+                {
+                    "$pull": {"members": {"$in": usernames}},
+                    "$set": {"updated_at": datetime.now(timezone.utc)},
+                },
+            )
+        except Exception as e:
+            logger.error(f"Error removing members from room {room_id}: {e}")
+            return None, []
+        if not previous:
+            return None, []
+        # Inbox và audience của change log dùng id dạng str(ObjectId), không phải chuỗi từ route
+        room_id = str(previous["_id"])
+        leaving = set(usernames)
+        removed = [m for m in previous.get("members", []) if m in leaving]
+        previous["members"] = [m for m in previous.get("members", []) if m not in leaving]
+        if removed:
+            await asyncio.gather(
+                db.db["inbox"].delete_many({"owner": {"$in": removed}, "kind": INBOX_ROOM, "conversation_id": room_id}),
+                _log_change(
+                    CHANGE_MEMBERSHIP, {"room_id": room_id, "usernames": removed, "action": "leave"},
+                    users=removed, room_id=room_id,
+                ),
+            )
+        return previous, removed
+
+    async def get_room_members(self, room_id: str) -> Optional[List[str]]:
+        from bson.objectid import ObjectId
+        try:
+            room = await db.db["rooms"].find_one({"_id": ObjectId(room_id)}, projection={"members": 1})
+        except Exception as e:
+            logger.error(f"Error getting room {room_id}: {e}")
+            return None
+        return room.get("members", []) if room else None
+
+    async def get_member_room_ids(self, username: str, object_ids: List[Any]) -> List[str]:
+        cursor = db.db["rooms"].find({"_id": {"$in": object_ids}, "members": username}, projection={"_id": 1})
+        return [str(room["_id"]) async for room in cursor]
+
+    async def get_user_room_ids(self, username: str) -> List[str]:
+        cursor = db.db["rooms"].find({"members": username}, projection={"_id": 1})
+        return [str(room["_id"]) async for room in cursor]
+
+    async def get_user_rooms(self, username: str) -> List[Dict[str, Any]]:
+        rooms = []
+        cursor = db.db["rooms"].find({"members": username}).sort("created_at", -1)
+        async for room in cursor:
+            rooms.append(room)
+        return rooms
+
+    # ---------- files ----------
+
+    async def save_file(self, file_obj: Dict[str, Any]):
+        result = await db.db["files"].insert_one(file_obj)
+        file_obj["_id"] = result.inserted_id
+
+    async def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        from bson.objectid import ObjectId
+        return await db.db["files"].find_one({"_id": ObjectId(file_id)})
+
+    async def get_user_files(self, username: str, limit: int) -> List[Dict[str, Any]]:
+        files = []
+        cursor = (
+            db.db["files"]
+            .find({"$or": [{"sender": username}, {"recipient": username}]}, {"file_data": 0})
+            .sort("timestamp", -1)
+            .limit(limit)
+        )
+        async for file in cursor:
+            files.append(file)
+        return files
+
+    # ---------- invitation links ----------
+
+    async def create_invitation_link(self, invitation: Dict[str, Any]):
+        result = await db.db["invitation_links"].insert_one(invitation)
+        invitation["_id"] = result.inserted_id
+
+    async def get_invitation_link(self, invite_code: str) -> Optional[Dict[str, Any]]:
+        return await db.db["invitation_links"].find_one({"invite_code": invite_code})
+
+    async def use_invitation_link(self, invite_code: str, username: str) -> bool:
+        result = await db.db["invitation_links"].update_one(
+            {"invite_code": invite_code},
+            {
+                "$addToSet": {"used_by": username},
+                "$set": {"updated_at": datetime.utcnow()},
+            },
+        )
+        return result.modified_count > 0
+
+    async def redeem_invitation_link(self, invite_code: str, username: str, now: datetime) -> Optional[Dict[str, Any]]:
+        return await db.db["invitation_links"].find_one_and_update(
+            {"invite_code": invite_code, "is_active": True, "expires_at": {"$gt": now}},
+            {
+                "$addToSet": {"used_by": username},
+                "$set": {"updated_at": now},
+            },
+        )
+
+    async def get_room_invitation_links(self, room_id: str) -> List[Dict[str, Any]]:
+        links = []
+        cursor = db.db["invitation_links"].find({"room_id": room_id}).sort("created_at", -1)
+        async for link in cursor:
+            links.append(link)
+        return links
+
+    async def disable_invitation_link(self, invite_code: str) -> bool:
+        result = await db.db["invitation_links"].update_one(
+            {"invite_code": invite_code},
+            {
+                "$set": {
+                    "is_active": False,
+                    "updated_at": datetime.utcnow(),
+                }
+            },
+        )
+        return result.modified_count > 0
+
+    # ---------- inbox ----------
+
+    async def get_inbox(self, username: str, limit: int) -> List[Dict[str, Any]]:
+        entries = []
+        cursor = db.db["inbox"].find({"owner": username}).sort("last_activity", -1).limit(limit)
+        async for entry in cursor:
+            entries.append(entry)
+        return entries
+
+    async def mark_inbox_read(self, username: str, kind: str, conversation_id: str) -> Optional[int]:
+        result = await db.db["inbox"].update_one(
+            {"owner": username, "kind": kind, "conversation_id": conversation_id},
+            {"$set": {"unread": 0}},
+        )
+        if result.matched_count == 0:
+            return None
+        if kind != INBOX_DIRECT:
+            return 0
+        messages = await db.db["messages"].update_many(
+            {"sender": conversation_id, "recipient": username, "is_read": False},
+            {"$set": {"is_read": True, "updated_at": datetime.now(timezone.utc)}},
+        )
+        if messages.modified_count:
+            await _log_change(
+                CHANGE_READ, {"sender": conversation_id, "recipient": username, "all": True},
+                users=[username, conversation_id],
+            )
+        return messages.modified_count
+
+
+def _create_storage() -> StorageEngine:
+    """Engine theo STORAGE_ENGINE"""
+    if settings.STORAGE_ENGINE == "memory":
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    if settings.STORAGE_ENGINE == "sqlite":
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(settings.SQLITE_PATH, settings.SQLITE_READ_CONNECTIONS, settings.SQLITE_WRITE_BATCH_SIZE)
+    return MongoStorage()
+
+
+# Engine đang dùng (routes vẫn gọi các hàm bên dưới, không gọi engine trực tiếp)
+storage = _create_storage()
+
+
 # ============ USER OPERATIONS ============
 
+@traced("db.create_user")
 async def create_user(username: str, email: Optional[str], password_hash: str) -> Dict[str, Any]:
     """Tạo user mới"""
-    try:
-        user = {
-            "username": username,
-            "email": email,
-            "password_hash": password_hash,
-            "is_online": False,
-            "last_login": None,
-            "created_at": datetime.now(timezone.utc),
-            "updated_at": datetime.now(timezone.utc),
-        }
-        result = await db.db["users"].insert_one(user)
-        user["_id"] = result.inserted_id
-        return user
-    except DuplicateKeyError:
-        raise ValueError(f"Username '{username}' hoặc email đã tồn tại")
+    user = {
+        "username": username,
+        "email": email,
+        "password_hash": password_hash,
+        "is_online": False,
+        "last_login": None,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc),
+    }
+    await storage.create_user(user)
+    change_versions.bump(USERS_KEY)
+    username_filter.add(username)
+    if username_index.loaded:
+        username_index.add(username)
+    return user
+
+
+def _username_filter_complete() -> bool:
+    """
+    Chỉ tin câu trả lời "không tồn tại" của filter khi filter chứa mọi user: đã nạp và chỉ có
+    1 worker (user đăng ký ở worker khác chỉ vào filter sau lần làm mới kế tiếp)
+    """
+    return settings.USERNAME_FILTER_ENABLED and settings.WORKERS == 1 and username_filter.loaded
+
+
+@traced("db.user_exists")
+async def user_exists(username: str) -> bool:
+    """Username có tồn tại không (username filter trả lời "không" mà không cần query)"""
+    filtered = _username_filter_complete()
+    if filtered and not username_filter.might_exist(username):
+        return False
+    found = await storage.user_exists(username)
+    if not found and filtered:
+        username_filter.false_positives += 1
+    return found
+
+
+@traced("db.existing_usernames")
+async def existing_usernames(usernames: List[str]) -> Set[str]:
+    """Những username đã tồn tại: filter loại trước các tên chắc chắn không có, phần còn lại một query"""
+    candidates = list(dict.fromkeys(usernames))
+    filtered = _username_filter_complete()
+    if filtered:
+        candidates = [username for username in candidates if username_filter.might_exist(username)]
+    if not candidates:
+        return set()
+    found = await storage.existing_usernames(candidates)
+    if filtered:
+        username_filter.false_positives += len(candidates) - len(found)
+    return found
+
+
+def _refresh_since(watermark: Optional[datetime]) -> Optional[datetime]:
+    """
+    Mốc quét lại có chồng lấn: worker khác có thể commit user với created_at sớm hơn
+    watermark sau lần quét trước. Thêm lại username đã có là idempotent.
+    """
+    if watermark is None:
+        return None
+    return watermark - timedelta(seconds=settings.USERNAME_FILTER_REFRESH_SECONDS)
+
+
+async def load_username_filter() -> int:
+    """
+    Nạp username vào filter: toàn bộ ở lần đầu (hoặc khi vượt capacity),
+    sau đó chỉ user tạo gần mốc created_at lần trước. Trả về số username đã nạp.
+    """
+    since = _refresh_since(username_filter.watermark)
+    if not username_filter.loaded or username_filter.over_capacity:
+        username_filter.reset(await storage.count_users())
+        since = None
+    
+    loaded = 0
+    async for username, created_at in storage.iter_usernames(since):
+        username_filter.add(username, created_at)
+        loaded += 1
+    username_filter.loaded = True
+    return loaded
+
+
+async def load_username_index() -> int:
+    """
+    Nạp username vào prefix index: toàn bộ ở lần đầu, sau đó chỉ user tạo gần
+    mốc created_at lần trước. Trả về số username đã nạp.
+    """
+    if not username_index.loaded:
+        names = []
+        async for username, created_at in storage.iter_usernames():
+            names.append(username)
+            if created_at is not None and (username_index.watermark is None or created_at > username_index.watermark):
+                username_index.watermark = created_at
+        username_index.reset(names)
+        username_index.loaded = True
+        return len(names)
+    
+    loaded = 0
+    async for username, created_at in storage.iter_usernames(_refresh_since(username_index.watermark)):
+        username_index.add(username, created_at)
+        loaded += 1
+    return loaded
+
+
+async def refresh_username_filter(interval: float):
+    """Task nền: định kỳ nạp user mới (tạo bởi worker khác) vào filter và prefix index"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if settings.USERNAME_FILTER_ENABLED:
+                await load_username_filter()
+            if settings.USERNAME_SEARCH_ENABLED:
+                await load_username_index()
+        except Exception as e:
+            logger.error(f"Error refreshing username filter: {e}")
+
 
+def search_usernames(prefix: str, limit: int) -> List[str]:
+    """Username có tiền tố (không phân biệt hoa thường / dấu), từ prefix index trong bộ nhớ"""
+    return username_index.search(prefix, limit)
 
+
+@traced("db.get_user")
 async def get_user(username: str) -> Optional[Dict[str, Any]]:
     """Lấy thông tin user theo username"""
-    return await db.db["users"].find_one({"username": username})
+    return await storage.get_user(username)
 
 
+@traced("db.get_user_by_id")
 async def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
     """Lấy thông tin user theo ID"""
-    from bson.objectid import ObjectId
-    return await db.db["users"].find_one({"_id": ObjectId(user_id)})
+    return await storage.get_user_by_id(user_id)
 
 
+@traced("db.get_all_users")
 async def get_all_users() -> List[Dict[str, Any]]:
     """Lấy tất cả users (không lấy password_hash)"""
-    users = []
-    cursor = db.db["users"].find({}, {"password_hash": 0})
-    async for user in cursor:
-        users.append(user)
-    return users
+    return await storage.get_all_users()
 
 
+@traced("db.get_online_users")
 async def get_online_users() -> List[Dict[str, Any]]:
     """Lấy danh sách users đang online"""
-    users = []
-    cursor = db.db["users"].find({"is_online": True}, {"password_hash": 0})
-    async for user in cursor:
-        users.append(user)
-    return users
+    return await storage.get_online_users()
 
 
+@traced("db.update_user_online_status")
 async def update_user_online_status(username: str, is_online: bool) -> bool:
     """Cập nhật trạng thái online của user"""
-    result = await db.db["users"].update_one(
-        {"username": username},
-        {
-            "$set": {
-                "is_online": is_online,
-                "last_login": datetime.now(timezone.utc) if is_online else None,
-                "updated_at": datetime.now(timezone.utc),
-            }
-        },
-    )
-    return result.modified_count > 0
+    updated = await storage.update_user_online_status(username, is_online)
+    change_versions.bump(USERS_KEY)
+    return updated
 
 
 # ============ MESSAGE OPERATIONS ============
 
+@traced("db.save_message")
 async def save_message(
     sender: str,
     recipient: Optional[str] = None,
@@ -176,155 +867,444 @@ async def save_message(
         "is_read": False,
         "timestamp": datetime.now(timezone.utc),
     }
-    result = await db.db["messages"].insert_one(message)
-    message["_id"] = result.inserted_id
+    await storage.save_message(message)
+    _bump_message_versions(message)
+    replay_buffer.record(message)
+    if message["room_id"]:
+        # Key dạng str(ObjectId) như khi đọc, không phụ thuộc cách viết room_id của route
+        room_cache.append(str(message["room_id"]), message)
     return message
 
 
-async def get_private_messages(user1: str, user2: str, limit: int = 50) -> List[Dict[str, Any]]:
-    """Lấy tin nhắn riêng tư giữa 2 người"""
-    messages = []
-    cursor = db.db["messages"].find(
+async def _next_seq(stream: str, count: int = 1) -> int:
+    """
+    Số thứ tự tiếp theo của stream (phòng / hội thoại), tăng nguyên tử trong MongoDB.
+    count > 1: cấp một dải count số liên tiếp, trả về số cuối của dải
+    """
+    counter = await db.db["counters"].find_one_and_update(
+        {"_id": stream},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["seq"]
+
+
+@traced("db.save_messages")
+async def save_messages(sender: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Lưu một lô tin nhắn của sender bằng một lần ghi
+    (mỗi item: recipient hoặc room_id, content, message_type)
+    """
+    from bson.objectid import ObjectId
+    
+    now = datetime.now(timezone.utc)
+    messages = [
         {
-            "$or": [
-                {"$and": [{"sender": user1}, {"recipient": user2}]},
-                {"$and": [{"sender": user2}, {"recipient": user1}]},
-            ]
+            "sender": sender,
+            "recipient": item.get("recipient"),
+            "room_id": ObjectId(item["room_id"]) if item.get("room_id") else None,
+            "content": item.get("content", ""),
+            "message_type": item.get("message_type", "TEXT"),
+            "is_read": False,
+            "timestamp": now,
         }
-    ).sort("timestamp", -1).limit(limit)
-    
-    async for msg in cursor:
-        messages.append(msg)
-    
-    return list(reversed(messages))  # Sắp xếp tăng dần
+        for item in items
+    ]
+    if not messages:
+        return []
+    await storage.save_messages(messages)
+    for message in messages:
+        _bump_message_versions(message)
+        replay_buffer.record(message)
+        if message["room_id"]:
+            room_cache.append(str(message["room_id"]), message)
+    return messages
 
 
-async def get_room_messages(room_id: str, limit: int = 50) -> List[Dict[str, Any]]:
-    """Lấy tin nhắn từ phòng"""
-    from bson.objectid import ObjectId
+@traced("db.get_stream_seqs")
+async def get_stream_seqs(streams: List[str]) -> Dict[str, int]:
+    """Seq mới nhất của các stream"""
+    return await storage.get_stream_seqs(streams)
+
+
+def _bump_message_versions(message: Dict[str, Any]):
+    """Tăng phiên bản của phòng/hội thoại chứa tin nhắn"""
+    if message.get("room_id"):
+        change_versions.bump(room_key(str(message["room_id"])))
+    elif message.get("recipient"):
+        change_versions.bump(conversation_key(message["sender"], message["recipient"]))
+
+
+@traced("db.get_private_messages")
+async def get_private_messages(user1: str, user2: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """Lấy tin nhắn riêng tư giữa 2 người"""
+    return await storage.get_private_messages(user1, user2, limit)
+
+
+@traced("db.get_room_messages")
+async def get_room_messages(room_id: str, limit: int = 50, before: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Lấy tin nhắn từ phòng (before: chỉ lấy tin cũ hơn message id này)"""
     if not room_id or room_id == 'undefined':
         return []
-    try:
-        messages = []
-        cursor = db.db["messages"].find({"room_id": ObjectId(room_id)}).sort("timestamp", -1).limit(limit)
-        
-        async for msg in cursor:
-            messages.append(msg)
-        
-        return list(reversed(messages))
-    except Exception as e:
-        logger.error(f"Error getting room messages for {room_id}: {e}")
-        return []
+    return await storage.get_room_messages(room_id, limit, before)
 
 
+@traced("db.mark_message_as_read")
 async def mark_message_as_read(message_id: str) -> bool:
     """Đánh dấu tin nhắn đã đọc"""
-    from bson.objectid import ObjectId
-    result = await db.db["messages"].update_one(
-        {"_id": ObjectId(message_id)},
-        {"$set": {"is_read": True, "updated_at": datetime.now(timezone.utc)}},
+    previous = await storage.mark_message_as_read(message_id)
+    if not previous:
+        return False
+    if not previous.get("is_read"):
+        _bump_message_versions(previous)
+        if previous.get("room_id"):
+            room_cache.mark_read(str(previous["room_id"]), message_id)
+    return True
+
+
+@traced("db.delete_message")
+async def delete_message(message_id: str) -> bool:
+    """Xóa tin nhắn"""
+    previous = await storage.delete_message(message_id)
+    if not previous:
+        return False
+    _bump_message_versions(previous)
+    if previous.get("room_id"):
+        room_cache.invalidate(str(previous["room_id"]))
+    return True
+
+
+@traced("db.get_unread_messages")
+async def get_unread_messages(username: str) -> List[Dict[str, Any]]:
+    """Lấy tin nhắn chưa đọc"""
+    return await storage.get_unread_messages(username)
+
+
+# ============ MESSAGE BUCKETS ============
+# MESSAGE_STORAGE="bucketed": tin nhắn phòng được nối vào document bucket của phòng
+# (tối đa MESSAGE_BUCKET_SIZE tin, trải dài tối đa MESSAGE_BUCKET_SPAN_HOURS).
+# Một trang lịch sử đọc 1-2 bucket liền nhau thay vì hàng chục document rải rác.
+# Tin nhắn 1-1 vẫn nằm trong "messages" (cần query theo recipient / is_read).
+
+def _bucketed(room_id: Optional[Any]) -> bool:
+    return bool(room_id) and settings.MESSAGE_STORAGE == "bucketed"
+
+
+def new_bucket(room_id: Any, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Document bucket chứa sẵn các tin nhắn (dùng khi migrate)"""
+    return {
+        "room_id": room_id,
+        "messages": messages,
+        "count": len(messages),
+        "min_id": min(m["_id"] for m in messages),
+        "max_id": max(m["_id"] for m in messages),
+        "start": min(m["timestamp"] for m in messages),
+        "end": max(m["timestamp"] for m in messages),
+    }
+
+
+async def _bucket_append(message: Dict[str, Any]):
+    """Nối tin nhắn vào bucket mới nhất còn chỗ của phòng, hoặc mở bucket mới"""
+    timestamp = message["timestamp"]
+    # count chỉ tăng (xóa tin không trả lại chỗ) để các bucket không chồng lấn khoảng _id
+    await db.db["message_buckets"].find_one_and_update(
+        {
+            "room_id": message["room_id"],
+            "count": {"$lt": settings.MESSAGE_BUCKET_SIZE},
+            "start": {"$gte": timestamp - timedelta(hours=settings.MESSAGE_BUCKET_SPAN_HOURS)},
+        },
+        {
+            "$push": {"messages": message},
+            "$inc": {"count": 1},
+            "$min": {"min_id": message["_id"]},
+            "$max": {"max_id": message["_id"], "end": timestamp},
+            "$setOnInsert": {"start": timestamp},
+        },
+        sort=[("max_id", -1)],
+        upsert=True,
+        projection={"_id": 1},
     )
-    return result.modified_count > 0
 
 
-async def get_unread_messages(username: str) -> List[Dict[str, Any]]:
-    """Lấy tin nhắn chưa đọc"""
-    messages = []
-    cursor = db.db["messages"].find(
-        {"recipient": username, "is_read": False}
-    ).sort("timestamp", -1)
+async def _get_bucketed_room_messages(room_id: Any, limit: int, before: Optional[Any]) -> List[Dict[str, Any]]:
+    """limit tin mới nhất (cũ -> mới) có _id < before, đọc bucket từ mới tới cũ"""
+    query: Dict[str, Any] = {"room_id": room_id}
+    if before is not None:
+        query["min_id"] = {"$lt": before}
+    cursor = (
+        db.db["message_buckets"]
+        .find(query, projection={"messages": 1, "max_id": 1})
+        .sort("max_id", -1)
+        .batch_size(limit // max(1, settings.MESSAGE_BUCKET_SIZE) + 2)
+    )
+    return await _newest_from_groups(cursor, lambda bucket: bucket["messages"], limit, before)
+
+
+async def _newest_from_groups(
+    cursor, unpack: Callable[[Dict[str, Any]], Iterable[Dict[str, Any]]], limit: int, before: Optional[Any]
+) -> List[Dict[str, Any]]:
+    """
+    limit tin mới nhất (cũ -> mới) có _id < before từ cursor các nhóm tin (bucket / segment)
+    sắp theo max_id giảm dần; các nhóm có thể chồng lấn khoảng _id
+    """
+    messages: List[Dict[str, Any]] = []
+    oldest_kept = None
+    async for group in cursor:
+        # Đã đủ limit tin và nhóm này chỉ chứa tin cũ hơn tất cả tin đã giữ
+        if oldest_kept is not None and group["max_id"] < oldest_kept:
+            break
+        messages.extend(m for m in unpack(group) if before is None or m["_id"] < before)
+        if len(messages) >= limit:
+            messages.sort(key=lambda m: m["_id"], reverse=True)
+            del messages[limit:]
+            oldest_kept = messages[-1]["_id"]
+    messages.sort(key=lambda m: m["_id"])
+    return messages[-limit:] if limit > 0 else []
+
+
+async def _bucket_mark_read(message_id: Any) -> Optional[Dict[str, Any]]:
+    """Đánh dấu đã đọc tin nhắn trong bucket; trả về trạng thái trước như find_one_and_update"""
+    bucket = await db.db["message_buckets"].find_one_and_update(
+        {"messages": {"$elemMatch": {"_id": message_id, "is_read": False}}},
+        {"$set": {"messages.$.is_read": True, "messages.$.updated_at": datetime.now(timezone.utc)}},
+        projection={"room_id": 1},
+    )
+    if bucket:
+        return {"room_id": bucket["room_id"], "is_read": False}
+    bucket = await db.db["message_buckets"].find_one({"messages._id": message_id}, projection={"room_id": 1})
+    if bucket:
+        return {"room_id": bucket["room_id"], "is_read": True}
+    return None
+
+
+# ============ MESSAGE ARCHIVE (COLD TIER) ============
+# Tin nhắn cũ hơn ARCHIVE_AFTER_DAYS được nén thành segment trong "message_archive"
+# (xem archive.py); get_room_messages / get_private_messages đọc tiếp khi tầng nóng hết tin.
+
+async def _get_archived_messages(scope: str, limit: int, before: Optional[Any]) -> List[Dict[str, Any]]:
+    """limit tin mới nhất (cũ -> mới) của scope trong archive có _id < before"""
+    if limit <= 0:
+        return []
+    query: Dict[str, Any] = {"scope": scope}
+    if before is not None:
+        query["min_id"] = {"$lt": before}
+    cursor = (
+        db.db["message_archive"]
+        .find(query, projection={"data": 1, "max_id": 1})
+        .sort("max_id", -1)
+        .batch_size(limit // max(1, settings.ARCHIVE_SEGMENT_SIZE) + 2)
+    )
+    return await _newest_from_groups(cursor, decode_segment, limit, before)
+
+
+def _archive_segments(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Chia tin nhắn theo phòng / hội thoại thành các segment đã nén"""
+    scopes: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for message in messages:
+        scopes.setdefault(message_stream(message), []).append(message)
+    size = max(1, settings.ARCHIVE_SEGMENT_SIZE)
+    return [
+        encode_segment(scope, group[i:i + size])
+        for scope, group in scopes.items()
+        for i in range(0, len(group), size)
+    ]
+
+
+@traced("db.archive_cold_messages")
+async def archive_cold_messages(older_than: datetime) -> int:
+    """
+    Chuyển tin nhắn có timestamp < older_than sang archive (ghi segment trước, xóa sau;
+    lỗi giữa chừng chỉ để lại bản trùng mà đọc lịch sử đã bỏ qua). Trả về số tin đã chuyển.
+    """
+    archived = 0
+    batch_size = max(1, settings.ARCHIVE_BATCH_SIZE)
+    # Tin nhắn 1-1 chưa đọc giữ lại ở tầng nóng cho get_unread_messages
+    query = {"timestamp": {"$lt": older_than}, "$or": [{"room_id": {"$ne": None}}, {"is_read": True}]}
+    while True:
+        batch = [m async for m in db.db["messages"].find(query).sort("timestamp", 1).limit(batch_size)]
+        if not batch:
+            break
+        segments = _archive_segments(batch)
+        await db.db["message_archive"].insert_many(segments)
+        await db.db["messages"].delete_many({"_id": {"$in": [m["_id"] for m in batch]}})
+        archive_stats.segments_written += len(segments)
+        archived += len(batch)
+        if len(batch) < batch_size:
+            break
     
-    async for msg in cursor:
-        messages.append(msg)
+    # Bucket (MESSAGE_STORAGE="bucketed") đã đóng và cũ: mỗi bucket thành một segment
+    async for bucket in db.db["message_buckets"].find({"end": {"$lt": older_than}}):
+        if bucket["messages"]:
+            await db.db["message_archive"].insert_one(
+                encode_segment(room_key(str(bucket["room_id"])), bucket["messages"])
+            )
+            archive_stats.segments_written += 1
+            archived += len(bucket["messages"])
+        await db.db["message_buckets"].delete_one({"_id": bucket["_id"]})
     
-    return messages
+    archive_stats.archived += archived
+    archive_stats.runs += 1
+    archive_stats.last_run = datetime.now(timezone.utc)
+    if archived:
+        logger.info(f"Archived {archived} messages older than {older_than.isoformat()}")
+    return archived
+
+
+async def run_archiver(interval: float):
+    """Task nền: archive định kỳ tin nhắn cũ hơn ARCHIVE_AFTER_DAYS"""
+    while True:
+        try:
+            await archive_cold_messages(datetime.now(timezone.utc) - timedelta(days=settings.ARCHIVE_AFTER_DAYS))
+        except Exception as e:
+            logger.error(f"Archiver error: {e}")
+        await asyncio.sleep(interval)
 
 
 # ============ ROOM OPERATIONS ============
 
+@traced("db.create_room")
 async def create_room(room_name: str, creator: str, description: Optional[str] = None, members: Optional[List[str]] = None) -> Dict[str, Any]:
     """Tạo phòng chat mới"""
-    try:
-        # Đảm bảo creator luôn trong members
-        room_members = [creator]
-        if members:
-            for member in members:
-                if member not in room_members:
-                    room_members.append(member)
+    # Đảm bảo creator luôn trong members
+    room_members = [creator]
+    if members:
+        for member in members:
+            if member not in room_members:
+                room_members.append(member)
         
-        room = {
-            "room_name": room_name,
-            "description": description,
-            "creator": creator,
-            "members": room_members,
-            "created_at": datetime.now(timezone.utc),
-            "updated_at": datetime.now(timezone.utc),
-        }
-        result = await db.db["rooms"].insert_one(room)
-        room["_id"] = result.inserted_id
-        return room
-    except DuplicateKeyError:
-        raise ValueError(f"Phòng '{room_name}' đã tồn tại")
+    room = {
+        "room_name": room_name,
+        "description": description,
+        "creator": creator,
+        "members": room_members,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc),
+    }
+    await storage.create_room(room)
+    change_versions.bump(ROOMS_KEY)
+    return room
 
 
+@traced("db.get_room")
 async def get_room(room_id: str) -> Optional[Dict[str, Any]]:
     """Lấy thông tin phòng"""
-    from bson.objectid import ObjectId
     if not room_id or room_id == 'undefined':
         return None
-    try:
-        return await db.db["rooms"].find_one({"_id": ObjectId(room_id)})
-    except Exception as e:
-        logger.error(f"Error getting room {room_id}: {e}")
-        return None
+    return await storage.get_room(room_id)
 
 
+@traced("db.get_all_rooms")
 async def get_all_rooms() -> List[Dict[str, Any]]:
     """Lấy tất cả phòng"""
-    rooms = []
-    cursor = db.db["rooms"].find({}).sort("created_at", -1)
-    async for room in cursor:
-        rooms.append(room)
-    return rooms
+    return await storage.get_all_rooms()
 
 
+@traced("db.join_room")
 async def join_room(room_id: str, username: str) -> bool:
     """Tham gia phòng"""
-    from bson.objectid import ObjectId
-    result = await db.db["rooms"].update_one(
-        {"_id": ObjectId(room_id)},
-        {
-            "$addToSet": {"members": username},
-            "$set": {"updated_at": datetime.utcnow()},
-        },
-    )
-    return result.modified_count > 0
+    joined = await storage.join_room(room_id, username)
+    if joined:
+        change_versions.bump(ROOMS_KEY)
+    return joined
 
 
+@traced("db.leave_room")
 async def leave_room(room_id: str, username: str) -> bool:
     """Rời khỏi phòng"""
+    left = await storage.leave_room(room_id, username)
+    if left:
+        change_versions.bump(ROOMS_KEY)
+    return left
+
+
+@traced("db.add_room_member")
+async def add_room_member(room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Thêm thành viên bằng một lệnh find-and-modify (thay cho get_room + join_room).
+    Trả về (phòng sau khi cập nhật hoặc None nếu không tồn tại, có phải thành viên mới không)
+    """
+    room, joined = await storage.add_room_member(room_id, username)
+    if joined:
+        change_versions.bump(ROOMS_KEY)
+    return room, joined
+
+
+@traced("db.remove_room_member")
+async def remove_room_member(room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Xóa thành viên bằng một lệnh find-and-modify (thay cho get_room + leave_room).
+    Trả về (phòng sau khi cập nhật hoặc None nếu không tồn tại, user có thực sự rời phòng không)
+    """
+    room, left = await storage.remove_room_member(room_id, username)
+    if left:
+        change_versions.bump(ROOMS_KEY)
+    return room, left
+
+
+@traced("db.add_room_members")
+async def add_room_members(room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Thêm nhiều thành viên bằng một lần ghi (import danh sách lớp / phòng ban).
+    Trả về (phòng sau khi cập nhật hoặc None nếu không tồn tại, những user mới vào phòng)
+    """
+    room, added = await storage.add_room_members(room_id, usernames)
+    if added:
+        change_versions.bump(ROOMS_KEY)
+    return room, added
+
+
+@traced("db.remove_room_members")
+async def remove_room_members(room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Xóa nhiều thành viên bằng một lần ghi.
+    Trả về (phòng sau khi cập nhật hoặc None nếu không tồn tại, những user thực sự rời phòng)
+    """
+    room, removed = await storage.remove_room_members(room_id, usernames)
+    if removed:
+        change_versions.bump(ROOMS_KEY)
+    return room, removed
+
+
+@traced("db.get_room_members")
+async def get_room_members(room_id: str) -> Optional[List[str]]:
+    """Chỉ lấy danh sách thành viên của phòng (projection, không tải cả document)"""
+    if not room_id or room_id == 'undefined':
+        return None
+    return await storage.get_room_members(room_id)
+
+
+@traced("db.get_member_room_ids")
+async def get_member_room_ids(username: str, room_ids: List[str]) -> List[str]:
+    """Trong các room_ids, những phòng mà user là thành viên"""
     from bson.objectid import ObjectId
-    result = await db.db["rooms"].update_one(
-        {"_id": ObjectId(room_id)},
-        {
-            "$pull": {"members": username},
-            "$set": {"updated_at": datetime.now(timezone.utc)},
-        },
-    )
-    return result.modified_count > 0
+    from bson.errors import InvalidId
+    object_ids = []
+    for room_id in room_ids:
+        try:
+            object_ids.append(ObjectId(room_id))
+        except (InvalidId, TypeError):
+            continue
+    if not object_ids:
+        return []
+    return await storage.get_member_room_ids(username, object_ids)
+
 
+@traced("db.get_user_room_ids")
+async def get_user_room_ids(username: str) -> List[str]:
+    """Chỉ lấy id các phòng của user"""
+    return await storage.get_user_room_ids(username)
 
+
+@traced("db.get_user_rooms")
 async def get_user_rooms(username: str) -> List[Dict[str, Any]]:
     """Lấy danh sách phòng của user"""
-    rooms = []
-    cursor = db.db["rooms"].find({"members": username}).sort("created_at", -1)
-    async for room in cursor:
-        rooms.append(room)
-    return rooms
+    return await storage.get_user_rooms(username)
 
 
 # ============ FILE OPERATIONS ============
 
+@traced("db.save_file")
 async def save_file(
     filename: str,
     sender: str,
@@ -344,35 +1324,25 @@ async def save_file(
         "file_data": base64.b64encode(file_data).decode() if file_data else "",
         "timestamp": datetime.utcnow(),
     }
-    result = await db.db["files"].insert_one(file_obj)
-    file_obj["_id"] = result.inserted_id
+    await storage.save_file(file_obj)
     return file_obj
 
 
+@traced("db.get_file")
 async def get_file(file_id: str) -> Optional[Dict[str, Any]]:
     """Lấy file theo ID"""
-    from bson.objectid import ObjectId
-    return await db.db["files"].find_one({"_id": ObjectId(file_id)})
+    return await storage.get_file(file_id)
 
 
+@traced("db.get_user_files")
 async def get_user_files(username: str, limit: int = 20) -> List[Dict[str, Any]]:
-    """Lấy danh sách file của user"""
-    files = []
-    cursor = (
-        db.db["files"]
-        .find({"$or": [{"sender": username}, {"recipient": username}]})
-        .sort("timestamp", -1)
-        .limit(limit)
-    )
-    async for file in cursor:
-        # Không lấy file_data trong list
-        file.pop("file_data", None)
-        files.append(file)
-    return files
+    """Lấy danh sách file của user (không lấy file_data)"""
+    return await storage.get_user_files(username, limit)
 
 
 # ============ INVITATION LINK OPERATIONS ============
 
+@traced("db.create_invitation_link")
 async def create_invitation_link(
     room_id: str, room_name: str, creator: str, created_by: str, expires_in_hours: int = 24
 ) -> Dict[str, Any]:
@@ -394,16 +1364,17 @@ async def create_invitation_link(
         "is_active": True,
         "used_by": [],
     }
-    result = await db.db["invitation_links"].insert_one(invitation)
-    invitation["_id"] = result.inserted_id
+    await storage.create_invitation_link(invitation)
     return invitation
 
 
+@traced("db.get_invitation_link")
 async def get_invitation_link(invite_code: str) -> Optional[Dict[str, Any]]:
     """Lấy thông tin invitation link"""
-    return await db.db["invitation_links"].find_one({"invite_code": invite_code})
+    return await storage.get_invitation_link(invite_code)
 
 
+@traced("db.validate_invitation_link")
 async def validate_invitation_link(invite_code: str) -> Tuple[bool, str]:
     """Kiểm tra invitation link có hợp lệ không"""
     link = await get_invitation_link(invite_code)
@@ -420,36 +1391,546 @@ async def validate_invitation_link(invite_code: str) -> Tuple[bool, str]:
     return True, ""
 
 
+@traced("db.use_invitation_link")
 async def use_invitation_link(invite_code: str, username: str) -> bool:
     """Sử dụng invitation link (thêm user vào phòng)"""
-    result = await db.db["invitation_links"].update_one(
-        {"invite_code": invite_code},
-        {
-            "$addToSet": {"used_by": username},
-            "$set": {"updated_at": datetime.utcnow()},
-        },
-    )
-    return result.modified_count > 0
+    return await storage.use_invitation_link(invite_code, username)
+
+
+@traced("db.redeem_invitation_link")
+async def redeem_invitation_link(invite_code: str, username: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Kiểm tra và sử dụng invitation link trong một lệnh find-and-modify
+    (thay cho validate_invitation_link + get_invitation_link + use_invitation_link).
+    Trả về (link, "") hoặc (None, lý do không hợp lệ)
+    """
+    link = await storage.redeem_invitation_link(invite_code, username, datetime.utcnow())
+    if link:
+        return link, ""
+    
+    # Chỉ đọc thêm khi thất bại, để trả về đúng lý do
+    is_valid, error = await validate_invitation_link(invite_code)
+    return None, error if not is_valid else "Invitation link đã hết hạn"
 
 
+@traced("db.get_room_invitation_links")
 async def get_room_invitation_links(room_id: str) -> List[Dict[str, Any]]:
     """Lấy tất cả invitation links của một phòng"""
-    links = []
-    cursor = db.db["invitation_links"].find({"room_id": room_id}).sort("created_at", -1)
-    async for link in cursor:
-        links.append(link)
-    return links
+    return await storage.get_room_invitation_links(room_id)
 
 
+@traced("db.disable_invitation_link")
 async def disable_invitation_link(invite_code: str) -> bool:
     """Vô hiệu hóa invitation link"""
-    result = await db.db["invitation_links"].update_one(
-        {"invite_code": invite_code},
+    return await storage.disable_invitation_link(invite_code)
+
+
+# ============ INBOX READ MODEL ============
+# Mỗi user có một document cho mỗi hội thoại (phòng hoặc chat 1-1), được cập nhật
+# tăng dần trong các write path ở trên, nên đọc inbox chỉ là một query theo index.
+
+
+def _inbox_preview(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Phần tin nhắn lưu trong inbox (last_message)"""
+    return {
+        "_id": message["_id"],
+        "sender": message["sender"],
+        "recipient": message.get("recipient"),
+        "room_id": message.get("room_id"),
+        "content": message.get("content", ""),
+        "message_type": message.get("message_type", "TEXT"),
+        "is_read": message.get("is_read", False),
+        "timestamp": message["timestamp"],
+        "seq": message.get("seq"),
+    }
+
+
+async def _inbox_on_messages(messages: List[Dict[str, Any]]):
+    """
+    Cập nhật last_message / unread của mọi inbox chứa các tin nhắn bằng một bulk_write.
+    Mỗi hội thoại chỉ ghi tin cuối cùng của lô và cộng dồn unread.
+    """
+    rooms: Dict[str, Dict[str, Any]] = {}
+    directs: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for message in messages:
+        sender = message["sender"]
+        if message.get("room_id"):
+            room = rooms.setdefault(str(message["room_id"]), {"sent": {}})
+            room["last"] = message
+            room["sent"][sender] = room["sent"].get(sender, 0) + 1
+        elif message.get("recipient"):
+            recipient = message["recipient"]
+            for owner, other, unread in ((sender, recipient, 0), (recipient, sender, 1)):
+                entry = directs.setdefault((owner, other), {"unread": 0})
+                entry["last"] = message
+                entry["unread"] += unread
+    
+    def last(message: Dict[str, Any]) -> Dict[str, Any]:
+        return {"last_message": _inbox_preview(message), "last_activity": message["timestamp"]}
+    
+    operations: List[Any] = []
+    for room_id, room in rooms.items():
+        conversation = {"kind": INBOX_ROOM, "conversation_id": room_id}
+        operations.append(UpdateMany(conversation, {"$set": last(room["last"])}))
+        # Tin của sender tính unread cho mọi thành viên trừ chính sender
+        operations.extend(
+            UpdateMany({**conversation, "owner": {"$ne": sender}}, {"$inc": {"unread": sent}})
+            for sender, sent in room["sent"].items()
+        )
+    for (owner, other), entry in directs.items():
+        operations.append(UpdateOne(
+            {"owner": owner, "kind": INBOX_DIRECT, "conversation_id": other},
+            {"$set": last(entry["last"]), "$setOnInsert": {"title": other}, "$inc": {"unread": entry["unread"]}},
+            upsert=True,
+        ))
+    if operations:
+        await db.db["inbox"].bulk_write(operations, ordered=False)
+
+
+async def _inbox_on_direct_read(message: Dict[str, Any]):
+    """Giảm unread của người nhận khi một tin nhắn 1-1 được đánh dấu đã đọc"""
+    if message.get("room_id") or not message.get("recipient"):
+        return
+    await db.db["inbox"].update_one(
         {
-            "$set": {
-                "is_active": False,
-                "updated_at": datetime.utcnow(),
-            }
+            "owner": message["recipient"],
+            "kind": INBOX_DIRECT,
+            "conversation_id": message["sender"],
+            "unread": {"$gt": 0},
         },
+        {"$inc": {"unread": -1}},
     )
-    return result.modified_count > 0
+
+
+async def _inbox_add_room_members(room: Dict[str, Any], usernames: List[str]):
+    """Tạo entry inbox của phòng cho các thành viên mới"""
+    if not usernames:
+        return
+    room_id = str(room["_id"])
+    now = datetime.now(timezone.utc)
+    await db.db["inbox"].bulk_write([
+        UpdateOne(
+            {"owner": username, "kind": INBOX_ROOM, "conversation_id": room_id},
+            {
+                "$set": {"title": room.get("room_name")},
+                "$setOnInsert": {"last_message": None, "last_activity": now, "unread": 0},
+            },
+            upsert=True,
+        )
+        for username in usernames
+    ], ordered=False)
+
+
+@traced("db.get_inbox")
+async def get_inbox(username: str, limit: int = 100) -> List[Dict[str, Any]]:
+    """Lấy inbox của user, sắp xếp theo hoạt động gần nhất"""
+    return await storage.get_inbox(username, limit)
+
+
+@traced("db.mark_inbox_read")
+async def mark_inbox_read(username: str, kind: str, conversation_id: str) -> bool:
+    """Đặt unread = 0 cho một hội thoại (chat 1-1: đồng thời đánh dấu các tin nhắn đã đọc)"""
+    marked = await storage.mark_inbox_read(username, kind, conversation_id)
+    if marked is None:
+        return False
+    if marked:
+        change_versions.bump(conversation_key(username, conversation_id))
+    return True
+
+
+async def rebuild_inbox() -> int:
+    """
+    Dựng lại toàn bộ inbox từ rooms + messages (chạy một lần khi nâng cấp,
+    sau đó inbox được cập nhật tăng dần). Trả về số entry đã tạo.
+    """
+    inbox = db.db["inbox"]
+    await inbox.delete_many({})
+    operations: List[UpdateOne] = []
+    
+    async for room in db.db["rooms"].find({}, projection={"room_name": 1, "members": 1, "created_at": 1}):
+        latest = await get_room_messages(str(room["_id"]), 1)
+        last = latest[-1] if latest else None
+        for member in room.get("members", []):
+            operations.append(UpdateOne(
+                {"owner": member, "kind": INBOX_ROOM, "conversation_id": str(room["_id"])},
+                {"$set": {
+                    "title": room.get("room_name"),
+                    "last_message": _inbox_preview(last) if last else None,
+                    "last_activity": last["timestamp"] if last else room.get("created_at"),
+                    "unread": 0,
+                }},
+                upsert=True,
+            ))
+    
+    # Chat 1-1: duyệt tin nhắn mới nhất trước, tin đầu tiên gặp là last_message
+    unread: Dict[Tuple[str, str], int] = {}
+    direct: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    cursor = db.db["messages"].find({"room_id": None, "recipient": {"$ne": None}}).sort("timestamp", -1)
+    async for message in cursor:
+        sender, recipient = message["sender"], message["recipient"]
+        for owner, other in ((sender, recipient), (recipient, sender)):
+            if (owner, other) not in direct:
+                direct[(owner, other)] = message
+        if not message.get("is_read"):
+            unread[(recipient, sender)] = unread.get((recipient, sender), 0) + 1
+    for (owner, other), message in direct.items():
+        operations.append(UpdateOne(
+            {"owner": owner, "kind": INBOX_DIRECT, "conversation_id": other},
+            {"$set": {
+                "title": other,
+                "last_message": _inbox_preview(message),
+                "last_activity": message["timestamp"],
+                "unread": unread.get((owner, other), 0),
+            }},
+            upsert=True,
+        ))
+    
+    if operations:
+        await inbox.bulk_write(operations, ordered=False)
+    logger.info(f"Inbox rebuilt: {len(operations)} entries")
+    return len(operations)
+
+
+# ============ CHANGE LOG (DELTA SYNC) ============
+# Mỗi thay đổi mà client cần biết được ghi kèm seq toàn cục tăng dần.
+# "users" / "room_id" xác định ai thấy thay đổi; /api/sync đọc theo index (users|room_id, seq).
+
+CHANGE_MESSAGE = "message"
+CHANGE_MESSAGE_DELETED = "message_deleted"
+CHANGE_READ = "read"
+CHANGE_MEMBERSHIP = "membership"
+CHANGE_ROOM = "room"
+CHANGELOG_STREAM = "changelog"
+
+# seq đã cấp nhưng chưa ghi xong: sync không được đọc vượt qua seq nhỏ nhất ở đây,
+# nếu không client có thể bỏ lỡ vĩnh viễn một change ghi chậm
+_changes_in_flight: Set[int] = set()
+# Lần xin seq đang chờ reply $inc: counter trên server đã tăng nhưng chưa biết seq nào.
+# Mỗi phần tử là seq lớn nhất process đã thấy lúc bắt đầu xin, seq được cấp chắc chắn lớn hơn.
+# Cả hai chỉ theo dõi change do process này ghi: horizon chỉ an toàn khi chạy 1 worker.
+_changes_reserving: List[int] = []
+_changelog_seen = 0
+
+
+def _message_audience(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Ai thấy thay đổi của tin nhắn: cả phòng, hoặc hai người trong hội thoại"""
+    if message.get("room_id"):
+        return {"room_id": str(message["room_id"])}
+    return {"users": [u for u in (message.get("sender"), message.get("recipient")) if u]}
+
+
+def _room_snapshot(room: Dict[str, Any]) -> Dict[str, Any]:
+    """Metadata phòng lưu trong change log"""
+    return {
+        "_id": room["_id"],
+        "room_name": room.get("room_name"),
+        "description": room.get("description"),
+        "creator": room.get("creator"),
+        "members": room.get("members", []),
+        "created_at": room.get("created_at"),
+    }
+
+
+async def _log_change(kind: str, data: Dict[str, Any], users: Optional[List[str]] = None, room_id: Optional[str] = None):
+    """Ghi một thay đổi vào change log"""
+    await _log_changes([(kind, data, {"users": users, "room_id": room_id})])
+
+
+async def _log_changes(changes: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]):
+    """Ghi một lô thay đổi (kind, data, audience) bằng một dải seq và một insert_many"""
+    global _changelog_seen
+    if not changes:
+        return
+    floor = _changelog_seen
+    _changes_reserving.append(floor)
+    try:
+        last = await _next_seq(CHANGELOG_STREAM, len(changes))
+        seqs = range(last - len(changes) + 1, last + 1)
+        # Chuyển sang in-flight trước khi bỏ reservation (không có await ở giữa)
+        _changes_in_flight.update(seqs)
+    finally:
+        _changes_reserving.remove(floor)
+    _changelog_seen = max(_changelog_seen, last)
+    now = datetime.now(timezone.utc)
+    try:
+        await db.db["changes"].insert_many([
+            {
+                "seq": seq,
+                "kind": kind,
+                "users": audience.get("users") or [],
+                "room_id": audience.get("room_id"),
+                "data": data,
+                "created_at": now,
+            }
+            for seq, (kind, data, audience) in zip(seqs, changes)
+        ])
+    finally:
+        _changes_in_flight.difference_update(seqs)
+
+
+@traced("db.get_changes_since")
+async def get_changes_since(
+    username: str, room_ids: List[str], since: int, until: int, limit: int
+) -> List[Dict[str, Any]]:
+    """Thay đổi có since < seq <= until liên quan tới user (trực tiếp hoặc qua các phòng), sắp theo seq"""
+    audience: List[Dict[str, Any]] = [{"users": username}]
+    if room_ids:
+        audience.append({"room_id": {"$in": room_ids}})
+    cursor = (
+        db.db["changes"]
+        .find({"seq": {"$gt": since, "$lte": until}, "$or": audience})
+        .sort("seq", 1)
+        .limit(limit)
+    )
+    return [change async for change in cursor]
+
+
+@traced("db.get_changelog_bounds")
+async def get_changelog_bounds() -> Tuple[int, int, int]:
+    """
+    (seq cũ nhất còn giữ, seq an toàn để đọc tới, seq mới nhất đã cấp): seq an toàn là
+    seq mới nhất đã cấp, lùi về trước change đang ghi dở hoặc đang chờ cấp seq (nếu có)
+    """
+    global _changelog_seen
+    oldest, counter = await asyncio.gather(
+        db.db["changes"].find_one({}, sort=[("seq", 1)], projection={"seq": 1}),
+        db.db["counters"].find_one({"_id": CHANGELOG_STREAM}),
+    )
+    latest = head = counter["seq"] if counter else 0
+    # Đọc reservation / in-flight sau khi đã có head: lần xin seq bắt đầu sau đó nhận seq > head,
+    # còn lần xin đang chờ reply có thể đã được tính vào head nên lùi về mốc lúc nó bắt đầu
+    if _changes_reserving:
+        head = min(head, min(_changes_reserving))
+    if _changes_in_flight:
+        head = min(head, min(_changes_in_flight) - 1)
+    _changelog_seen = max(_changelog_seen, latest)
+    return (oldest["seq"] if oldest else latest + 1), head, latest
+
+
+# ============ OFFLINE DELIVERY QUEUE ============
+# Event WebSocket cho người nhận không online được xếp hàng theo user,
+# gửi bù khi họ kết nối và xóa khi client ack (hoặc khi hết hạn).
+
+@traced("db.enqueue_deliveries")
+async def enqueue_deliveries(entries: List[Dict[str, Any]]):
+    """Ghi một lô entry {username, event, created_at, expires_at}"""
+    if not entries:
+        return
+    try:
+        await db.db["pending_deliveries"].insert_many(entries, ordered=False)
+    except BulkWriteError as e:
+        # Ghi lại lô sau lần ghi dở: insert_many đã gán _id cho entry, trùng khóa = entry đã được ghi
+        errors = e.details.get("writeErrors", [])
+        if e.details.get("writeConcernErrors") or any(error.get("code") != 11000 for error in errors):
+            raise
+
+
+@traced("db.get_pending_deliveries")
+async def get_pending_deliveries(
+    username: str, limit: int, after: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Entry chưa ack của user, cũ -> mới, bắt đầu sau entry `after`"""
+    from bson.objectid import ObjectId
+    query: Dict[str, Any] = {"username": username, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    if after is not None:
+        query["_id"] = {"$gt": ObjectId(after)}
+    cursor = db.db["pending_deliveries"].find(query).sort("_id", 1).limit(limit)
+    return [entry async for entry in cursor]
+
+
+@traced("db.ack_deliveries")
+async def ack_deliveries(username: str, up_to: str) -> int:
+    """Xóa các entry của user tới (và gồm) `up_to`; trả về số entry đã xóa"""
+    from bson.objectid import ObjectId
+    if not ObjectId.is_valid(up_to):
+        return 0
+    result = await db.db["pending_deliveries"].delete_many(
+        {"username": username, "_id": {"$lte": ObjectId(up_to)}}
+    )
+    return result.deleted_count
+
+
+# ============ MESSAGE SEARCH ============
+# Inverted index trong "search_postings" (scope, term, message_id, tf) + "search_terms"
+# (_id = "<scope>\t<term>": df; term rỗng = số tin đã index của scope). Xem search.py.
+
+SEARCH_SCOPE_TOTAL = ""
+
+
+def _search_term_key(scope: str, term: str) -> str:
+    return f"{scope}\t{term}"
+
+
+def _searchable(message: Dict[str, Any]) -> bool:
+    return bool(message.get("content")) and message.get("message_type") != "SYSTEM"
+
+
+async def _search_index_messages(messages: List[Dict[str, Any]]):
+    """Index một lô tin nhắn: một insert_many posting, rồi một bulk_write df cho các posting đã ghi"""
+    if not settings.SEARCH_ENABLED:
+        return
+    postings: List[Dict[str, Any]] = []
+    for message in messages:
+        scope = message_stream(message)
+        if scope is None or not _searchable(message):
+            continue
+        for term, tf in term_frequencies(message["content"]).items():
+            postings.append({"scope": scope, "term": term, "message_id": message["_id"], "tf": tf})
+    if not postings:
+        return
+    duplicates = await _insert_postings(postings)
+    
+    # df chỉ tăng theo posting thực sự được ghi: index lại (hoặc rebuild chạy song song
+    # với lượt ghi mới) không làm lệch idf
+    increments: Dict[str, int] = {}
+    indexed = set()
+    for i, posting in enumerate(postings):
+        if i in duplicates:
+            continue
+        key = _search_term_key(posting["scope"], posting["term"])
+        increments[key] = increments.get(key, 0) + 1
+        indexed.add((posting["scope"], posting["message_id"]))
+    for scope, _ in indexed:
+        total_key = _search_term_key(scope, SEARCH_SCOPE_TOTAL)
+        increments[total_key] = increments.get(total_key, 0) + 1
+    if increments:
+        await db.db["search_terms"].bulk_write(
+            [UpdateOne({"_id": key}, {"$inc": {"df": count}}, upsert=True) for key, count in increments.items()],
+            ordered=False,
+        )
+    search_stats.indexed += len(indexed)
+    search_stats.postings += len(postings) - len(duplicates)
+
+
+async def _insert_postings(postings: List[Dict[str, Any]]) -> Set[int]:
+    """Ghi posting, bỏ qua posting đã có; trả về vị trí (trong postings) của các posting trùng"""
+    try:
+        await db.db["search_postings"].insert_many(postings, ordered=False)
+    except BulkWriteError as e:
+        # Tin nằm ở hai tầng (archive dở dang) hoặc đã được index: bỏ qua posting trùng
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errors):
+            raise
+        return {error["index"] for error in errors}
+    return set()
+
+
+async def _search_unindex_message(message_id: Any):
+    """Gỡ các posting của tin nhắn đã xóa"""
+    postings = [p async for p in db.db["search_postings"].find({"message_id": message_id}, projection={"scope": 1, "term": 1})]
+    if not postings:
+        return
+    keys = [_search_term_key(p["scope"], p["term"]) for p in postings]
+    keys.append(_search_term_key(postings[0]["scope"], SEARCH_SCOPE_TOTAL))
+    await asyncio.gather(
+        db.db["search_postings"].delete_many({"message_id": message_id}),
+        db.db["search_terms"].bulk_write(
+            [UpdateOne({"_id": key}, {"$inc": {"df": -1}}) for key in keys], ordered=False
+        ),
+    )
+
+
+async def _get_messages_by_ids(scope: str, ids: List[Any]) -> Dict[Any, Dict[str, Any]]:
+    """Tin nhắn theo _id ở mọi tầng lưu trữ: messages, bucket, rồi archive"""
+    found = {m["_id"]: m async for m in db.db["messages"].find({"_id": {"$in": ids}})}
+    missing = set(ids) - found.keys()
+    if missing and scope.startswith("room:"):
+        async for bucket in db.db["message_buckets"].find({"messages._id": {"$in": list(missing)}}):
+            found.update((m["_id"], m) for m in bucket["messages"] if m["_id"] in missing)
+        missing -= found.keys()
+    if missing:
+        cursor = db.db["message_archive"].find({
+            "scope": scope, "min_id": {"$lte": max(missing)}, "max_id": {"$gte": min(missing)},
+        })
+        async for segment in cursor:
+            found.update((m["_id"], m) for m in decode_segment(segment) if m["_id"] in missing)
+    return found
+
+
+@traced("db.search_messages")
+async def search_messages(
+    scope: str, query: str, limit: int, offset: int = 0
+) -> Tuple[List[Tuple[Dict[str, Any], float]], int, bool]:
+    """
+    Tin nhắn trong scope khớp mọi term của query, xếp theo điểm tf-idf (rồi độ mới).
+    Trả về ([(tin nhắn, điểm)] của trang, tổng số kết quả đã xếp hạng, truncated):
+    truncated = term hiếm nhất khớp nhiều hơn SEARCH_MAX_CANDIDATES tin, chỉ các tin gần nhất
+    được xếp hạng nên total chỉ là cận dưới.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return [], 0, False
+    search_stats.queries += 1
+    
+    keys = [_search_term_key(scope, term) for term in terms] + [_search_term_key(scope, SEARCH_SCOPE_TOTAL)]
+    counts = {d["_id"]: d["df"] async for d in db.db["search_terms"].find({"_id": {"$in": keys}})}
+    dfs = {term: counts.get(_search_term_key(scope, term), 0) for term in terms}
+    if min(dfs.values()) <= 0:
+        return [], 0, False
+    total = counts.get(_search_term_key(scope, SEARCH_SCOPE_TOTAL), 0)
+    idfs = {term: idf(total, df) for term, df in dfs.items()}
+    
+    # Term hiếm nhất cho tập ứng viên nhỏ nhất, các term còn lại chỉ kiểm tra trên tập đó
+    ordered = sorted(terms, key=dfs.get)
+    truncated = dfs[ordered[0]] > settings.SEARCH_MAX_CANDIDATES
+    postings = db.db["search_postings"]
+    cursor = (
+        postings.find({"scope": scope, "term": ordered[0]}, projection={"message_id": 1, "tf": 1})
+        .sort("message_id", -1)
+        .limit(settings.SEARCH_MAX_CANDIDATES)
+    )
+    candidates = {p["message_id"]: {ordered[0]: p["tf"]} async for p in cursor}
+    for term in ordered[1:]:
+        if not candidates:
+            break
+        matched: Dict[Any, Dict[str, int]] = {}
+        cursor = postings.find(
+            {"scope": scope, "term": term, "message_id": {"$in": list(candidates)}},
+            projection={"message_id": 1, "tf": 1},
+        )
+        async for posting in cursor:
+            tfs = candidates[posting["message_id"]]
+            tfs[term] = posting["tf"]
+            matched[posting["message_id"]] = tfs
+        candidates = matched
+    
+    ranked = sorted(
+        ((message_id, score(tfs, idfs)) for message_id, tfs in candidates.items()),
+        key=lambda item: (item[1], item[0]),
+        reverse=True,
+    )
+    page = ranked[offset:offset + limit]
+    if not page:
+        return [], len(ranked), truncated
+    messages = await _get_messages_by_ids(scope, [message_id for message_id, _ in page])
+    return [(messages[message_id], s) for message_id, s in page if message_id in messages], len(ranked), truncated
+
+
+async def rebuild_search_index() -> int:
+    """
+    Dựng lại search index từ mọi tầng lưu trữ (messages, bucket, archive) theo lô
+    SEARCH_REBUILD_BATCH_SIZE. Trả về số tin đã index.
+    """
+    await asyncio.gather(db.db["search_postings"].delete_many({}), db.db["search_terms"].delete_many({}))
+    indexed_before = search_stats.indexed
+    batch: List[Dict[str, Any]] = []
+    
+    async def add(message: Dict[str, Any]):
+        batch.append(message)
+        if len(batch) >= settings.SEARCH_REBUILD_BATCH_SIZE:
+            await _search_index_messages(batch)
+            batch.clear()
+    
+    async for message in db.db["messages"].find({"message_type": {"$ne": "SYSTEM"}}):
+        await add(message)
+    async for bucket in db.db["message_buckets"].find({}):
+        for message in bucket["messages"]:
+            await add(message)
+    async for segment in db.db["message_archive"].find({}):
+        for message in decode_segment(segment):
+            await add(message)
+    if batch:
+        await _search_index_messages(batch)
+    indexed = search_stats.indexed - indexed_before
+    logger.info(f"Search index rebuilt: {indexed} messages")
+    return indexed
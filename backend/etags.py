@@ -0,0 +1,84 @@
+"""
+ETag & Conditional GET cho RealChat - dựa trên bộ đếm thay đổi (change counter)
+
+Mỗi tài nguyên (danh sách users, danh sách phòng, lịch sử phòng, hội thoại 1-1)
+có một bộ đếm được tăng bởi các hàm ghi trong database.py. ETag được dựng từ
+bộ đếm nên kiểm tra If-None-Match không cần truy vấn MongoDB hay hash body.
+
+Lưu ý: bộ đếm nằm trong bộ nhớ process. Epoch ngẫu nhiên được gắn vào ETag
+để ETag cũ bị vô hiệu sau khi restart.
+"""
+from collections import defaultdict
+from typing import Dict, Optional
+from starlette.requests import Request
+from starlette.responses import Response
+import uuid
+
+USERS_KEY = "users"
+ROOMS_KEY = "rooms"
+
+
+def room_key(room_id: str) -> str:
+    """Key cho lịch sử tin nhắn của phòng (id viết thường như str(ObjectId) để mọi cách viết cùng một key)"""
+    return f"room:{room_id.lower()}"
+
+
+def conversation_key(user1: str, user2: str) -> str:
+    """Key cho hội thoại 1-1 (không phụ thuộc thứ tự)"""
+    a, b = sorted((user1, user2))
+    return f"conv:{a}|{b}"
+
+
+class ChangeVersions:
+    """Bộ đếm phiên bản theo key, tăng mỗi khi dữ liệu tương ứng thay đổi"""
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._versions: Dict[str, int] = defaultdict(int)
+
+    def bump(self, *keys: str):
+        """Tăng phiên bản cho các key"""
+        for key in keys:
+            self._versions[key] += 1
+
+    def get(self, key: str) -> int:
+        return self._versions.get(key, 0)
+
+    def etag(self, key: str, *variant: object) -> str:
+        """
+        Dựng weak ETag từ phiên bản hiện tại
+        - variant: tham số ảnh hưởng tới body (limit, username...)
+        """
+        suffix = "-".join(str(v) for v in variant)
+        return f'W/"{self.epoch}-{self.get(key)}-{suffix}"'
+
+
+change_versions = ChangeVersions()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """So khớp If-None-Match (weak comparison, hỗ trợ danh sách và '*')"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Trả về response 304 nếu client đã có phiên bản hiện tại, ngược lại None"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    return None
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    """Headers đi kèm response có ETag (buộc client revalidate)"""
+    return {"ETag": etag, "Cache-Control": "no-cache"}
@@ -0,0 +1,101 @@
+"""
+Event Loop Monitor cho RealChat - đo độ trễ lập lịch và phát hiện code blocking
+
+- Task nền ngủ LOOP_MONITOR_INTERVAL_MS rồi đo thời gian thực tế bị trễ (lag)
+- Thread watchdog kiểm tra heartbeat của task đó; nếu loop không phản hồi quá
+  LOOP_BLOCK_THRESHOLD_MS thì chụp stack của thread event loop và ghi log,
+  nên thấy ngay đoạn code đang block (bcrypt, list comprehension lớn...)
+"""
+from typing import Optional
+from config import settings
+from metrics import registry
+import asyncio
+import sys
+import threading
+import time
+import traceback
+import logging
+
+logger = logging.getLogger(__name__)
+
+loop_lag_seconds = registry.gauge(
+    "realchat_event_loop_lag_seconds", "Most recent event loop scheduling lag"
+)
+loop_lag_histogram = registry.histogram(
+    "realchat_event_loop_lag", "Event loop scheduling lag distribution (seconds)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+loop_blocked_total = registry.counter(
+    "realchat_event_loop_blocked_total", "Times the event loop was blocked longer than the threshold"
+)
+
+
+class EventLoopMonitor:
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.2):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.max_lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def _measure(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._heartbeat = time.monotonic()
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            loop_lag_seconds.set(lag)
+            loop_lag_histogram.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self):
+        reported_heartbeat = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.block_threshold or heartbeat == reported_heartbeat:
+                continue
+            # Chỉ log một lần cho mỗi lần block
+            reported_heartbeat = heartbeat
+            loop_blocked_total.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+            logger.warning(
+                f"Event loop blocked for {stalled * 1000:.0f}ms+ "
+                f"(threshold {self.block_threshold * 1000:.0f}ms). Stack:\n{stack}"
+            )
+
+    def start(self):
+        """Khởi động (gọi từ trong event loop)"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="realchat-loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+
+
+loop_monitor = EventLoopMonitor(
+    interval=settings.LOOP_MONITOR_INTERVAL_MS / 1000,
+    block_threshold=settings.LOOP_BLOCK_THRESHOLD_MS / 1000,
+)
+
+registry.gauge(
+    "realchat_event_loop_lag_max_seconds", "Largest event loop lag since startup",
+    callback=lambda: {(): loop_monitor.max_lag},
+)
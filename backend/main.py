@@ -4,9 +4,15 @@ High-performance chat application with MongoDB
 """
 from fastapi import FastAPI, status, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
 from config import settings
-from database import db
+from database import storage, load_username_filter, load_username_index, refresh_username_filter, run_archiver
+from profiler import install_signal_handler
+from loop_monitor import loop_monitor
+from tracing import tracer
+from offline_queue import offline_queue
+import asyncio
 import logging
 
 # Configure logging
@@ -18,9 +24,13 @@ logger = logging.getLogger(__name__)
 
 # Import routes
 from routes.auth import router as auth_router
-from routes.messages import router as messages_router
+from routes.messages import router as messages_router, manager
 from routes.users import router as users_router
 from routes.rooms import router as rooms_router
+from routes.inbox import router as inbox_router
+from routes.sync import router as sync_router
+from routes.search import router as search_router
+from routes.admin import router as admin_router
 
 
 # ============ LIFESPAN EVENTS ============
@@ -32,11 +42,38 @@ async def lifespan(app: FastAPI):
     """
     # Startup
     logger.info("🚀 Starting RealChat FastAPI server...")
-    await db.connect_db()
+    await storage.connect()
+    logger.info(f"Storage engine: {storage.name}")
+    refresh_task = None
+    if settings.USERNAME_FILTER_ENABLED:
+        logger.info(f"Username filter loaded ({await load_username_filter()} users)")
+    if settings.USERNAME_SEARCH_ENABLED:
+        logger.info(f"Username prefix index loaded ({await load_username_index()} users)")
+    if (settings.USERNAME_FILTER_ENABLED or settings.USERNAME_SEARCH_ENABLED) and settings.USERNAME_FILTER_REFRESH_SECONDS > 0:
+        refresh_task = asyncio.create_task(refresh_username_filter(settings.USERNAME_FILTER_REFRESH_SECONDS))
+    if install_signal_handler(asyncio.get_running_loop()):
+        logger.info("Profiler signal handler installed (SIGUSR2)")
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    if settings.OFFLINE_QUEUE_ENABLED:
+        offline_queue.start()
+    archive_task = None
+    if settings.ARCHIVE_ENABLED:
+        archive_task = asyncio.create_task(run_archiver(settings.ARCHIVE_INTERVAL_MINUTES * 60))
     yield
     # Shutdown
     logger.info("🛑 Shutting down RealChat server...")
-    await db.close_db()
+    if refresh_task is not None:
+        refresh_task.cancel()
+    if archive_task is not None:
+        archive_task.cancel()
+    if settings.LOOP_MONITOR_ENABLED:
+        await loop_monitor.stop()
+    if settings.OFFLINE_QUEUE_ENABLED:
+        await offline_queue.stop()
+    if settings.TRACING_ENABLED and tracer.spans:
+        tracer.write()
+    await storage.close()
 
 
 # ============ CREATE APP ============
@@ -52,6 +89,26 @@ app = FastAPI(
 
 # Import security middleware
 from middleware import RateLimitMiddleware, SecurityHeadersMiddleware
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware, render_metrics
+from profiler import ProfilerMiddleware
+from tracing import TracingMiddleware
+
+# Request tracing (sát route handler nhất, span database/fanout là con của span này)
+if settings.TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
+
+# Per-request profiler (chỉ hoạt động khi PROFILER_ENABLED)
+if settings.PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
+
+# Compression middleware (innermost, nén body cuối cùng)
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.COMPRESSION_MIN_SIZE,
+        cache_size=settings.COMPRESSION_CACHE_SIZE,
+    )
 
 # Security middleware (add first)
 app.add_middleware(SecurityHeadersMiddleware)
@@ -66,6 +123,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Metrics middleware (outermost, đo cả thời gian của các middleware khác)
+app.add_middleware(MetricsMiddleware)
+
 
 # ============ ROUTES ============
 
@@ -90,15 +150,26 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "RealChat API",
-        "version": "2.0.0"
+        "version": "2.0.0",
+        "websocket": manager.stats()
     }
 
 
+@app.get("/metrics", tags=["health"], include_in_schema=False)
+async def metrics():
+    """Prometheus metrics endpoint"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # Include routers (auth already has /api prefix in its definition)
 app.include_router(auth_router)
 app.include_router(messages_router)
 app.include_router(users_router)
 app.include_router(rooms_router)
+app.include_router(inbox_router)
+app.include_router(sync_router)
+app.include_router(search_router)
+app.include_router(admin_router)
 
 
 # ============ ERROR HANDLERS ============
@@ -119,5 +190,6 @@ if __name__ == "__main__":
         host=settings.HOST,
         port=settings.PORT,
         reload=settings.DEBUG,
+        workers=settings.WORKERS,
         log_level="info"
     )
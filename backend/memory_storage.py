@@ -0,0 +1,407 @@
+"""
+Memory Storage cho RealChat - storage engine trong bộ nhớ process (STORAGE_ENGINE="memory")
+
+- Chạy toàn bộ API trên một máy không cần MongoDB (dev, demo, edge một node)
+- Đo overhead của FastAPI / middleware / serialization tách khỏi độ trễ database:
+  chạy server với STORAGE_ENGINE=memory rồi `python run_tests.py --bench`
+- Dữ liệu mất khi restart; chỉ chạy 1 worker (mỗi process có dữ liệu riêng)
+
+Cấu trúc: dict theo khóa chính + index phụ cho các truy vấn của API. Lịch sử phòng /
+hội thoại là list sắp theo _id (ObjectId tăng dần theo thời gian tạo), phân trang bằng tìm kiếm nhị phân.
+Mọi document trả ra là bản sao để caller sửa thoải mái mà không làm hỏng dữ liệu đã lưu.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from etags import conversation_key
+from replay import message_stream
+from storage import INBOX_DIRECT, INBOX_ROOM, StorageEngine
+
+
+def _object_id(value: Any) -> Optional[ObjectId]:
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _copy_room(room: Dict[str, Any]) -> Dict[str, Any]:
+    return {**room, "members": list(room["members"])}
+
+
+def _public_user(user: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in user.items() if k != "password_hash"}
+
+
+def _bisect(history: List[Dict[str, Any]], message_id: ObjectId) -> int:
+    """Vị trí đầu tiên có _id >= message_id (bisect_left theo _id, chạy được trên Python 3.8)"""
+    low, high = 0, len(history)
+    while low < high:
+        middle = (low + high) // 2
+        if history[middle]["_id"] < message_id:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _latest(history: List[Dict[str, Any]], limit: int, before: Optional[ObjectId] = None) -> List[Dict[str, Any]]:
+    """limit tin mới nhất (cũ -> mới) có _id < before trong list đã sắp theo _id"""
+    end = len(history) if before is None else _bisect(history, before)
+    return [dict(m) for m in history[max(0, end - limit):end]] if limit > 0 else []
+
+
+def _remove(history: List[Dict[str, Any]], message_id: ObjectId):
+    position = _bisect(history, message_id)
+    if position < len(history) and history[position]["_id"] == message_id:
+        del history[position]
+
+
+class MemoryStorage(StorageEngine):
+    """Lưu trữ trong bộ nhớ"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.user_ids: Dict[ObjectId, str] = {}
+        self.emails: Set[str] = set()
+        self.messages: Dict[ObjectId, Dict[str, Any]] = {}
+        self.room_history: Dict[ObjectId, List[Dict[str, Any]]] = defaultdict(list)
+        self.conversations: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.unread: Dict[str, Dict[ObjectId, Dict[str, Any]]] = defaultdict(dict)  # recipient -> tin 1-1 chưa đọc
+        self.seqs: Dict[str, int] = defaultdict(int)
+        self.rooms: Dict[ObjectId, Dict[str, Any]] = {}
+        self.room_names: Set[str] = set()
+        self.user_rooms: Dict[str, Set[ObjectId]] = defaultdict(set)
+        self.files: Dict[ObjectId, Dict[str, Any]] = {}
+        self.user_files: Dict[str, List[ObjectId]] = defaultdict(list)
+        self.invitations: Dict[str, Dict[str, Any]] = {}
+        self.inbox: Dict[str, Dict[Tuple[str, str], Dict[str, Any]]] = defaultdict(dict)
+
+    # ---------- users ----------
+
+    async def create_user(self, user: Dict[str, Any]):
+        username, email = user["username"], user.get("email")
+        if username in self.users or (email and email in self.emails):
+            raise ValueError(f"Username '{username}' hoặc email đã tồn tại")
+        user["_id"] = ObjectId()
+        self.users[username] = dict(user)
+        self.user_ids[user["_id"]] = username
+        if email:
+            self.emails.add(email)
+
+    async def user_exists(self, username: str) -> bool:
+        return username in self.users
+
+    async def existing_usernames(self, usernames: List[str]) -> Set[str]:
+        return {username for username in usernames if username in self.users}
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        user = self.users.get(username)
+        return dict(user) if user else None
+
+    async def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.get_user(self.user_ids.get(ObjectId(user_id), ""))
+
+    async def get_all_users(self) -> List[Dict[str, Any]]:
+        return [_public_user(user) for user in self.users.values()]
+
+    async def get_online_users(self) -> List[Dict[str, Any]]:
+        return [_public_user(user) for user in self.users.values() if user.get("is_online")]
+
+    async def update_user_online_status(self, username: str, is_online: bool) -> bool:
+        user = self.users.get(username)
+        if user is None:
+            return False
+        now = datetime.now(timezone.utc)
+        user.update(is_online=is_online, last_login=now if is_online else None, updated_at=now)
+        return True
+
+    async def count_users(self) -> int:
+        return len(self.users)
+
+    async def iter_usernames(self, since: Optional[datetime] = None) -> AsyncIterator[Tuple[str, Optional[datetime]]]:
+        for username, user in list(self.users.items()):
+            created_at = user.get("created_at")
+            if since is None or (created_at is not None and created_at >= since):
+                yield username, created_at
+
+    # ---------- messages ----------
+
+    async def save_message(self, message: Dict[str, Any]):
+        stream = message_stream(message)
+        if stream:
+            self.seqs[stream] += 1
+            message["seq"] = self.seqs[stream]
+        message["_id"] = ObjectId()
+        stored = dict(message)
+        self.messages[stored["_id"]] = stored
+        if stored.get("room_id"):
+            self.room_history[stored["room_id"]].append(stored)
+        elif stored.get("recipient"):
+            self.conversations[stream].append(stored)
+            self.unread[stored["recipient"]][stored["_id"]] = stored
+        self._inbox_on_message(stored)
+
+    async def save_messages(self, messages: List[Dict[str, Any]]):
+        for message in messages:
+            await self.save_message(message)
+
+    async def get_stream_seqs(self, streams: List[str]) -> Dict[str, int]:
+        return {stream: self.seqs[stream] for stream in streams if stream in self.seqs}
+
+    async def get_private_messages(self, user1: str, user2: str, limit: int) -> List[Dict[str, Any]]:
+        return _latest(self.conversations.get(conversation_key(user1, user2), []), limit)
+
+    async def get_room_messages(self, room_id: str, limit: int, before: Optional[str]) -> List[Dict[str, Any]]:
+        room_oid = _object_id(room_id)
+        before_oid = _object_id(before) if before else None
+        if room_oid is None or (before and before_oid is None):
+            return []
+        return _latest(self.room_history.get(room_oid, []), limit, before_oid)
+
+    async def mark_message_as_read(self, message_id: str) -> Optional[Dict[str, Any]]:
+        message = self.messages.get(ObjectId(message_id))
+        if message is None:
+            return None
+        previous = {k: message.get(k) for k in ("_id", "sender", "recipient", "room_id", "is_read")}
+        if not message["is_read"]:
+            message["is_read"] = True
+            message["updated_at"] = datetime.now(timezone.utc)
+            if message.get("recipient") and not message.get("room_id"):
+                self.unread[message["recipient"]].pop(message["_id"], None)
+                entry = self.inbox[message["recipient"]].get((INBOX_DIRECT, message["sender"]))
+                if entry and entry["unread"] > 0:
+                    entry["unread"] -= 1
+        return previous
+
+    async def delete_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        message = self.messages.pop(ObjectId(message_id), None)
+        if message is None:
+            return None
+        if message.get("room_id"):
+            _remove(self.room_history[message["room_id"]], message["_id"])
+        elif message.get("recipient"):
+            _remove(self.conversations[message_stream(message)], message["_id"])
+            self.unread[message["recipient"]].pop(message["_id"], None)
+        return dict(message)
+
+    async def get_unread_messages(self, username: str) -> List[Dict[str, Any]]:
+        unread = sorted(self.unread.get(username, {}).values(), key=lambda m: m["timestamp"], reverse=True)
+        return [dict(m) for m in unread]
+
+    # ---------- rooms ----------
+
+    async def create_room(self, room: Dict[str, Any]):
+        if room["room_name"] in self.room_names:
+            raise ValueError(f"Phòng '{room['room_name']}' đã tồn tại")
+        room["_id"] = ObjectId()
+        self.rooms[room["_id"]] = _copy_room(room)
+        self.room_names.add(room["room_name"])
+        for member in room["members"]:
+            self.user_rooms[member].add(room["_id"])
+        self._inbox_add_room_members(room, room["members"])
+
+    def _find_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        room_oid = _object_id(room_id)
+        return self.rooms.get(room_oid) if room_oid else None
+
+    async def get_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        room = self._find_room(room_id)
+        return _copy_room(room) if room else None
+
+    async def get_all_rooms(self) -> List[Dict[str, Any]]:
+        return [_copy_room(room) for room in sorted(self.rooms.values(), key=lambda r: r["created_at"], reverse=True)]
+
+    async def join_room(self, room_id: str, username: str) -> bool:
+        return (await self.add_room_member(room_id, username))[1]
+
+    async def leave_room(self, room_id: str, username: str) -> bool:
+        return (await self.remove_room_member(room_id, username))[1]
+
+    async def add_room_member(self, room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        room = self._find_room(room_id)
+        if room is None:
+            return None, False
+        room["updated_at"] = datetime.now(timezone.utc)
+        joined = username not in room["members"]
+        if joined:
+            room["members"].append(username)
+            self.user_rooms[username].add(room["_id"])
+            self._inbox_add_room_members(room, [username])
+        return _copy_room(room), joined
+
+    async def remove_room_member(self, room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        room = self._find_room(room_id)
+        if room is None:
+            return None, False
+        room["updated_at"] = datetime.now(timezone.utc)
+        left = username in room["members"]
+        if left:
+            room["members"] = [m for m in room["members"] if m != username]
+            self.user_rooms[username].discard(room["_id"])
+            self.inbox[username].pop((INBOX_ROOM, str(room["_id"])), None)
+        return _copy_room(room), left
+
+    async def add_room_members(self, room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        room = self._find_room(room_id)
+        if room is None:
+            return None, []
+        room["updated_at"] = datetime.now(timezone.utc)
+        members = set(room["members"])
+        added = [username for username in dict.fromkeys(usernames) if username not in members]
+        room["members"].extend(added)
+        for username in added:
+            self.user_rooms[username].add(room["_id"])
+        self._inbox_add_room_members(room, added)
+        return _copy_room(room), added
+
+    async def remove_room_members(self, room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        room = self._find_room(room_id)
+        if room is None:
+            return None, []
+        room["updated_at"] = datetime.now(timezone.utc)
+        leaving = set(usernames)
+        removed = [m for m in room["members"] if m in leaving]
+        room["members"] = [m for m in room["members"] if m not in leaving]
+        for username in removed:
+            self.user_rooms[username].discard(room["_id"])
+            self.inbox[username].pop((INBOX_ROOM, str(room["_id"])), None)
+        return _copy_room(room), removed
+
+    async def get_room_members(self, room_id: str) -> Optional[List[str]]:
+        room = self._find_room(room_id)
+        return list(room["members"]) if room else None
+
+    async def get_member_room_ids(self, username: str, object_ids: List[Any]) -> List[str]:
+        rooms = self.user_rooms.get(username, set())
+        return [str(room_id) for room_id in object_ids if room_id in rooms]
+
+    async def get_user_room_ids(self, username: str) -> List[str]:
+        return [str(room_id) for room_id in self.user_rooms.get(username, ())]
+
+    async def get_user_rooms(self, username: str) -> List[Dict[str, Any]]:
+        rooms = (self.rooms[room_id] for room_id in self.user_rooms.get(username, ()))
+        return [_copy_room(room) for room in sorted(rooms, key=lambda r: r["created_at"], reverse=True)]
+
+    # ---------- files ----------
+
+    async def save_file(self, file_obj: Dict[str, Any]):
+        file_obj["_id"] = ObjectId()
+        self.files[file_obj["_id"]] = dict(file_obj)
+        for username in {file_obj["sender"], file_obj.get("recipient")} - {None}:
+            self.user_files[username].append(file_obj["_id"])
+
+    async def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        file_obj = self.files.get(ObjectId(file_id))
+        return dict(file_obj) if file_obj else None
+
+    async def get_user_files(self, username: str, limit: int) -> List[Dict[str, Any]]:
+        file_ids = self.user_files.get(username, [])
+        newest = [self.files[file_id] for file_id in reversed(file_ids[-limit:])] if limit > 0 else []
+        return [{k: v for k, v in f.items() if k != "file_data"} for f in newest]
+
+    # ---------- invitation links ----------
+
+    async def create_invitation_link(self, invitation: Dict[str, Any]):
+        if invitation["invite_code"] in self.invitations:
+            raise ValueError(f"Invite code '{invitation['invite_code']}' đã tồn tại")
+        invitation["_id"] = ObjectId()
+        self.invitations[invitation["invite_code"]] = {**invitation, "used_by": list(invitation["used_by"])}
+
+    def _link_copy(self, invite_code: str) -> Optional[Dict[str, Any]]:
+        link = self.invitations.get(invite_code)
+        return {**link, "used_by": list(link["used_by"])} if link else None
+
+    async def get_invitation_link(self, invite_code: str) -> Optional[Dict[str, Any]]:
+        return self._link_copy(invite_code)
+
+    async def use_invitation_link(self, invite_code: str, username: str) -> bool:
+        link = self.invitations.get(invite_code)
+        if link is None:
+            return False
+        link["updated_at"] = datetime.utcnow()
+        if username not in link["used_by"]:
+            link["used_by"].append(username)
+        return True
+
+    async def redeem_invitation_link(self, invite_code: str, username: str, now: datetime) -> Optional[Dict[str, Any]]:
+        link = self.invitations.get(invite_code)
+        if link is None or not link.get("is_active") or link["expires_at"] <= now:
+            return None
+        # Trả về trạng thái trước khi cập nhật, như find_one_and_update
+        previous = self._link_copy(invite_code)
+        link["updated_at"] = now
+        if username not in link["used_by"]:
+            link["used_by"].append(username)
+        return previous
+
+    async def get_room_invitation_links(self, room_id: str) -> List[Dict[str, Any]]:
+        links = [code for code, link in self.invitations.items() if link["room_id"] == room_id]
+        return [self._link_copy(code) for code in reversed(links)]
+
+    async def disable_invitation_link(self, invite_code: str) -> bool:
+        link = self.invitations.get(invite_code)
+        if link is None:
+            return False
+        changed = link["is_active"]
+        link.update(is_active=False, updated_at=datetime.utcnow())
+        return changed
+
+    # ---------- inbox ----------
+
+    def _inbox_on_message(self, message: Dict[str, Any]):
+        """Cập nhật last_message / unread như _inbox_on_message của MongoDB"""
+        sender = message["sender"]
+        last = {"last_message": dict(message), "last_activity": message["timestamp"]}
+        if message.get("room_id"):
+            key = (INBOX_ROOM, str(message["room_id"]))
+            room = self.rooms.get(message["room_id"])
+            for member in room["members"] if room else ():
+                entry = self.inbox[member].get(key)
+                if entry is not None:
+                    entry.update(last)
+                    if member != sender:
+                        entry["unread"] += 1
+        elif message.get("recipient"):
+            recipient = message["recipient"]
+            for owner, other, unread in ((sender, recipient, 0), (recipient, sender, 1)):
+                entry = self.inbox[owner].setdefault(
+                    (INBOX_DIRECT, other),
+                    {"owner": owner, "kind": INBOX_DIRECT, "conversation_id": other, "title": other, "unread": 0},
+                )
+                entry.update(last)
+                entry["unread"] += unread
+
+    def _inbox_add_room_members(self, room: Dict[str, Any], usernames: List[str]):
+        room_id = str(room["_id"])
+        now = datetime.now(timezone.utc)
+        for username in usernames:
+            entry = self.inbox[username].setdefault((INBOX_ROOM, room_id), {
+                "owner": username, "kind": INBOX_ROOM, "conversation_id": room_id,
+                "last_message": None, "last_activity": now, "unread": 0,
+            })
+            entry["title"] = room.get("room_name")
+
+    async def get_inbox(self, username: str, limit: int) -> List[Dict[str, Any]]:
+        entries = sorted(self.inbox.get(username, {}).values(), key=lambda e: e["last_activity"], reverse=True)
+        return [dict(entry) for entry in entries[:limit]]
+
+    async def mark_inbox_read(self, username: str, kind: str, conversation_id: str) -> Optional[int]:
+        entry = self.inbox.get(username, {}).get((kind, conversation_id))
+        if entry is None:
+            return None
+        entry["unread"] = 0
+        if kind != INBOX_DIRECT:
+            return 0
+        now = datetime.now(timezone.utc)
+        pending = self.unread.get(username, {})
+        read = [m for m in pending.values() if m["sender"] == conversation_id]
+        for message in read:
+            message["is_read"] = True
+            message["updated_at"] = now
+            del pending[message["_id"]]
+        return len(read)
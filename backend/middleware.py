@@ -1,20 +1,21 @@
 """
 Security Middleware cho RealChat
 """
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from typing import Callable
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+from config import settings
+from metrics import rate_limit_rejections_total
 import time
 from collections import defaultdict
 import html
+import json
 import re
 
 # Simple rate limiter
 class RateLimiter:
     def __init__(self):
         self.requests = defaultdict(list)
-        self.max_requests = 100  # Max requests per window
-        self.window = 60  # 60 seconds
+        self.max_requests = settings.RATE_LIMIT_MAX_REQUESTS  # Max requests per window
+        self.window = settings.RATE_LIMIT_WINDOW  # seconds
     
     def is_allowed(self, identifier: str) -> bool:
         now = time.time()
@@ -36,42 +37,87 @@ class RateLimiter:
 
 rate_limiter = RateLimiter()
 
+# Các path không bị giới hạn (health checks, docs)
+RATE_LIMIT_EXEMPT_PATHS = frozenset(["/health", "/metrics", "/", "/docs", "/openapi.json"])
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """Rate limiting middleware"""
+# Security headers được tính sẵn dưới dạng bytes (ASGI headers)
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+]
+_SECURITY_HEADER_NAMES = frozenset(name for name, _ in SECURITY_HEADERS)
+
+# Response 429 dựng sẵn, gửi thẳng mà không đi qua router
+_TOO_MANY_REQUESTS_BODY = json.dumps(
+    {"detail": "Too many requests. Please try again later."}
+).encode("utf-8")
+_TOO_MANY_REQUESTS_START: Message = {
+    "type": "http.response.start",
+    "status": 429,
+    "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(_TOO_MANY_REQUESTS_BODY)).encode("latin-1")),
+        (b"retry-after", str(rate_limiter.window).encode("latin-1")),
+        *SECURITY_HEADERS,
+    ],
+}
+_TOO_MANY_REQUESTS_BODY_MESSAGE: Message = {
+    "type": "http.response.body",
+    "body": _TOO_MANY_REQUESTS_BODY,
+}
+
+
+class RateLimitMiddleware:
+    """Rate limiting middleware (ASGI thuần, không dùng BaseHTTPMiddleware)"""
     
-    async def dispatch(self, request: Request, call_next: Callable):
-        # Get client IP
-        client_ip = request.client.host
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Chỉ áp dụng cho HTTP, bỏ qua websocket/lifespan và health checks
+        if scope["type"] != "http" or scope["path"] in RATE_LIMIT_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
         
-        # Skip rate limiting for health checks
-        if request.url.path in ["/health", "/", "/docs", "/openapi.json"]:
-            return await call_next(request)
+        # Get client IP
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
         
         # Check rate limit
         if not rate_limiter.is_allowed(client_ip):
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Too many requests. Please try again later."
-            )
+            rate_limit_rejections_total.inc()
+            await send(_TOO_MANY_REQUESTS_START)
+            await send(_TOO_MANY_REQUESTS_BODY_MESSAGE)
+            return
         
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
 
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    """Add security headers to responses"""
+class SecurityHeadersMiddleware:
+    """Add security headers to responses (ASGI thuần)"""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
     
-    async def dispatch(self, request: Request, call_next: Callable):
-        response = await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # Add security headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                # Ghi đè header trùng tên để giữ hành vi cũ
+                headers = [
+                    header for header in message.get("headers", [])
+                    if header[0].lower() not in _SECURITY_HEADER_NAMES
+                ]
+                headers.extend(SECURITY_HEADERS)
+                message["headers"] = headers
+            await send(message)
         
-        return response
+        await self.app(scope, receive, send_with_headers)
 
 
 def sanitize_html(text: str) -> str:
@@ -0,0 +1,109 @@
+"""
+Chuyển tin nhắn phòng giữa hai kiểu lưu trữ (MESSAGE_STORAGE):
+- document -> bucketed: gom tin của từng phòng (theo _id) vào bucket MESSAGE_BUCKET_SIZE tin /
+  MESSAGE_BUCKET_SPAN_HOURS giờ trong "message_buckets"
+- bucketed -> document: tách bucket trở lại thành từng document trong "messages"
+
+Tin đã có ở đích được bỏ qua nên chạy lại an toàn. Nên dừng server (hoặc chạy trước khi đổi
+MESSAGE_STORAGE) để không có tin ghi vào kiểu cũ trong lúc migrate.
+
+Chạy từ thư mục backend:
+    python migrate_message_buckets.py --to bucketed --delete-source
+    python migrate_message_buckets.py --to document --delete-source
+"""
+import argparse
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError
+
+from config import settings
+from database import db, new_bucket
+
+logger = logging.getLogger("migrate_message_buckets")
+
+
+def split_into_buckets(messages: List[Dict[str, Any]], size: int, span: timedelta) -> List[List[Dict[str, Any]]]:
+    """Chia tin nhắn (đã sắp theo _id) thành các nhóm không vượt quá size tin / span thời gian"""
+    groups: List[List[Dict[str, Any]]] = []
+    for message in messages:
+        current = groups[-1] if groups else None
+        if current is None or len(current) >= size or message["timestamp"] - current[0]["timestamp"] > span:
+            groups.append([message])
+        else:
+            current.append(message)
+    return groups
+
+
+async def migrate_to_buckets(
+    database: AsyncIOMotorDatabase, size: int, span: timedelta, delete_source: bool = False
+) -> int:
+    """Chuyển tin nhắn phòng từ "messages" sang "message_buckets"; trả về số tin đã chuyển"""
+    migrated = 0
+    for room_id in await database["messages"].distinct("room_id", {"room_id": {"$ne": None}}):
+        existing = set()
+        async for bucket in database["message_buckets"].find({"room_id": room_id}, projection={"messages._id": 1}):
+            existing.update(m["_id"] for m in bucket["messages"])
+
+        source = [m async for m in database["messages"].find({"room_id": room_id}).sort("_id", 1)]
+        messages = [m for m in source if m["_id"] not in existing]
+        if messages:
+            await database["message_buckets"].insert_many(
+                [new_bucket(room_id, group) for group in split_into_buckets(messages, size, span)]
+            )
+        if delete_source and source:
+            # Chỉ xóa phần đã đọc, tin ghi sau đó (nếu có) vẫn còn nguyên
+            await database["messages"].delete_many({"room_id": room_id, "_id": {"$lte": source[-1]["_id"]}})
+        migrated += len(messages)
+        logger.info(f"Room {room_id}: {len(messages)} messages bucketed")
+    return migrated
+
+
+async def migrate_to_documents(database: AsyncIOMotorDatabase, delete_source: bool = False) -> int:
+    """Tách "message_buckets" trở lại thành document trong "messages"; trả về số tin đã chuyển"""
+    migrated = 0
+    async for bucket in database["message_buckets"].find({}):
+        if bucket["messages"]:
+            try:
+                result = await database["messages"].insert_many(bucket["messages"], ordered=False)
+                migrated += len(result.inserted_ids)
+            except BulkWriteError as e:
+                # Tin đã có trong "messages" (chạy lại sau lần migrate dở)
+                migrated += e.details.get("nInserted", 0)
+        if delete_source:
+            await database["message_buckets"].delete_one({"_id": bucket["_id"]})
+    return migrated
+
+
+async def run(args: argparse.Namespace):
+    await db.connect_db()
+    try:
+        if args.to == "bucketed":
+            count = await migrate_to_buckets(
+                db.db, args.bucket_size, timedelta(hours=args.span_hours), args.delete_source
+            )
+        else:
+            count = await migrate_to_documents(db.db, args.delete_source)
+        print(f"Migrated {count} room messages to {args.to} storage")
+        if settings.MESSAGE_STORAGE != args.to:
+            print(f"Remember to set MESSAGE_STORAGE={args.to}")
+    finally:
+        await db.close_db()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", choices=["bucketed", "document"], required=True)
+    parser.add_argument("--bucket-size", type=int, default=settings.MESSAGE_BUCKET_SIZE)
+    parser.add_argument("--span-hours", type=int, default=settings.MESSAGE_BUCKET_SPAN_HOURS)
+    parser.add_argument("--delete-source", action="store_true", help="Xóa dữ liệu ở kiểu lưu trữ cũ sau khi chuyển")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
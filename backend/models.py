@@ -101,11 +101,41 @@ class MessageResponse(BaseModel):
     message_type: MessageType
     is_read: bool = False
     timestamp: datetime
+    seq: Optional[int] = None  # số thứ tự trong phòng / hội thoại
 
     class Config:
         from_attributes = True
 
 
+class MessageBatchItem(BaseModel):
+    """Một tin nhắn trong lô: gửi cho recipient hoặc vào room_id"""
+    recipient: Optional[str] = None
+    room_id: Optional[str] = None
+    content: str
+    message_type: MessageType = MessageType.TEXT
+
+
+class MessageBatchCreate(BaseModel):
+    """Gửi nhiều tin nhắn trong một request"""
+    messages: List[MessageBatchItem] = Field(..., min_length=1)
+
+
+class MessageBatchResult(BaseModel):
+    """Kết quả của từng tin nhắn trong lô (theo thứ tự gửi lên)"""
+    index: int
+    status: str  # "sent" | "failed"
+    message_id: Optional[str] = None
+    seq: Optional[int] = None
+    error: Optional[str] = None
+
+
+class MessageBatchResponse(BaseModel):
+    """Phản hồi gửi lô tin nhắn"""
+    sent: int
+    failed: int
+    results: List[MessageBatchResult]
+
+
 # ============ Room Models ============
 
 class RoomCreate(BaseModel):
@@ -120,6 +150,11 @@ class RoomJoin(BaseModel):
     room_id: str
 
 
+class RoomMembersBulk(BaseModel):
+    """Thêm / xóa nhiều thành viên phòng trong một request"""
+    usernames: List[str] = Field(..., min_length=1)
+
+
 class RoomResponse(BaseModel):
     """Phản hồi thông tin phòng"""
     id: Optional[str] = Field(alias="_id")
@@ -163,6 +198,33 @@ class InvitationLinkJoin(BaseModel):
     username: str
 
 
+# ============ Inbox Models ============
+
+class InboxEntry(BaseModel):
+    """Một hội thoại trong inbox (phòng hoặc chat 1-1)"""
+    kind: str  # "room" | "direct"
+    conversation_id: str  # room_id hoặc username người kia
+    title: Optional[str] = None
+    last_message: Optional[MessageResponse] = None
+    last_activity: Optional[datetime] = None
+    unread: int = 0
+
+
+# ============ Search Models ============
+
+class SearchResult(MessageResponse):
+    """Tin nhắn khớp truy vấn kèm điểm xếp hạng"""
+    score: float
+
+
+class SearchResponse(BaseModel):
+    """Một trang kết quả tìm kiếm"""
+    results: List[SearchResult]
+    total: int  # số kết quả đã xếp hạng (tối đa SEARCH_MAX_CANDIDATES)
+    next_offset: Optional[int] = None
+    truncated: bool = False  # True: chỉ xếp hạng SEARCH_MAX_CANDIDATES tin gần nhất, total là cận dưới
+
+
 # ============ File Models ============
 
 class FileUploadResponse(BaseModel):
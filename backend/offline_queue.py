@@ -0,0 +1,177 @@
+"""
+Offline Delivery Queue cho RealChat - store-and-forward cho người nhận không có WebSocket
+
+- broadcast/broadcast_room xếp event của tin nhắn đã lưu vào hàng đợi của từng người nhận
+  đang offline; entry được gom trong bộ nhớ và ghi mỗi OFFLINE_QUEUE_FLUSH_MS bằng một
+  insert_many (hoặc sớm hơn khi đủ OFFLINE_QUEUE_BATCH_SIZE)
+- Khi user kết nối websocket_endpoint, toàn bộ hàng đợi được gửi thành các frame lớn:
+      {"type": "offline_batch", "messages": [...], "ack": "<id entry cuối>"}
+- Client xác nhận bằng {"type": "ack", "ack": "<id>"} -> xóa mọi entry tới id đó.
+  Entry chưa ack được gửi lại ở lần kết nối sau; quá OFFLINE_QUEUE_TTL_HOURS thì MongoDB tự xóa
+- offline_batch được gửi trước mọi tin live của socket; mỗi tin mang "_id" và ("stream", "seq")
+  nên client bỏ trùng theo (stream, seq), resume cũng không gửi lại tin vừa có trong offline_batch
+- Các lần flush chạy tuần tự (drain chờ lần flush đang chạy xong rồi mới đọc); lô ghi lỗi được
+  giữ ở đầu buffer và ghi lại tối đa OFFLINE_QUEUE_MAX_RETRIES lần trước khi bị bỏ
+
+"Offline" nghĩa là không có socket trên process này.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+from fastapi import WebSocket
+from config import settings
+from database import enqueue_deliveries, get_pending_deliveries, ack_deliveries
+from metrics import registry
+from responses import dumps
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OfflineQueue:
+    def __init__(self, flush_interval: float, batch_size: int, ttl: timedelta, max_retries: int):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.max_retries = max_retries
+        self.buffer: List[Dict[str, Any]] = []
+        self.failures = 0  # số lần ghi lỗi liên tiếp của lô đầu buffer
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.delivered = 0
+        self.acked = 0
+        self.dropped = 0
+        self.retries = 0
+        self.flushes = 0
+
+    def enqueue(self, usernames: Iterable[str], event: Dict[str, Any]):
+        """Xếp event cho các user offline (ghi xuống MongoDB ở lần flush kế tiếp)"""
+        now = datetime.now(timezone.utc)
+        expires_at = now + self.ttl
+        for username in usernames:
+            self.buffer.append({"username": username, "event": event, "created_at": now, "expires_at": expires_at})
+            self.enqueued += 1
+        if len(self.buffer) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self):
+        """
+        Ghi các entry đang gom bằng insert_many (mỗi lô tối đa batch_size).
+        Lô chỉ rời buffer khi đã ghi xong, nên lock đủ để drain không đọc trước khi entry tồn tại.
+        """
+        async with self._lock:
+            while self.buffer:
+                batch = self.buffer[:self.batch_size]
+                try:
+                    await enqueue_deliveries(batch)
+                except Exception as e:
+                    self.failures += 1
+                    if self.failures <= self.max_retries:
+                        # Giữ lô ở đầu buffer, _run ghi lại sau khoảng backoff
+                        self.retries += len(batch)
+                        logger.warning(
+                            f"Offline queue flush failed ({self.failures}/{self.max_retries}), will retry: {e}"
+                        )
+                        break
+                    self.dropped += len(batch)
+                    logger.error(f"Offline queue flush failed {self.failures} times, dropped {len(batch)} entries: {e}")
+                else:
+                    self.flushes += 1
+                # enqueue chỉ nối vào cuối buffer nên đầu buffer vẫn là lô vừa xử lý
+                del self.buffer[:len(batch)]
+                self.failures = 0
+            self._full.clear()
+
+    async def drain(self, username: str, websocket: WebSocket) -> Dict[str, Set[int]]:
+        """Gửi toàn bộ hàng đợi của user thành các frame offline_batch; trả về seq đã gửi theo stream"""
+        # Entry còn trong bộ nhớ (kể cả lô đang được flush nền ghi dở) phải xuống MongoDB trước khi đọc
+        await self.flush()
+        sent = 0
+        seqs: Dict[str, Set[int]] = {}
+        after = None
+        while True:
+            entries = await get_pending_deliveries(username, self.batch_size, after)
+            if not entries:
+                break
+            after = str(entries[-1]["_id"])
+            await websocket.send_text(dumps({
+                "type": "offline_batch",
+                "messages": [entry["event"] for entry in entries],
+                "ack": after,
+            }).decode("utf-8"))
+            sent += len(entries)
+            for entry in entries:
+                event = entry["event"]
+                if event.get("stream") and event.get("seq") is not None:
+                    seqs.setdefault(event["stream"], set()).add(event["seq"])
+            if len(entries) < self.batch_size:
+                break
+        self.delivered += sent
+        return seqs
+
+    async def ack(self, username: str, up_to: str) -> int:
+        removed = await ack_deliveries(username, up_to)
+        self.acked += removed
+        return removed
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Dừng flusher và ghi nốt phần còn trong bộ nhớ"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            # Đang ghi lỗi: chờ lâu dần thay vì ghi lại ngay khi buffer đầy
+            delay = self.flush_interval * (2 ** self.failures)
+            try:
+                if self.failures:
+                    await asyncio.sleep(delay)
+                else:
+                    await asyncio.wait_for(self._full.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
+offline_queue = OfflineQueue(
+    settings.OFFLINE_QUEUE_FLUSH_MS / 1000,
+    settings.OFFLINE_QUEUE_BATCH_SIZE,
+    timedelta(hours=settings.OFFLINE_QUEUE_TTL_HOURS),
+    settings.OFFLINE_QUEUE_MAX_RETRIES,
+)
+
+registry.counter(
+    "realchat_offline_queue_events_total", "Offline delivery queue entries by outcome",
+    ("outcome",),
+    callback=lambda: {
+        ("enqueued",): offline_queue.enqueued,
+        ("delivered",): offline_queue.delivered,
+        ("acked",): offline_queue.acked,
+        ("dropped",): offline_queue.dropped,
+        ("retried",): offline_queue.retries,
+    },
+)
+registry.counter(
+    "realchat_offline_queue_flushes_total", "Batched writes to the offline delivery queue",
+    callback=lambda: {(): offline_queue.flushes},
+)
+registry.gauge(
+    "realchat_offline_queue_buffered", "Offline queue entries waiting to be written",
+    callback=lambda: {(): len(offline_queue.buffer)},
+)
+registry.gauge(
+    "realchat_offline_queue_enabled", "1 if offline delivery is enabled (MongoDB engine only)",
+    callback=lambda: {(): int(settings.OFFLINE_QUEUE_ENABLED)},
+)
@@ -0,0 +1,196 @@
+"""
+Sampling Profiler cho RealChat - chụp stack của event loop theo chu kỳ
+
+Một thread nền đọc sys._current_frames() cho thread đang chạy event loop
+mỗi interval, gom thành "collapsed stacks" (định dạng của flamegraph.pl /
+speedscope): "frame;frame;frame count". Không cần redeploy hay thư viện ngoài.
+
+Cách dùng (chỉ khi PROFILER_ENABLED=True, cần header X-Admin-Token):
+- GET /api/admin/profile?seconds=10          -> profile toàn process N giây
+- Header "X-Profile: 1" trên một request     -> profile riêng request đó,
+  response có header X-Profile-Id, lấy kết quả ở /api/admin/profile/{id}
+- kill -USR2 <pid>                           -> ghi profile ra PROFILER_OUTPUT_DIR
+"""
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+from config import settings
+import asyncio
+import hmac
+import signal
+import os
+import sys
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 128
+MAX_RECENT_PROFILES = 32
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Lấy mẫu stack của một thread (mặc định: thread hiện tại) trong thread nền"""
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample_once(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack: List[str] = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks[";".join(stack)] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample_once()
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="realchat-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def collapsed(self) -> str:
+        """Kết quả dạng collapsed stacks, sắp xếp theo số mẫu giảm dần"""
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+# ============ SHARED STATE ============
+
+_active_profiles = 0
+recent_profiles: "OrderedDict[str, str]" = OrderedDict()
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """Kiểm tra token admin (so sánh constant-time)"""
+    if not settings.ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, settings.ADMIN_TOKEN)
+
+
+def remember_profile(profile_id: str, profile: str):
+    """Lưu profile gần đây (giới hạn MAX_RECENT_PROFILES)"""
+    recent_profiles[profile_id] = profile
+    while len(recent_profiles) > MAX_RECENT_PROFILES:
+        recent_profiles.popitem(last=False)
+
+
+async def profile_event_loop(seconds: float, interval: float = 0.005) -> SamplingProfiler:
+    """Profile thread event loop trong N giây mà không block loop"""
+    global _active_profiles
+    _active_profiles += 1
+    profiler = SamplingProfiler(threading.get_ident(), interval)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+        _active_profiles -= 1
+    return profiler
+
+
+def profiling_in_progress() -> bool:
+    return _active_profiles > 0
+
+
+# ============ SIGNAL TRIGGER ============
+
+async def _profile_to_file(seconds: float):
+    profiler = await profile_event_loop(seconds, settings.PROFILER_INTERVAL_MS / 1000)
+    os.makedirs(settings.PROFILER_OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(
+        settings.PROFILER_OUTPUT_DIR,
+        f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.collapsed",
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(profiler.collapsed())
+    logger.info(f"Profile saved to {path} ({profiler.samples} samples)")
+
+
+def install_signal_handler(loop: asyncio.AbstractEventLoop) -> bool:
+    """SIGUSR2 -> profile PROFILER_SIGNAL_SECONDS giây và ghi ra file"""
+    if not settings.PROFILER_ENABLED or not hasattr(signal, "SIGUSR2"):
+        return False
+
+    def handler():
+        if profiling_in_progress():
+            logger.warning("Profiler is already running, ignoring SIGUSR2")
+            return
+        loop.create_task(_profile_to_file(settings.PROFILER_SIGNAL_SECONDS))
+
+    try:
+        loop.add_signal_handler(signal.SIGUSR2, handler)
+    except (NotImplementedError, RuntimeError):
+        return False
+    return True
+
+
+# ============ PER-REQUEST PROFILING ============
+
+class ProfilerMiddleware:
+    """
+    Profile riêng một request khi có header X-Profile và X-Admin-Token hợp lệ.
+    Lưu ý: các request khác chạy song song trên cùng loop cũng có thể lọt vào mẫu.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not settings.PROFILER_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers: Dict[bytes, bytes] = dict(scope["headers"])
+        if b"x-profile" not in headers:
+            await self.app(scope, receive, send)
+            return
+        token = headers.get(b"x-admin-token", b"").decode("latin-1")
+        if not is_admin_token(token):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+        profiler = SamplingProfiler(threading.get_ident(), settings.PROFILER_INTERVAL_MS / 1000)
+
+        async def send_with_profile_id(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            remember_profile(profile_id, profiler.collapsed())
@@ -0,0 +1,104 @@
+"""
+Replay Buffer cho RealChat - gửi lại tin nhắn bị lỡ khi WebSocket kết nối lại
+
+Mỗi tin nhắn được gán số thứ tự tăng dần (seq) theo stream lúc lưu:
+- phòng:       stream = "room:<room_id>"
+- chat 1-1:    stream = "conv:<user_a>|<user_b>"  (username sắp xếp)
+
+Buffer giữ REPLAY_BUFFER_PER_STREAM event gần nhất của mỗi stream (LRU theo stream,
+tối đa REPLAY_MAX_STREAMS). Client kết nối lại gửi seq cuối đã thấy:
+    {"type": "resume", "streams": {"room:<id>": 41, "conv:alice|bob": 7}}
+và chỉ nhận phần bị lỡ; stream có khoảng trống ngoài buffer được trả về trong
+"resync" để client tải lại bằng REST (phân trang lịch sử).
+
+Buffer chỉ có tin do process này lưu thành công, còn seq (counters) nằm trong database: seq đã
+cấp nhưng lưu lỗi không có trong buffer. Vì vậy chỉ replay khi các seq trong buffer liền mạch
+từ seq cuối của client tới seq mới nhất trong database, ngược lại stream vào "resync".
+"""
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+from config import settings
+from etags import room_key, conversation_key
+from metrics import registry
+from utils import format_message_response
+
+Event = Dict[str, Any]
+
+
+def message_stream(message: Dict[str, Any]) -> Optional[str]:
+    """Stream của tin nhắn (None với tin nhắn không thuộc phòng/hội thoại nào)"""
+    if message.get("room_id"):
+        return room_key(str(message["room_id"]))
+    if message.get("recipient"):
+        return conversation_key(message["sender"], message["recipient"])
+    return None
+
+
+def message_event(message: Dict[str, Any]) -> Event:
+    """Payload WebSocket của một tin nhắn đã lưu (dùng cho cả fanout lẫn replay)"""
+    return {
+        "type": "room_message" if message.get("room_id") else "message",
+        **format_message_response(message),
+        "stream": message_stream(message),
+    }
+
+
+class ReplayBuffer:
+    def __init__(self, per_stream: int, max_streams: int):
+        self.per_stream = per_stream
+        self.max_streams = max_streams
+        self.streams: "OrderedDict[str, deque]" = OrderedDict()
+        self.replayed = 0
+        self.resyncs = 0
+
+    def record(self, message: Dict[str, Any]):
+        """Ghi tin nhắn vừa lưu (có seq) vào buffer của stream"""
+        stream = message_stream(message)
+        if stream is None or message.get("seq") is None:
+            return
+        entries = self.streams.get(stream)
+        if entries is None:
+            entries = self.streams[stream] = deque(maxlen=self.per_stream)
+            while len(self.streams) > self.max_streams:
+                self.streams.popitem(last=False)
+        else:
+            self.streams.move_to_end(stream)
+        entries.append((message["seq"], message_event(message)))
+
+    def since(self, stream: str, last_seq: int) -> Optional[Tuple[bool, List[Event]]]:
+        """
+        Event có seq > last_seq, sắp theo seq.
+        None nếu stream không có trong buffer; (False, []) nếu các seq sau last_seq không
+        liền mạch (khoảng trống vượt quá buffer, hoặc seq không được ghi vào buffer này).
+        Caller vẫn phải so seq cuối với seq mới nhất trong database.
+        """
+        entries = self.streams.get(stream)
+        if not entries:
+            return None
+        # Các lần lưu song song có thể ghi lệch thứ tự nên không giả định deque đã sắp xếp
+        events = []
+        expected = last_seq + 1
+        for seq, event in sorted(entries, key=lambda e: e[0]):
+            if seq <= last_seq:
+                continue
+            if seq != expected:
+                return False, []
+            events.append(event)
+            expected += 1
+        return True, events
+
+
+replay_buffer = ReplayBuffer(settings.REPLAY_BUFFER_PER_STREAM, settings.REPLAY_MAX_STREAMS)
+
+registry.counter(
+    "realchat_ws_replayed_messages_total", "Messages replayed to reconnecting WebSocket clients",
+    callback=lambda: {(): replay_buffer.replayed},
+)
+registry.counter(
+    "realchat_ws_resync_total", "Streams whose gap was outside the replay buffer",
+    callback=lambda: {(): replay_buffer.resyncs},
+)
+registry.gauge(
+    "realchat_ws_replay_streams", "Streams tracked by the replay buffer",
+    callback=lambda: {(): len(replay_buffer.streams)},
+)
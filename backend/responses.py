@@ -0,0 +1,34 @@
+"""
+Response classes cho RealChat API - serialize nhanh bằng orjson
+"""
+from typing import Any
+from bson.objectid import ObjectId
+from starlette.responses import JSONResponse
+import orjson
+
+
+def _default(obj: Any) -> Any:
+    """Serialize các kiểu orjson không hỗ trợ sẵn (ObjectId)"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Encode JSON bằng orjson
+    - datetime/Enum được orjson xử lý trực tiếp
+    - datetime có timezone UTC ghi dạng "Z" giống pydantic
+    """
+    return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response bỏ qua bước validate lại qua response_model và jsonable_encoder.
+    Chỉ dùng cho dữ liệu tin cậy đã được format bởi utils.format_*_response.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,131 @@
+"""
+Room Message Cache cho RealChat - ring buffer tin nhắn gần nhất của các phòng "nóng"
+
+- Mỗi phòng giữ tối đa ROOM_CACHE_MESSAGES_PER_ROOM tin nhắn đã format (deque)
+- Trang mới nhất của GET /api/rooms/{room_id}/messages được trả thẳng từ buffer;
+  trang cũ hơn (cursor `before`) vẫn đọc MongoDB
+- save_message nối tin mới vào buffer của phòng đã được cache
+- Giới hạn bộ nhớ toàn cục ROOM_CACHE_MAX_BYTES (ước lượng theo kích thước JSON),
+  vượt giới hạn thì loại phòng ít dùng nhất (LRU)
+"""
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+from config import settings
+from etags import change_versions, room_key
+from metrics import registry
+from responses import dumps
+from utils import format_message_response
+
+Entry = Tuple[Dict[str, Any], int]  # (tin nhắn đã format, kích thước ước lượng)
+
+
+class RoomBuffer:
+    __slots__ = ("entries", "complete", "bytes")
+
+    def __init__(self, capacity: int):
+        self.entries: deque = deque(maxlen=capacity)
+        # True khi buffer chứa toàn bộ lịch sử phòng (phòng có ít tin hơn capacity)
+        self.complete = False
+        self.bytes = 0
+
+
+class RoomMessageCache:
+    def __init__(self, per_room: int, max_bytes: int):
+        self.per_room = per_room
+        self.max_bytes = max_bytes
+        self.rooms: "OrderedDict[str, RoomBuffer]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_latest(self, room_id: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """limit tin mới nhất (cũ -> mới), hoặc None nếu buffer không đủ"""
+        buffer = self.rooms.get(room_id)
+        if buffer is None or (limit > len(buffer.entries) and not buffer.complete):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.rooms.move_to_end(room_id)
+        entries = buffer.entries
+        start = max(0, len(entries) - limit)
+        return [entries[i][0] for i in range(start, len(entries))]
+
+    def snapshot_version(self, room_id: str) -> int:
+        """Gọi trước khi đọc MongoDB để fill(); phát hiện tin nhắn ghi xen giữa"""
+        return change_versions.get(room_key(room_id))
+
+    def fill(self, room_id: str, messages: List[Dict[str, Any]], version: int):
+        """Nạp buffer từ kết quả MongoDB (tối đa per_room tin mới nhất, cũ -> mới)"""
+        if change_versions.get(room_key(room_id)) != version:
+            # Có tin ghi trong lúc đọc: kết quả có thể thiếu tin đó, không cache
+            return
+        self.invalidate(room_id)
+        buffer = RoomBuffer(self.per_room)
+        buffer.complete = len(messages) < self.per_room
+        self.rooms[room_id] = buffer
+        for message in messages[-self.per_room:]:
+            self._push(buffer, message)
+        self._evict()
+
+    def append(self, room_id: str, message: Dict[str, Any]):
+        """Nối tin nhắn thô (từ save_message) vào buffer nếu phòng đang được cache"""
+        buffer = self.rooms.get(room_id)
+        if buffer is None:
+            return
+        self.rooms.move_to_end(room_id)
+        self._push(buffer, format_message_response(message))
+        self._evict()
+
+    def mark_read(self, room_id: str, message_id: str):
+        buffer = self.rooms.get(room_id)
+        if buffer is None:
+            return
+        for message, _ in buffer.entries:
+            if message["_id"] == message_id:
+                message["is_read"] = True
+                break
+
+    def invalidate(self, room_id: str):
+        buffer = self.rooms.pop(room_id, None)
+        if buffer is not None:
+            self.bytes -= buffer.bytes
+
+    def _push(self, buffer: RoomBuffer, message: Dict[str, Any]):
+        entries = buffer.entries
+        if len(entries) == entries.maxlen:
+            _, dropped = entries.popleft()
+            buffer.bytes -= dropped
+            self.bytes -= dropped
+            buffer.complete = False
+        size = len(dumps(message))
+        entries.append((message, size))
+        buffer.bytes += size
+        self.bytes += size
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self.rooms) > 1:
+            _, buffer = self.rooms.popitem(last=False)
+            self.bytes -= buffer.bytes
+            self.evictions += 1
+
+
+room_cache = RoomMessageCache(settings.ROOM_CACHE_MESSAGES_PER_ROOM, settings.ROOM_CACHE_MAX_BYTES)
+
+registry.counter(
+    "realchat_room_cache_requests_total", "Room history cache lookups by result",
+    ("result",),
+    callback=lambda: {("hit",): room_cache.hits, ("miss",): room_cache.misses},
+)
+registry.counter(
+    "realchat_room_cache_evictions_total", "Rooms evicted from the history cache",
+    callback=lambda: {(): room_cache.evictions},
+)
+registry.gauge(
+    "realchat_room_cache_rooms", "Rooms with a cached history buffer",
+    callback=lambda: {(): len(room_cache.rooms)},
+)
+registry.gauge(
+    "realchat_room_cache_bytes", "Estimated size of cached room history (JSON bytes)",
+    callback=lambda: {(): room_cache.bytes},
+)
@@ -5,10 +5,18 @@ from .auth import router as auth_router
 from .messages import router as messages_router
 from .users import router as users_router
 from .rooms import router as rooms_router
+from .inbox import router as inbox_router
+from .sync import router as sync_router
+from .search import router as search_router
+from .admin import router as admin_router
 
 __all__ = [
     "auth_router",
     "messages_router", 
     "users_router",
-    "rooms_router"
+    "rooms_router",
+    "inbox_router",
+    "sync_router",
+    "search_router",
+    "admin_router"
 ]
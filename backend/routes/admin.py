@@ -0,0 +1,128 @@
+"""
+Admin Routes - Công cụ chẩn đoán (sampling profiler, tracing), archive tin nhắn cũ, search index
+"""
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+from config import settings
+from archive import archive_stats
+from database import archive_cold_messages, rebuild_search_index
+from profiler import is_admin_token, profile_event_loop, profiling_in_progress, recent_profiles
+from responses import FastJSONResponse
+from tracing import tracer
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Chỉ cho phép khi X-Admin-Token hợp lệ"""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin token không hợp lệ"
+        )
+
+
+async def require_profiler(x_admin_token: Optional[str] = Header(None)):
+    """Profiler phải được bật; ẩn endpoint khi chưa bật"""
+    if not settings.PROFILER_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    await require_admin(x_admin_token)
+
+
+async def require_tracing(x_admin_token: Optional[str] = Header(None)):
+    """Tracing phải được bật; ẩn endpoint khi chưa bật"""
+    if not settings.TRACING_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    await require_admin(x_admin_token)
+
+
+@router.get("/profile", response_class=PlainTextResponse, dependencies=[Depends(require_profiler)])
+async def profile(seconds: float = 10.0, interval_ms: Optional[int] = None):
+    """
+    Profile event loop trong N giây, trả về collapsed stacks (flamegraph-ready)
+    """
+    if seconds <= 0 or seconds > settings.PROFILER_MAX_SECONDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"seconds phải trong khoảng (0, {settings.PROFILER_MAX_SECONDS}]"
+        )
+    if profiling_in_progress():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Profiler đang chạy"
+        )
+    
+    interval = (interval_ms or settings.PROFILER_INTERVAL_MS) / 1000
+    profiler = await profile_event_loop(seconds, max(interval, 0.001))
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={
+            "X-Profile-Samples": str(profiler.samples),
+            "X-Profile-Duration": f"{profiler.duration:.3f}",
+        },
+    )
+
+
+@router.get("/profile/{profile_id}", response_class=PlainTextResponse, dependencies=[Depends(require_profiler)])
+async def get_request_profile(profile_id: str):
+    """
+    Lấy profile của một request (đã gửi kèm header X-Profile)
+    """
+    profile_text = recent_profiles.get(profile_id)
+    if profile_text is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile không tồn tại"
+        )
+    return PlainTextResponse(profile_text)
+
+
+@router.get("/traces", dependencies=[Depends(require_tracing)])
+async def get_traces(limit: Optional[int] = None):
+    """
+    Span gần đây dạng Chrome Trace Event JSON (mở bằng Perfetto / chrome://tracing)
+    """
+    return FastJSONResponse(tracer.export(limit))
+
+
+@router.post("/traces/export", dependencies=[Depends(require_tracing)])
+async def export_traces():
+    """
+    Ghi ring buffer ra file trong TRACE_OUTPUT_DIR
+    """
+    path = tracer.write()
+    return {"path": path, "spans": len(tracer.spans)}
+
+
+@router.post("/archive/run", dependencies=[Depends(require_admin)])
+async def run_archive(older_than_days: Optional[int] = None):
+    """
+    Archive ngay tin nhắn cũ hơn N ngày (mặc định ARCHIVE_AFTER_DAYS)
+    """
+    if settings.STORAGE_ENGINE != "mongodb":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    days = settings.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    if days < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="older_than_days không được âm"
+        )
+    archived = await archive_cold_messages(datetime.now(timezone.utc) - timedelta(days=days))
+    return {
+        "archived": archived,
+        "total_archived": archive_stats.archived,
+        "raw_bytes": archive_stats.raw_bytes,
+        "compressed_bytes": archive_stats.compressed_bytes,
+    }
+
+
+@router.post("/search/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_search():
+    """
+    Dựng lại search index từ toàn bộ tin nhắn (chạy một lần khi bật tìm kiếm cho dữ liệu có sẵn)
+    """
+    if not settings.SEARCH_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return {"indexed": await rebuild_search_index()}
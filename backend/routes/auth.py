@@ -5,7 +5,7 @@ from fastapi import APIRouter, HTTPException, status
 from datetime import timedelta
 from models import UserCreate, UserLogin, UserResponse, Token, LoginResponse
 from database import (
-    create_user, get_user, update_user_online_status
+    create_user, get_user, user_exists, update_user_online_status
 )
 from utils import (
     hash_password, verify_password, create_access_token,
@@ -13,6 +13,7 @@ from utils import (
     format_user_response
 )
 from config import settings
+from responses import FastJSONResponse
 
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
@@ -47,9 +48,9 @@ async def register(user_data: UserCreate):
                 detail=error
             )
     
-    # Check if user exists
-    existing_user = await get_user(user_data.username)
-    if existing_user:
+    # Check if user exists (username filter bỏ qua query khi chắc chắn chưa có;
+    # unique index vẫn chặn trùng lặp trong create_user)
+    if await user_exists(user_data.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username đã tồn tại"
@@ -65,7 +66,7 @@ async def register(user_data: UserCreate):
             email=user_data.email,
             password_hash=password_hash
         )
-        return format_user_response(new_user)
+        return FastJSONResponse(format_user_response(new_user), status_code=status.HTTP_201_CREATED)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -107,11 +108,11 @@ async def login(credentials: UserLogin):
         expires_delta=access_token_expires
     )
     
-    return {
+    return FastJSONResponse({
         "access_token": access_token,
         "token_type": "bearer",
         "user": format_user_response(user)
-    }
+    })
 
 
 @router.post("/logout")
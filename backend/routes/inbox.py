@@ -0,0 +1,40 @@
+"""
+Inbox Routes - Danh sách hội thoại (phòng + chat 1-1) kèm tin nhắn cuối và số chưa đọc
+"""
+from fastapi import APIRouter, HTTPException, status
+from typing import List
+from models import InboxEntry
+from database import get_inbox, mark_inbox_read, INBOX_ROOM, INBOX_DIRECT
+from utils import format_inbox_entry
+from responses import FastJSONResponse
+
+router = APIRouter(prefix="/api/inbox", tags=["inbox"])
+
+
+@router.get("/{username}", response_model=List[InboxEntry])
+async def get_user_inbox(username: str, limit: int = 100):
+    """
+    Lấy inbox của user trong một request (đọc từ read model, sắp xếp theo hoạt động gần nhất)
+    """
+    entries = await get_inbox(username, min(max(limit, 1), 500))
+    return FastJSONResponse([format_inbox_entry(e) for e in entries])
+
+
+@router.put("/{username}/{kind}/{conversation_id}/read")
+async def mark_conversation_read(username: str, kind: str, conversation_id: str):
+    """
+    Đánh dấu cả hội thoại đã đọc (unread = 0)
+    """
+    if kind not in (INBOX_ROOM, INBOX_DIRECT):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Loại hội thoại không hợp lệ"
+        )
+    
+    success = await mark_inbox_read(username, kind, conversation_id)
+    if not success:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Hội thoại không tồn tại"
+        )
+    return {"message": "Đã đánh dấu đã đọc"}
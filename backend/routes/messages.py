@@ -1,14 +1,22 @@
 """
 Message Routes - Lấy tin nhắn, Gửi tin nhắn
 """
-from fastapi import APIRouter, HTTPException, status, WebSocket, WebSocketDisconnect
-from typing import List, Dict, Set
-from models import MessageCreate, MessageResponse
+from fastapi import APIRouter, HTTPException, Request, status, WebSocket, WebSocketDisconnect
+from typing import List, Dict, Set, Tuple
+from models import MessageCreate, MessageResponse, MessageBatchCreate, MessageBatchResponse
 from database import (
-    save_message, get_private_messages, get_unread_messages,
-    get_user, mark_message_as_read
+    save_message, save_messages, get_private_messages, get_unread_messages, get_room_members,
+    user_exists, existing_usernames, mark_message_as_read, get_stream_seqs, get_member_room_ids
 )
 from utils import format_message_response
+from responses import FastJSONResponse, dumps
+from metrics import registry
+from etags import change_versions, not_modified, etag_headers, conversation_key
+from tracing import trace_span
+from replay import replay_buffer, message_event
+from offline_queue import offline_queue
+from config import settings
+import asyncio
 import json
 import logging
 from datetime import datetime, timezone
@@ -21,56 +29,231 @@ router = APIRouter(prefix="/api/messages", tags=["messages"])
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, List[WebSocket]] = {}
+        # Số lượt gửi fanout đang chờ hoàn tất (độ sâu hàng đợi fanout)
+        self.pending_sends = 0
+        self.delivered = 0
+        # Socket đang nhận offline_batch: tin live được giữ lại (theo thứ tự) tới khi drain xong
+        self.holding: Dict[WebSocket, List[str]] = {}
+        # (stream, seq) đã gửi trong offline_batch của socket, để resume không gửi lại lần nữa
+        self.drained: Dict[WebSocket, Dict[str, Set[int]]] = {}
     
-    async def connect(self, username: str, websocket: WebSocket):
+    async def connect(self, username: str, websocket: WebSocket, hold: bool = False):
+        """hold=True: giữ tin live cho socket tới khi release() (dùng khi còn phải gửi offline_batch)"""
         await websocket.accept()
+        if hold:
+            self.holding[websocket] = []
         if username not in self.active_connections:
             self.active_connections[username] = []
         self.active_connections[username].append(websocket)
     
+    async def release(self, websocket: WebSocket, drained: Dict[str, Set[int]]):
+        """Kết thúc drain: ghi nhớ seq đã gửi bù rồi gửi các tin live bị giữ, theo thứ tự nhận"""
+        self.drained[websocket] = drained
+        held = self.holding.get(websocket)
+        while held:
+            payload = held.pop(0)
+            try:
+                await websocket.send_text(payload)
+                self.delivered += 1
+            except Exception as e:
+                logger.error(f"Error sending message: {e}")
+        # Không có await giữa lần kiểm tra cuối và lúc bỏ hold nên không tin nào bị kẹt lại
+        self.holding.pop(websocket, None)
+    
     def disconnect(self, username: str, websocket: WebSocket):
+        self.holding.pop(websocket, None)
+        self.drained.pop(websocket, None)
         if username in self.active_connections:
             self.active_connections[username].remove(websocket)
             if not self.active_connections[username]:
                 del self.active_connections[username]
     
-    async def broadcast(self, message: dict):
-        """Broadcast to all connected clients"""
+    async def broadcast(self, message: dict, queue_offline: bool = False):
+        """
+        Broadcast to all connected clients.
+        queue_offline=True (tin nhắn đã lưu): người nhận offline nhận bù khi kết nối lại
+        """
         recipient = message.get("recipient")
         if recipient and recipient in self.active_connections:
-            for connection in self.active_connections[recipient]:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    logger.error(f"Error sending message: {e}")
+            await self._fanout(list(self.active_connections[recipient]), dumps(message).decode("utf-8"))
+        elif recipient and queue_offline and settings.OFFLINE_QUEUE_ENABLED:
+            offline_queue.enqueue([recipient], message)
+    
+    async def broadcast_room(self, members: List[str], message: dict, queue_offline: bool = False):
+        """Gửi tin nhắn phòng tới các thành viên đang kết nối (encode JSON một lần)"""
+        connections = []
+        offline = []
+        for member in members:
+            sockets = self.active_connections.get(member)
+            if sockets:
+                connections.extend(sockets)
+            elif member != message.get("sender"):
+                offline.append(member)
+        if offline and queue_offline and settings.OFFLINE_QUEUE_ENABLED:
+            offline_queue.enqueue(offline, message)
+        if connections:
+            await self._fanout(connections, dumps(message).decode("utf-8"))
+    
+    async def broadcast_many(self, deliveries: List[Tuple[dict, List[str]]], queue_offline: bool = False):
+        """
+        Gửi một lô tin nhắn, mỗi tin kèm danh sách người nhận (recipient hoặc thành viên phòng).
+        Một lượt duyệt: gom toàn bộ (socket, payload) rồi fanout một lần, offline gom theo tin.
+        """
+        sends: List[Tuple[WebSocket, str]] = []
+        for message, usernames in deliveries:
+            payload = None
+            offline = []
+            for username in usernames:
+                sockets = self.active_connections.get(username)
+                if sockets:
+                    payload = payload or dumps(message).decode("utf-8")
+                    sends.extend((socket, payload) for socket in sockets)
+                elif username != message.get("sender"):
+                    offline.append(username)
+            if offline and queue_offline and settings.OFFLINE_QUEUE_ENABLED:
+                offline_queue.enqueue(offline, message)
+        if sends:
+            await self._deliver(sends)
+    
+    async def _fanout(self, connections: List[WebSocket], payload: str):
+        """Gửi payload đã encode tới danh sách socket"""
+        await self._deliver([(connection, payload) for connection in connections])
+    
+    async def _deliver(self, sends: List[Tuple[WebSocket, str]]):
+        """Gửi từng payload tới socket tương ứng"""
+        remaining = len(sends)
+        self.pending_sends += remaining
+        try:
+            with trace_span("ws.fanout", sockets=remaining):
+                for connection, payload in sends:
+                    held = self.holding.get(connection)
+                    if held is not None:
+                        held.append(payload)
+                        remaining -= 1
+                        self.pending_sends -= 1
+                        continue
+                    try:
+                        await connection.send_text(payload)
+                        self.delivered += 1
+                    except Exception as e:
+                        logger.error(f"Error sending message: {e}")
+                    remaining -= 1
+                    self.pending_sends -= 1
+        finally:
+            self.pending_sends -= remaining
+    
+    async def resume(self, username: str, websocket: WebSocket, streams: Dict[str, int]):
+        """
+        Gửi lại tin nhắn bị lỡ (seq > seq cuối client đã thấy) từ replay buffer.
+        Stream có khoảng trống ngoài buffer được báo trong "resync" để client tải lại qua REST.
+        Tin đã có trong offline_batch của socket này không được gửi lại.
+        """
+        streams = await self._authorized_streams(username, streams)
+        allowed = list(streams)
+        # seq mới nhất trong database: buffer chỉ có tin do process này ghi thành công
+        latest = await get_stream_seqs(allowed) if allowed else {}
+        replayed = 0
+        resync: List[str] = []
+        
+        for stream in allowed:
+            last_seen = streams[stream]
+            if latest.get(stream, 0) <= last_seen:
+                continue
+            result = replay_buffer.since(stream, last_seen)
+            if result is None or not result[0]:
+                resync.append(stream)
+                continue
+            events = result[1]
+            # Buffer phải phủ tới seq mới nhất, nếu không client sẽ có lỗ hổng mà không biết
+            if not events or events[-1]["seq"] < latest[stream]:
+                resync.append(stream)
+                continue
+            drained = self.drained.get(websocket, {}).get(stream, set())
+            for event in events:
+                if event["seq"] in drained:
+                    continue
+                await websocket.send_text(dumps(event).decode("utf-8"))
+                replayed += 1
+        
+        replay_buffer.replayed += replayed
+        replay_buffer.resyncs += len(resync)
+        await websocket.send_text(dumps({
+            "type": "resume_result",
+            "replayed": replayed,
+            "resync": resync,
+        }).decode("utf-8"))
+    
+    async def _authorized_streams(self, username: str, streams: Dict[str, int]) -> Dict[str, int]:
+        """
+        Chỉ giữ các stream mà user được phép đọc, key chuẩn hóa như server dùng
+        (room id viết thường); client gửi trùng một phòng với cách viết khác thì lấy seq nhỏ hơn
+        """
+        allowed: Dict[str, int] = {}
+        rooms: Dict[str, int] = {}
+        for stream, seq in streams.items():
+            if stream.startswith("conv:"):
+                if username in stream[len("conv:"):].split("|"):
+                    allowed[stream] = seq
+            elif stream.startswith("room:"):
+                room_id = stream[len("room:"):].lower()
+                rooms[room_id] = min(seq, rooms.get(room_id, seq))
+        if rooms:
+            for room_id in await get_member_room_ids(username, list(rooms)):
+                allowed[f"room:{room_id}"] = rooms[room_id]
+        return allowed
+    
+    def stats(self) -> Dict[str, int]:
+        """Số user và số socket đang kết nối"""
+        return {
+            "users": len(self.active_connections),
+            "sockets": sum(len(c) for c in self.active_connections.values()),
+        }
     
     async def send_personal_message(self, username: str, message: dict):
         """Send to specific user"""
         if username in self.active_connections:
-            for connection in self.active_connections[username]:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    logger.error(f"Error sending personal message: {e}")
+            await self._fanout(list(self.active_connections[username]), dumps(message).decode("utf-8"))
 
 manager = ConnectionManager()
 
+registry.gauge(
+    "realchat_websocket_connections", "Active WebSocket connections",
+    callback=lambda: {(): manager.stats()["sockets"]},
+)
+registry.gauge(
+    "realchat_websocket_users", "Users with at least one active WebSocket",
+    callback=lambda: {(): len(manager.active_connections)},
+)
+registry.gauge(
+    "realchat_fanout_pending_sends", "WebSocket fanout sends in progress",
+    callback=lambda: {(): manager.pending_sends},
+)
+registry.counter(
+    "realchat_fanout_delivered_total", "WebSocket messages delivered by fanout",
+    callback=lambda: {(): manager.delivered},
+)
+
 
 @router.get("/private/{username}", response_model=List[MessageResponse])
-async def get_private_chat(username: str, other_user: str, limit: int = 50):
+async def get_private_chat(request: Request, username: str, other_user: str, limit: int = 50):
     """
     Lấy lịch sử tin nhắn riêng tư với người dùng
     """
+    # Conditional GET: trả 304 trước khi chạm tới MongoDB
+    etag = change_versions.etag(conversation_key(username, other_user), username, limit)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
     # Verify user exists
-    other = await get_user(other_user)
-    if not other:
+    if not await user_exists(other_user):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User không tồn tại"
         )
     
     messages = await get_private_messages(username, other_user, limit)
-    return [format_message_response(m) for m in messages]
+    return FastJSONResponse([format_message_response(m) for m in messages], headers=etag_headers(etag))
 
 
 @router.get("/unread/{username}", response_model=List[MessageResponse])
@@ -79,7 +262,7 @@ async def get_unread(username: str):
     Lấy tin nhắn chưa đọc
     """
     messages = await get_unread_messages(username)
-    return [format_message_response(m) for m in messages]
+    return FastJSONResponse([format_message_response(m) for m in messages])
 
 
 @router.post("/send", response_model=MessageResponse)
@@ -92,8 +275,7 @@ async def send_message(username: str, message_data: MessageCreate):
     sanitized_content = sanitize_input(message_data.content, max_length=5000)
     
     # Verify recipient exists
-    recipient = await get_user(message_data.recipient)
-    if not recipient:
+    if not await user_exists(message_data.recipient):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Người nhận không tồn tại"
@@ -108,15 +290,75 @@ async def send_message(username: str, message_data: MessageCreate):
     )
     
     # Broadcast via WebSocket
-    await manager.broadcast({
-        "type": "message",
-        "sender": username,
-        "recipient": message_data.recipient,
-        "content": message_data.content,
-        "timestamp": message.get("timestamp").isoformat()
-    })
+    await manager.broadcast(message_event(message), queue_offline=True)
+    
+    return FastJSONResponse(format_message_response(message))
+
+
+@router.post("/send-batch", response_model=MessageBatchResponse)
+async def send_message_batch(username: str, batch: MessageBatchCreate):
+    """
+    Gửi nhiều tin nhắn (nhiều người nhận và/hoặc phòng) trong một request.
+    Lỗi của từng tin được trả trong results, các tin hợp lệ vẫn được gửi.
+    """
+    if len(batch.messages) > settings.MESSAGE_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Tối đa {settings.MESSAGE_BATCH_MAX_SIZE} tin nhắn mỗi lô"
+        )
     
-    return format_message_response(message)
+    from middleware import sanitize_input
+    
+    results: List[dict] = [{"index": i, "status": "failed"} for i in range(len(batch.messages))]
+    recipients = {item.recipient for item in batch.messages if item.recipient and not item.room_id}
+    room_ids = list({item.room_id for item in batch.messages if item.room_id and not item.recipient})
+    
+    # Một query cho mọi người nhận, một lần đọc thành viên cho mỗi phòng
+    found, members = await asyncio.gather(
+        existing_usernames(list(recipients)),
+        asyncio.gather(*(get_room_members(room_id) for room_id in room_ids)),
+    )
+    room_members = dict(zip(room_ids, members))
+    
+    accepted: List[int] = []
+    items: List[dict] = []
+    for i, item in enumerate(batch.messages):
+        if bool(item.recipient) == bool(item.room_id):
+            results[i]["error"] = "Cần đúng một trong recipient hoặc room_id"
+            continue
+        if item.recipient and item.recipient not in found:
+            results[i]["error"] = "Người nhận không tồn tại"
+            continue
+        if item.room_id:
+            if room_members[item.room_id] is None:
+                results[i]["error"] = "Phòng không tồn tại"
+                continue
+            if username not in room_members[item.room_id]:
+                results[i]["error"] = "Bạn không phải thành viên của phòng này"
+                continue
+        accepted.append(i)
+        items.append({
+            "recipient": item.recipient,
+            "room_id": item.room_id,
+            "content": sanitize_input(item.content, max_length=5000),
+            "message_type": item.message_type,
+        })
+    
+    # Lưu cả lô bằng một lần ghi rồi fanout một lượt
+    messages = await save_messages(username, items)
+    deliveries = []
+    for i, message in zip(accepted, messages):
+        results[i].update(status="sent", message_id=str(message["_id"]), seq=message.get("seq"))
+        room_id = batch.messages[i].room_id
+        audience = room_members[room_id] if room_id else [message["recipient"]]
+        deliveries.append((message_event(message), audience))
+    await manager.broadcast_many(deliveries, queue_offline=True)
+    
+    return FastJSONResponse({
+        "sent": len(messages),
+        "failed": len(results) - len(messages),
+        "results": results,
+    })
 
 
 @router.put("/mark-read/{message_id}")
@@ -133,16 +375,48 @@ async def mark_as_read(message_id: str):
     return {"message": "Đã đánh dấu đã đọc"}
 
 
+async def send_error(websocket: WebSocket, detail: str):
+    """Báo lỗi cho client mà không đóng socket"""
+    await websocket.send_text(dumps({"type": "error", "detail": detail}).decode("utf-8"))
+
+
 @router.websocket("/ws/{username}")
 async def websocket_endpoint(websocket: WebSocket, username: str):
     """
     WebSocket endpoint để nhận tin nhắn real-time
     """
-    await manager.connect(username, websocket)
+    await manager.connect(username, websocket, hold=settings.OFFLINE_QUEUE_ENABLED)
     try:
+        # Gửi bù tin nhắn nhận được khi offline (một lần đọc, gửi thành frame lớn) trước mọi tin live
+        if settings.OFFLINE_QUEUE_ENABLED:
+            await manager.release(websocket, await offline_queue.drain(username, websocket))
+        
         while True:
             data = await websocket.receive_text()
             message_data = json.loads(data)
+            if not isinstance(message_data, dict):
+                await send_error(websocket, "Frame phải là JSON object")
+                continue
+            
+            # Client kết nối lại: gửi lại phần tin nhắn bị lỡ
+            if message_data.get("type") == "resume":
+                raw_streams = message_data.get("streams") or {}
+                if not isinstance(raw_streams, dict):
+                    await send_error(websocket, "streams phải là object {stream: seq}")
+                    continue
+                streams = {
+                    str(stream): seq
+                    for stream, seq in raw_streams.items()
+                    if isinstance(seq, int) and not isinstance(seq, bool)
+                }
+                await manager.resume(username, websocket, streams)
+                continue
+            
+            # Client xác nhận đã nhận offline_batch: xóa các entry tới id "ack"
+            if message_data.get("type") == "ack":
+                if isinstance(message_data.get("ack"), str):
+                    await offline_queue.ack(username, message_data["ack"])
+                continue
             
             # Add sender and timestamp
             message_data["sender"] = username
@@ -1,16 +1,30 @@
 """
-Room Routes - Tạo phòng, Tham gia phòng, Lấy tin nhắn từ phòng, Invitation Links
+Room Routes - Tạo phòng, Tham gia phòng, Thành viên hàng loạt, Lấy tin nhắn từ phòng, Invitation Links
 """
-from fastapi import APIRouter, HTTPException, status
-from typing import List
-from models import RoomCreate, RoomResponse, MessageResponse, InvitationLinkCreate, InvitationLinkResponse, InvitationLinkJoin, MessageRoom
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import PlainTextResponse
+from pydantic import ValidationError
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from typing import List, Literal, Optional
+from models import RoomCreate, RoomResponse, MessageResponse, InvitationLinkCreate, InvitationLinkResponse, InvitationLinkJoin, MessageRoom, RoomMembersBulk
 from database import (
-    create_room, get_room, get_all_rooms, join_room, leave_room,
-    get_user_rooms, get_user, save_message, get_room_messages,
-    create_invitation_link, validate_invitation_link, use_invitation_link,
+    create_room, get_room, get_all_rooms, add_room_member, remove_room_member, add_room_members, remove_room_members,
+    existing_usernames, get_room_members, get_user_rooms, save_message, get_room_messages,
+    create_invitation_link, validate_invitation_link, redeem_invitation_link,
     get_room_invitation_links, disable_invitation_link, get_invitation_link
 )
 from utils import format_room_response, format_message_response, validate_room_name, format_invitation_link_response
+from responses import FastJSONResponse
+from routes.messages import manager
+from room_cache import room_cache
+from replay import message_event
+from config import settings
+from etags import change_versions, not_modified, etag_headers, ROOMS_KEY, room_key
+import csv
+import io
+import orjson
 
 router = APIRouter(prefix="/api/rooms", tags=["rooms"])
 
@@ -41,7 +55,7 @@ async def create_new_room(room_data: RoomCreate, username: str = None):
             description=room_data.description,
             members=room_data.members
         )
-        return format_room_response(room)
+        return FastJSONResponse(format_room_response(room), status_code=status.HTTP_201_CREATED)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -50,10 +64,15 @@ async def create_new_room(room_data: RoomCreate, username: str = None):
 
 
 @router.get("/", response_model=List[RoomResponse])
-async def get_rooms(username: str = None):
+async def get_rooms(request: Request, username: str = None):
     """
     Lấy phòng - tất cả phòng nếu không có username, hoặc phòng của user cụ thể
     """
+    etag = change_versions.etag(ROOMS_KEY, username or "")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
     try:
         if username:
             # Lấy phòng của user cụ thể
@@ -61,7 +80,7 @@ async def get_rooms(username: str = None):
         else:
             # Lấy tất cả phòng
             rooms = await get_all_rooms()
-        return [format_room_response(r) for r in rooms]
+        return FastJSONResponse([format_room_response(r) for r in rooms], headers=etag_headers(etag))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -70,13 +89,18 @@ async def get_rooms(username: str = None):
 
 
 @router.get("/user/{username}", response_model=List[RoomResponse])
-async def get_user_rooms_list(username: str):
+async def get_user_rooms_list(request: Request, username: str):
     """
     Lấy danh sách phòng của user
     """
+    etag = change_versions.etag(ROOMS_KEY, username)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
     try:
         rooms = await get_user_rooms(username)
-        return [format_room_response(r) for r in rooms]
+        return FastJSONResponse([format_room_response(r) for r in rooms], headers=etag_headers(etag))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -99,7 +123,7 @@ async def validate_invite(invite_code: str):
         )
     
     link = await get_invitation_link(invite_code)
-    return format_invitation_link_response(link)
+    return FastJSONResponse(format_invitation_link_response(link))
 
 
 @router.post("/invite/join")
@@ -107,32 +131,23 @@ async def join_via_invite(invite_data: InvitationLinkJoin):
     """
     Tham gia phòng thông qua invitation link
     """
-    # Kiểm tra tính hợp lệ của link
-    is_valid, error = await validate_invitation_link(invite_data.invite_code)
-    if not is_valid:
+    # Kiểm tra và sử dụng link trong một round trip
+    link, error = await redeem_invitation_link(invite_data.invite_code, invite_data.username)
+    if not link:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=error
         )
     
-    # Lấy thông tin link
-    link = await get_invitation_link(invite_data.invite_code)
+    # room_id lấy từ link, không phải input; chỉ ghi system message khi phòng còn tồn tại
     room_id = link.get("room_id")
-    room = await get_room(room_id)
-    
+    room, _ = await add_room_member(room_id, invite_data.username)
     if not room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Phòng không tồn tại"
         )
     
-    # Tham gia phòng
-    success = await join_room(room_id, invite_data.username)
-    
-    # Sử dụng link
-    await use_invitation_link(invite_data.invite_code, invite_data.username)
-    
-    # Gửi system message
     await save_message(
         sender="SYSTEM",
         room_id=room_id,
@@ -154,15 +169,14 @@ async def join_chat_room(room_id: str, username: str):
     """
     Tham gia phòng chat
     """
-    room = await get_room(room_id)
+    room, joined = await add_room_member(room_id, username)
     if not room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Phòng không tồn tại"
         )
     
-    success = await join_room(room_id, username)
-    if not success:
+    if not joined:
         return {"message": "Đã có trong phòng"}
     
     # Send system message
@@ -181,15 +195,14 @@ async def leave_chat_room(room_id: str, username: str):
     """
     Rời khỏi phòng chat
     """
-    room = await get_room(room_id)
+    room, left = await remove_room_member(room_id, username)
     if not room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Phòng không tồn tại"
         )
     
-    success = await leave_room(room_id, username)
-    if not success:
+    if not left:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Lỗi khi rời phòng"
@@ -206,16 +219,195 @@ async def leave_chat_room(room_id: str, username: str):
     return {"message": "Đã rời khỏi phòng"}
 
 
+# ============ BULK MEMBERSHIP (import / export) ============
+
+def _summarize_usernames(usernames: List[str], shown: int = 5) -> str:
+    """Danh sách ngắn cho system message, vd. 'a, b, c, d, e và 995 người khác'"""
+    summary = ", ".join(usernames[:shown])
+    if len(usernames) > shown:
+        summary += f" và {len(usernames) - shown} người khác"
+    return summary
+
+
+# Body của members/import và members/remove: JSON {"usernames": [...]} hoặc CSV (file từ members/export)
+MEMBERS_BODY = {"requestBody": {"required": True, "content": {
+    "application/json": {"schema": RoomMembersBulk.model_json_schema()},
+    "text/csv": {"schema": {"type": "string"}},
+}}}
+
+
+def _parse_members_csv(body: bytes) -> List[str]:
+    """Cột đầu của CSV, bỏ dòng tiêu đề "username" và dòng trống"""
+    usernames = [row[0].strip() for row in csv.reader(io.StringIO(body.decode("utf-8-sig"))) if row and row[0].strip()]
+    if usernames and usernames[0] == "username":
+        usernames = usernames[1:]
+    return usernames
+
+
+async def _read_usernames(request: Request) -> List[str]:
+    """Danh sách username từ body JSON hoặc text/csv"""
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("text/csv"):
+            data = {"usernames": _parse_members_csv(body)}
+        else:
+            data = orjson.loads(body)
+    except (UnicodeDecodeError, csv.Error, orjson.JSONDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body phải là JSON {\"usernames\": [...]} hoặc CSV cột username"
+        )
+    try:
+        return RoomMembersBulk.model_validate(data).usernames
+    except ValidationError as exc:
+        raise RequestValidationError(exc.errors())
+
+
+async def _get_managed_room(room_id: str, username: str, usernames: List[str]):
+    """Phòng mà username là creator; kiểm tra kích thước danh sách"""
+    if len(usernames) > settings.ROOM_MEMBERS_BULK_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Tối đa {settings.ROOM_MEMBERS_BULK_MAX_SIZE} username mỗi request"
+        )
+    room = await get_room(room_id)
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Phòng không tồn tại"
+        )
+    if room.get("creator") != username:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Chỉ creator phòng mới có thể quản lý thành viên"
+        )
+    return room
+
+
+@router.post("/{room_id}/members/import", openapi_extra=MEMBERS_BODY)
+async def import_room_members(room_id: str, request: Request, username: str):
+    """
+    Thêm nhiều thành viên vào phòng (chỉ creator): một lần ghi, một system message tóm tắt.
+    Body JSON {"usernames": [...]} hoặc text/csv (file từ members/export)
+    """
+    usernames = await _read_usernames(request)
+    await _get_managed_room(room_id, username, usernames)
+    
+    requested = list(dict.fromkeys(usernames))
+    found = await existing_usernames(requested)
+    room, added = await add_room_members(room_id, [u for u in requested if u in found])
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Phòng không tồn tại"
+        )
+    
+    if added:
+        await save_message(
+            sender="SYSTEM",
+            room_id=room_id,
+            content=f"{username} đã thêm {len(added)} thành viên: {_summarize_usernames(added)}",
+            message_type="SYSTEM"
+        )
+    
+    added_set = set(added)
+    return FastJSONResponse({
+        "added": added,
+        "already_members": [u for u in requested if u in found and u not in added_set],
+        "not_found": [u for u in requested if u not in found],
+        "member_count": len(room.get("members", [])),
+    })
+
+
+@router.post("/{room_id}/members/remove", openapi_extra=MEMBERS_BODY)
+async def remove_room_members_bulk(room_id: str, request: Request, username: str):
+    """
+    Xóa nhiều thành viên khỏi phòng (chỉ creator): một lần ghi, một system message tóm tắt.
+    Body giống members/import
+    """
+    usernames = await _read_usernames(request)
+    room = await _get_managed_room(room_id, username, usernames)
+    if room.get("creator") in usernames:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Không thể xóa creator khỏi phòng"
+        )
+    
+    requested = list(dict.fromkeys(usernames))
+    room, removed = await remove_room_members(room_id, requested)
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Phòng không tồn tại"
+        )
+    
+    if removed:
+        await save_message(
+            sender="SYSTEM",
+            room_id=room_id,
+            content=f"{username} đã xóa {len(removed)} thành viên: {_summarize_usernames(removed)}",
+            message_type="SYSTEM"
+        )
+    
+    removed_set = set(removed)
+    return FastJSONResponse({
+        "removed": removed,
+        "not_members": [u for u in requested if u not in removed_set],
+        "member_count": len(room.get("members", [])),
+    })
+
+
+@router.get("/{room_id}/members/export")
+async def export_room_members(room_id: str, format: Literal["json", "csv"] = "json"):
+    """
+    Xuất danh sách thành viên phòng (csv: một cột username, dùng lại được cho import)
+    """
+    members = await get_room_members(room_id)
+    if members is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Phòng không tồn tại"
+        )
+    if format == "csv":
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(["username"])
+        writer.writerows([member] for member in members)
+        return PlainTextResponse(
+            output.getvalue(),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="room-{room_id}-members.csv"'},
+        )
+    return FastJSONResponse({"room_id": room_id, "members": members})
+
+
 @router.get("/{room_id}/messages", response_model=List[MessageResponse])
-async def get_room_messages_list(room_id: str, limit: int = 50):
+async def get_room_messages_list(request: Request, room_id: str, limit: int = 50, before: Optional[str] = None):
     """
-    Lấy tin nhắn từ phòng
+    Lấy tin nhắn từ phòng (before: message id để lấy trang cũ hơn)
     """
-    if not room_id or room_id == 'undefined':
+    # Chuẩn hóa id (hex thường) để key ETag / cache trùng với key mà save_message cập nhật
+    try:
+        room_id = str(ObjectId(room_id))
+    except (InvalidId, TypeError):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Room ID không hợp lệ"
         )
+    
+    # Conditional GET: trả 304 trước khi chạm tới MongoDB
+    etag = change_versions.etag(room_key(room_id), limit, before or "")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    # Trang mới nhất của phòng nóng: trả thẳng từ ring buffer
+    use_cache = settings.ROOM_CACHE_ENABLED and before is None and 0 < limit <= room_cache.per_room
+    if use_cache:
+        messages = room_cache.get_latest(room_id, limit)
+        if messages is not None:
+            return FastJSONResponse(messages, headers=etag_headers(etag))
+    
     room = await get_room(room_id)
     if not room:
         raise HTTPException(
@@ -223,8 +415,15 @@ async def get_room_messages_list(room_id: str, limit: int = 50):
             detail="Phòng không tồn tại"
         )
     
-    messages = await get_room_messages(room_id, limit)
-    return [format_message_response(m) for m in messages]
+    if use_cache:
+        # Nạp cả buffer một lần để các request sau (limit bất kỳ <= per_room) đều hit
+        version = room_cache.snapshot_version(room_id)
+        messages = [format_message_response(m) for m in await get_room_messages(room_id, room_cache.per_room)]
+        room_cache.fill(room_id, messages, version)
+        return FastJSONResponse(messages[-limit:], headers=etag_headers(etag))
+    
+    messages = await get_room_messages(room_id, limit, before)
+    return FastJSONResponse([format_message_response(m) for m in messages], headers=etag_headers(etag))
 
 
 # ============ ROOM MESSAGE ENDPOINTS ============
@@ -240,15 +439,15 @@ async def send_room_message(room_id: str, message_data: MessageRoom):
             detail="Room ID không hợp lệ"
         )
     
-    room = await get_room(room_id)
-    if not room:
+    members = await get_room_members(room_id)
+    if members is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Phòng không tồn tại"
         )
     
     # Kiểm tra user có trong phòng không
-    if message_data.sender not in room.get("members", []):
+    if message_data.sender not in members:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Bạn không phải thành viên của phòng này"
@@ -261,12 +460,16 @@ async def send_room_message(room_id: str, message_data: MessageRoom):
             content=message_data.content,
             message_type=message_data.message_type
         )
-        return format_message_response(message)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Lỗi gửi tin nhắn: {str(e)}"
         )
+    
+    # Broadcast tới các thành viên đang online qua WebSocket
+    await manager.broadcast_room(members, message_event(message), queue_offline=True)
+    
+    return FastJSONResponse(format_message_response(message))
 
 
 # ============ INVITATION LINK MANAGEMENT (with room_id) ============
@@ -298,7 +501,7 @@ async def create_invite_link(room_id: str, invite_data: InvitationLinkCreate, us
             created_by=username,
             expires_in_hours=invite_data.expires_in_hours
         )
-        return format_invitation_link_response(link)
+        return FastJSONResponse(format_invitation_link_response(link), status_code=status.HTTP_201_CREATED)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -326,7 +529,7 @@ async def get_invite_links(room_id: str, username: str):
         )
     
     links = await get_room_invitation_links(room_id)
-    return [format_invitation_link_response(link) for link in links]
+    return FastJSONResponse([format_invitation_link_response(link) for link in links])
 
 
 @router.post("/{room_id}/invites/{invite_code}/disable")
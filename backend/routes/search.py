@@ -0,0 +1,64 @@
+"""
+Search Routes - Tìm kiếm tin nhắn trong một phòng hoặc một hội thoại 1-1
+"""
+from fastapi import APIRouter, HTTPException, status
+from typing import Optional
+from models import SearchResponse
+from database import search_messages, get_member_room_ids
+from etags import room_key, conversation_key
+from search import query_terms
+from utils import format_message_response
+from responses import FastJSONResponse
+from config import settings
+
+router = APIRouter(prefix="/api/search", tags=["search"])
+
+MAX_QUERY_LENGTH = 200
+
+
+@router.get("", response_model=SearchResponse)
+async def search(
+    username: str,
+    q: str,
+    room_id: Optional[str] = None,
+    with_user: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+):
+    """
+    Tìm tin nhắn chứa mọi từ của `q` (không phân biệt dấu) trong phòng `room_id`
+    hoặc hội thoại với `with_user`, xếp theo độ liên quan
+    """
+    if not settings.SEARCH_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if (room_id is None) == (with_user is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cần đúng một trong room_id hoặc with_user"
+        )
+    if len(q) > MAX_QUERY_LENGTH or not query_terms(q):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Từ khóa tìm kiếm không hợp lệ"
+        )
+
+    if room_id is not None:
+        if not await get_member_room_ids(username, [room_id]):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Bạn không phải thành viên phòng này"
+            )
+        scope = room_key(room_id)
+    else:
+        scope = conversation_key(username, with_user)
+
+    limit = min(max(limit or settings.SEARCH_PAGE_SIZE, 1), 100)
+    offset = max(offset, 0)
+    results, total, truncated = await search_messages(scope, q, limit, offset)
+    next_offset = offset + limit
+    return FastJSONResponse({
+        "results": [{**format_message_response(m), "score": round(s, 4)} for m, s in results],
+        "total": total,
+        "next_offset": next_offset if next_offset < total else None,
+        "truncated": truncated,
+    })
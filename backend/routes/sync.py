@@ -0,0 +1,95 @@
+"""
+Sync Routes - Delta sync: chỉ trả về những gì đã thay đổi từ lần sync trước
+"""
+from fastapi import APIRouter, HTTPException, status
+from typing import Any, Dict, Optional
+from database import (
+    get_changes_since, get_changelog_bounds, get_user_room_ids,
+    CHANGE_MESSAGE, CHANGE_ROOM
+)
+from utils import format_message_response, format_room_response
+from responses import FastJSONResponse
+from config import settings
+import asyncio
+import base64
+import binascii
+
+router = APIRouter(prefix="/api/sync", tags=["sync"])
+
+TOKEN_PREFIX = "v1:"
+
+
+def encode_sync_token(seq: int) -> str:
+    """Token opaque cho client (seq của change log)"""
+    return base64.urlsafe_b64encode(f"{TOKEN_PREFIX}{seq}".encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> Optional[int]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if not raw.startswith(TOKEN_PREFIX) or not raw[len(TOKEN_PREFIX):].isdigit():
+        return None
+    return int(raw[len(TOKEN_PREFIX):])
+
+
+def format_change(change: Dict[str, Any]) -> Dict[str, Any]:
+    """Format một change (message/room dùng cùng format với REST)"""
+    data = change.get("data", {})
+    if change["kind"] == CHANGE_MESSAGE:
+        data = {**data, "message": format_message_response(data["message"])}
+    elif change["kind"] == CHANGE_ROOM:
+        data = {**data, "room": format_room_response(data["room"])}
+    return {
+        "seq": change["seq"],
+        "kind": change["kind"],
+        "data": data,
+        "created_at": change.get("created_at"),
+    }
+
+
+@router.get("")
+async def sync(username: str, since: Optional[str] = None, limit: Optional[int] = None):
+    """
+    Lấy thay đổi từ sync token `since`: tin nhắn mới/xóa, trạng thái đã đọc,
+    thành viên phòng và metadata phòng. Không có `since` -> chỉ trả token hiện tại
+    (client tải toàn bộ một lần rồi sync tăng dần từ token đó).
+    """
+    # Change log chỉ có với engine MongoDB
+    if settings.STORAGE_ENGINE != "mongodb":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    limit = min(max(limit or settings.SYNC_PAGE_SIZE, 1), settings.SYNC_PAGE_SIZE)
+    
+    since_seq = None
+    if since is not None:
+        since_seq = decode_sync_token(since)
+        if since_seq is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Sync token không hợp lệ"
+            )
+    
+    (oldest, head, latest), room_ids = await asyncio.gather(get_changelog_bounds(), get_user_room_ids(username))
+    if since_seq is None:
+        return FastJSONResponse({"changes": [], "next": encode_sync_token(head), "has_more": False})
+    
+    if since_seq < oldest - 1 or since_seq > latest:
+        # Change log đã bị xóa (quá hạn lưu) hoặc token không thuộc database này
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Sync token đã hết hạn, cần tải lại toàn bộ"
+        )
+    if since_seq >= head:
+        # Change ngay sau token còn đang ghi: chưa có gì an toàn để trả, client giữ token cũ
+        return FastJSONResponse({"changes": [], "next": since, "has_more": False})
+    
+    changes = await get_changes_since(username, room_ids, since_seq, head, limit)
+    has_more = len(changes) == limit
+    # Hết trang: nhảy tới head để lần sau bỏ qua cả các change không liên quan
+    next_seq = changes[-1]["seq"] if has_more else head
+    return FastJSONResponse({
+        "changes": [format_change(c) for c in changes],
+        "next": encode_sync_token(next_seq),
+        "has_more": has_more,
+    })
@@ -1,31 +1,60 @@
 """
 User Routes - Lấy danh sách users, trạng thái online
 """
-from fastapi import APIRouter, HTTPException, status
-from typing import List
+from fastapi import APIRouter, HTTPException, Request, status
+from typing import List, Optional
 from models import UserResponse
-from database import get_user, get_all_users, get_online_users
+from database import get_user, get_all_users, get_online_users, search_usernames
+from config import settings
 from utils import format_user_response
+from responses import FastJSONResponse
+from etags import change_versions, not_modified, etag_headers, USERS_KEY
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
 
 @router.get("/", response_model=List[UserResponse])
-async def get_users():
+async def get_users(request: Request):
     """
     Lấy danh sách tất cả users
     """
+    etag = change_versions.etag(USERS_KEY, "all")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
     users = await get_all_users()
-    return [format_user_response(u) for u in users]
+    return FastJSONResponse([format_user_response(u) for u in users], headers=etag_headers(etag))
 
 
 @router.get("/online", response_model=List[UserResponse])
-async def get_online():
+async def get_online(request: Request):
     """
     Lấy danh sách users đang online
     """
+    etag = change_versions.etag(USERS_KEY, "online")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
     users = await get_online_users()
-    return [format_user_response(u) for u in users]
+    return FastJSONResponse([format_user_response(u) for u in users], headers=etag_headers(etag))
+
+
+@router.get("/search", response_model=List[str])
+async def search_users(q: str, limit: Optional[int] = None):
+    """
+    Tìm username theo tiền tố (không phân biệt hoa thường / dấu), dùng khi chọn người để nhắn / mời
+    """
+    if not settings.USERNAME_SEARCH_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not q.strip():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Từ khóa tìm kiếm không được để trống"
+        )
+    limit = min(max(limit or settings.USERNAME_SEARCH_MAX_RESULTS, 1), settings.USERNAME_SEARCH_MAX_RESULTS)
+    return FastJSONResponse(search_usernames(q.strip(), limit))
 
 
 @router.get("/{username}", response_model=UserResponse)
@@ -39,4 +68,4 @@ async def get_user_profile(username: str):
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User không tồn tại"
         )
-    return format_user_response(user)
+    return FastJSONResponse(format_user_response(user))
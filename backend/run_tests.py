@@ -2,13 +2,27 @@
 """
 RealChat - Automated Test Script
 Tests all functionality of the RealChat application
+
+Benchmark mode (server + mongod phải đang chạy, nên nâng rate limit):
+    RATE_LIMIT_MAX_REQUESTS=100000000 python -m uvicorn main:app --port 8000
+    python run_tests.py --bench --workloads auth room private invite \
+        --concurrency 50 --duration 20 --output bench_results/run.json
+    python run_tests.py --bench --compare bench_results/old.json
 """
+import argparse
 import asyncio
 import aiohttp
 import json
+import os
+import subprocess
 import sys
+import time
+import uuid
+from collections import defaultdict
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable, Awaitable, Tuple
+
+from benchmarks.common import summarize
 
 # Configuration
 BASE_URL = "http://localhost:8000"
@@ -48,7 +62,8 @@ def print_info(text: str):
 
 
 class RealChatTester:
-    def __init__(self):
+    def __init__(self, base_url: str = BASE_URL):
+        self.base_url = base_url.rstrip("/")
         self.session: Optional[aiohttp.ClientSession] = None
         self.tokens: Dict[str, str] = {}
         self.test_results: List[Dict[str, Any]] = []
@@ -73,7 +88,7 @@ class RealChatTester:
         """Test health check endpoint"""
         print_header("Testing Health Check")
         try:
-            async with self.session.get(f"{BASE_URL}/health") as response:
+            async with self.session.get(f"{self.base_url}/health") as response:
                 data = await response.json()
                 if response.status == 200 and data.get("status") == "healthy":
                     print_success(f"Health check: {data}")
@@ -93,7 +108,7 @@ class RealChatTester:
         for user in TEST_USERS:
             try:
                 async with self.session.post(
-                    f"{BASE_URL}/api/auth/register",
+                    f"{self.base_url}/api/auth/register",
                     json=user
                 ) as response:
                     data = await response.json()
@@ -118,7 +133,7 @@ class RealChatTester:
         for user in TEST_USERS:
             try:
                 async with self.session.post(
-                    f"{BASE_URL}/api/auth/login",
+                    f"{self.base_url}/api/auth/login",
                     json={"username": user["username"], "password": user["password"]}
                 ) as response:
                     data = await response.json()
@@ -142,7 +157,7 @@ class RealChatTester:
         for username in self.tokens.keys():
             try:
                 async with self.session.post(
-                    f"{BASE_URL}/api/auth/logout",
+                    f"{self.base_url}/api/auth/logout",
                     params={"username": username}
                 ) as response:
                     data = await response.json()
@@ -163,7 +178,7 @@ class RealChatTester:
         
         # Test get all users
         try:
-            async with self.session.get(f"{BASE_URL}/api/users") as response:
+            async with self.session.get(f"{self.base_url}/api/users") as response:
                 if response.status == 200:
                     users = await response.json()
                     print_success(f"Get all users: {len(users)} users found")
@@ -176,7 +191,7 @@ class RealChatTester:
         
         # Test get online users
         try:
-            async with self.session.get(f"{BASE_URL}/api/users/online") as response:
+            async with self.session.get(f"{self.base_url}/api/users/online") as response:
                 if response.status == 200:
                     online_users = await response.json()
                     print_success(f"Get online users: {len(online_users)} users online")
@@ -187,7 +202,7 @@ class RealChatTester:
         
         # Test get user profile
         try:
-            async with self.session.get(f"{BASE_URL}/api/users/{TEST_USERS[0]['username']}") as response:
+            async with self.session.get(f"{self.base_url}/api/users/{TEST_USERS[0]['username']}") as response:
                 if response.status == 200:
                     user = await response.json()
                     print_success(f"Get user profile: {user.get('username')}")
@@ -210,7 +225,7 @@ class RealChatTester:
         
         try:
             async with self.session.post(
-                f"{BASE_URL}/api/auth/login",
+                f"{self.base_url}/api/auth/login",
                 json=login_data
             ) as response:
                 data = await response.json()
@@ -225,7 +240,7 @@ class RealChatTester:
                     }
                     
                     async with self.session.post(
-                        f"{BASE_URL}/api/rooms/?username={TEST_USERS[0]['username']}",
+                        f"{self.base_url}/api/rooms/?username={TEST_USERS[0]['username']}",
                         json=room_data
                     ) as room_response:
                         room = await room_response.json()
@@ -241,7 +256,7 @@ class RealChatTester:
                                 # Get a room for testing
                                 try:
                                     async with self.session.get(
-                                        f"{BASE_URL}/api/rooms/user/{TEST_USERS[0]['username']}"
+                                        f"{self.base_url}/api/rooms/user/{TEST_USERS[0]['username']}"
                                     ) as get_resp:
                                         rooms = await get_resp.json()
                                         if rooms:
@@ -264,7 +279,7 @@ class RealChatTester:
         
         # Get all rooms
         try:
-            async with self.session.get(f"{BASE_URL}/api/rooms/") as response:
+            async with self.session.get(f"{self.base_url}/api/rooms/") as response:
                 if response.status == 200:
                     rooms = await response.json()
                     print_success(f"Get all rooms: {len(rooms)} rooms found")
@@ -279,7 +294,7 @@ class RealChatTester:
         # Get user rooms
         try:
             async with self.session.get(
-                f"{BASE_URL}/api/rooms/user/{TEST_USERS[0]['username']}"
+                f"{self.base_url}/api/rooms/user/{TEST_USERS[0]['username']}"
             ) as response:
                 if response.status == 200:
                     user_rooms = await response.json()
@@ -305,7 +320,7 @@ class RealChatTester:
         # Join room
         try:
             async with self.session.post(
-                f"{BASE_URL}/api/rooms/{self.created_room_id}/join?username={TEST_USERS[0]['username']}"
+                f"{self.base_url}/api/rooms/{self.created_room_id}/join?username={TEST_USERS[0]['username']}"
             ) as response:
                 data = await response.json()
                 if response.status == 200:
@@ -320,7 +335,7 @@ class RealChatTester:
         # Leave room
         try:
             async with self.session.post(
-                f"{BASE_URL}/api/rooms/{self.created_room_id}/leave?username={TEST_USERS[0]['username']}"
+                f"{self.base_url}/api/rooms/{self.created_room_id}/leave?username={TEST_USERS[0]['username']}"
             ) as response:
                 data = await response.json()
                 if response.status == 200:
@@ -344,7 +359,7 @@ class RealChatTester:
         
         # Re-join room first
         await self.session.post(
-            f"{BASE_URL}/api/rooms/{self.created_room_id}/join?username={TEST_USERS[0]['username']}"
+            f"{self.base_url}/api/rooms/{self.created_room_id}/join?username={TEST_USERS[0]['username']}"
         )
         
         # Send room message (room_id is required in body even though it's in path)
@@ -357,7 +372,7 @@ class RealChatTester:
         
         try:
             async with self.session.post(
-                f"{BASE_URL}/api/rooms/{self.created_room_id}/messages",
+                f"{self.base_url}/api/rooms/{self.created_room_id}/messages",
                 json=message_data
             ) as response:
                 if response.status in [201, 200]:
@@ -374,7 +389,7 @@ class RealChatTester:
         # Get room messages
         try:
             async with self.session.get(
-                f"{BASE_URL}/api/rooms/{self.created_room_id}/messages"
+                f"{self.base_url}/api/rooms/{self.created_room_id}/messages"
             ) as response:
                 if response.status == 200:
                     messages = await response.json()
@@ -399,7 +414,7 @@ class RealChatTester:
         
         try:
             async with self.session.post(
-                f"{BASE_URL}/api/messages/send?username={TEST_USERS[0]['username']}",
+                f"{self.base_url}/api/messages/send?username={TEST_USERS[0]['username']}",
                 json=message_data
             ) as response:
                 message = await response.json()
@@ -413,7 +428,7 @@ class RealChatTester:
         # Get private messages
         try:
             async with self.session.get(
-                f"{BASE_URL}/api/messages/private/{TEST_USERS[0]['username']}?other_user={TEST_USERS[1]['username']}"
+                f"{self.base_url}/api/messages/private/{TEST_USERS[0]['username']}?other_user={TEST_USERS[1]['username']}"
             ) as response:
                 if response.status == 200:
                     messages = await response.json()
@@ -426,7 +441,7 @@ class RealChatTester:
         # Get unread messages
         try:
             async with self.session.get(
-                f"{BASE_URL}/api/messages/unread/{TEST_USERS[1]['username']}"
+                f"{self.base_url}/api/messages/unread/{TEST_USERS[1]['username']}"
             ) as response:
                 if response.status == 200:
                     messages = await response.json()
@@ -451,7 +466,7 @@ class RealChatTester:
         
         try:
             async with self.session.post(
-                f"{BASE_URL}/api/rooms/{self.created_room_id}/invite?username={TEST_USERS[0]['username']}",
+                f"{self.base_url}/api/rooms/{self.created_room_id}/invite?username={TEST_USERS[0]['username']}",
                 json=invite_data
             ) as response:
                 invite = await response.json()
@@ -468,7 +483,7 @@ class RealChatTester:
         # Get invitation links
         try:
             async with self.session.get(
-                f"{BASE_URL}/api/rooms/{self.created_room_id}/invites?username={TEST_USERS[0]['username']}"
+                f"{self.base_url}/api/rooms/{self.created_room_id}/invites?username={TEST_USERS[0]['username']}"
             ) as response:
                 if response.status == 200:
                     invites = await response.json()
@@ -481,7 +496,7 @@ class RealChatTester:
         # Validate invitation link
         try:
             async with self.session.post(
-                f"{BASE_URL}/api/rooms/invite/validate?invite_code={self.invite_code}"
+                f"{self.base_url}/api/rooms/invite/validate?invite_code={self.invite_code}"
             ) as response:
                 if response.status == 200:
                     print_success("Invitation link is valid")
@@ -498,7 +513,7 @@ class RealChatTester:
         
         try:
             async with self.session.post(
-                f"{BASE_URL}/api/rooms/invite/join",
+                f"{self.base_url}/api/rooms/invite/join",
                 json=join_data
             ) as response:
                 if response.status == 200:
@@ -511,6 +526,419 @@ class RealChatTester:
         
         return True
 
+    async def test_inbox(self) -> bool:
+        """Test inbox (last message + unread count per conversation)"""
+        print_header("Testing Inbox")
+        sender, recipient = TEST_USERS[0]["username"], TEST_USERS[1]["username"]
+        content = f"Inbox test {uuid.uuid4().hex[:8]}"
+        
+        try:
+            async with self.session.post(
+                f"{self.base_url}/api/messages/send?username={sender}",
+                json={"recipient": recipient, "content": content, "message_type": "TEXT"}
+            ) as response:
+                if response.status not in [200, 201]:
+                    print_error(f"Send message for inbox failed: {await response.text()}")
+                    return False
+            
+            async with self.session.get(f"{self.base_url}/api/inbox/{recipient}") as response:
+                if response.status != 200:
+                    print_error(f"Get inbox failed: {response.status}")
+                    return False
+                entries = await response.json()
+                entry = next((e for e in entries if e.get("kind") == "direct" and e.get("conversation_id") == sender), None)
+                if not entry or (entry.get("last_message") or {}).get("content") != content or entry.get("unread", 0) < 1:
+                    print_error(f"Inbox entry for {sender} is stale: {entry}")
+                    return False
+                print_success(f"Get inbox: {len(entries)} conversations, {entry['unread']} unread from {sender}")
+            
+            async with self.session.put(f"{self.base_url}/api/inbox/{recipient}/direct/{sender}/read") as response:
+                if response.status != 200:
+                    print_error(f"Mark inbox read failed: {await response.text()}")
+                    return False
+            
+            async with self.session.get(f"{self.base_url}/api/inbox/{recipient}") as response:
+                entries = await response.json()
+                entry = next((e for e in entries if e.get("kind") == "direct" and e.get("conversation_id") == sender), None)
+                if response.status != 200 or not entry or entry.get("unread") != 0:
+                    print_error(f"Inbox unread not reset: {entry}")
+                    return False
+                print_success("Marked conversation read: unread = 0")
+        except Exception as e:
+            print_error(f"Inbox error: {e}")
+            return False
+        
+        return True
+
+    async def _receive_until(self, ws, predicate: Callable[[Dict[str, Any]], bool], timeout: float = 5.0) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Đọc frame JSON từ WebSocket tới khi predicate đúng (hoặc hết timeout); trả về (frame khớp, các frame đã đọc)"""
+        frames: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, frames
+            try:
+                frame = await ws.receive_json(timeout=remaining)
+            except (asyncio.TimeoutError, TypeError):
+                return None, frames
+            frames.append(frame)
+            if predicate(frame):
+                return frame, frames
+
+    async def test_websocket_resume(self) -> bool:
+        """Test WebSocket resume (replay tin nhắn bị lỡ theo seq)"""
+        print_header("Testing WebSocket Resume")
+        sender, recipient = TEST_USERS[0]["username"], TEST_USERS[1]["username"]
+        stream = "conv:" + "|".join(sorted((sender, recipient)))
+        content = f"Resume test {uuid.uuid4().hex[:8]}"
+        ws_url = self.base_url.replace("http", "ws", 1)
+        
+        try:
+            async with self.session.ws_connect(f"{ws_url}/api/messages/ws/{recipient}") as ws:
+                # Bỏ qua offline_batch (nếu có) gửi ngay khi kết nối
+                await self._receive_until(ws, lambda f: False, timeout=0.5)
+                
+                async with self.session.post(
+                    f"{self.base_url}/api/messages/send?username={sender}",
+                    json={"recipient": recipient, "content": content, "message_type": "TEXT"}
+                ) as response:
+                    if response.status not in [200, 201]:
+                        print_error(f"Send message for resume failed: {await response.text()}")
+                        return False
+                    seq = (await response.json()).get("seq")
+                if not isinstance(seq, int):
+                    print_error(f"Message has no seq: {seq}")
+                    return False
+                
+                live, _ = await self._receive_until(ws, lambda f: f.get("content") == content)
+                if not live:
+                    print_error("Live message not received over WebSocket")
+                    return False
+                print_success(f"Received live message (seq {seq})")
+                
+                await ws.send_json({"type": "resume", "streams": {stream: seq - 1}})
+                result, frames = await self._receive_until(ws, lambda f: f.get("type") == "resume_result")
+                if not result:
+                    print_error("No resume_result received")
+                    return False
+                replayed = [f for f in frames if f.get("stream") == stream]
+                if stream in result.get("resync", []):
+                    print_info(f"Stream {stream} needs resync (not in this worker's replay buffer)")
+                elif result.get("replayed", 0) < 1 or not any(f.get("content") == content for f in replayed):
+                    print_error(f"Missed message was not replayed: {result}")
+                    return False
+                else:
+                    print_success(f"Resume replayed {result['replayed']} message(s)")
+        except Exception as e:
+            print_error(f"WebSocket resume error: {e}")
+            return False
+        
+        return True
+
+    async def test_sync(self) -> bool:
+        """Test delta sync (token -> chỉ các thay đổi mới)"""
+        print_header("Testing Delta Sync")
+        sender, recipient = TEST_USERS[0]["username"], TEST_USERS[1]["username"]
+        content = f"Sync test {uuid.uuid4().hex[:8]}"
+        
+        try:
+            async with self.session.get(f"{self.base_url}/api/sync", params={"username": recipient}) as response:
+                if response.status == 404:
+                    print_info("Delta sync not available on this storage engine, skipped")
+                    return True
+                data = await response.json()
+                if response.status != 200 or data.get("changes") != [] or not data.get("next"):
+                    print_error(f"Initial sync failed: {data}")
+                    return False
+                token = data["next"]
+                print_success("Got initial sync token")
+            
+            async with self.session.post(
+                f"{self.base_url}/api/messages/send?username={sender}",
+                json={"recipient": recipient, "content": content, "message_type": "TEXT"}
+            ) as response:
+                if response.status not in [200, 201]:
+                    print_error(f"Send message for sync failed: {await response.text()}")
+                    return False
+            
+            async with self.session.get(
+                f"{self.base_url}/api/sync", params={"username": recipient, "since": token}
+            ) as response:
+                data = await response.json()
+                if response.status != 200:
+                    print_error(f"Incremental sync failed: {data}")
+                    return False
+                changes = data.get("changes", [])
+                if not any(c.get("kind") == "message" and c["data"]["message"].get("content") == content for c in changes):
+                    print_error(f"New message missing from sync changes: {changes}")
+                    return False
+                if data.get("next") == token:
+                    print_error("Sync token did not advance")
+                    return False
+                print_success(f"Incremental sync: {len(changes)} change(s)")
+            
+            async with self.session.get(
+                f"{self.base_url}/api/sync", params={"username": recipient, "since": "not-a-token"}
+            ) as response:
+                if response.status != 400:
+                    print_error(f"Invalid sync token accepted: {response.status}")
+                    return False
+                print_success("Invalid sync token rejected")
+        except Exception as e:
+            print_error(f"Sync error: {e}")
+            return False
+        
+        return True
+
+    async def test_offline_delivery(self) -> bool:
+        """Test offline queue: offline_batch khi kết nối lại và ack"""
+        print_header("Testing Offline Delivery")
+        sender, recipient = TEST_USERS[0]["username"], TEST_USERS[2]["username"]
+        content = f"Offline test {uuid.uuid4().hex[:8]}"
+        ws_url = self.base_url.replace("http", "ws", 1)
+        
+        def has_message(frame: Dict[str, Any]) -> bool:
+            return frame.get("type") == "offline_batch" and any(m.get("content") == content for m in frame.get("messages", []))
+        
+        try:
+            # Chỉ bỏ qua khi server báo hàng đợi bị tắt; không nhận được offline_batch là lỗi
+            async with self.session.get(f"{self.base_url}/metrics") as response:
+                if response.status != 200:
+                    print_error(f"Get metrics failed: {response.status}")
+                    return False
+                if "realchat_offline_queue_enabled 0" in (await response.text()).splitlines():
+                    print_info("Offline queue disabled on this server, skipped")
+                    return True
+            
+            # recipient không có WebSocket nên tin nhắn vào hàng đợi offline
+            async with self.session.post(
+                f"{self.base_url}/api/messages/send?username={sender}",
+                json={"recipient": recipient, "content": content, "message_type": "TEXT"}
+            ) as response:
+                if response.status not in [200, 201]:
+                    print_error(f"Send message for offline delivery failed: {await response.text()}")
+                    return False
+            
+            async with self.session.ws_connect(f"{ws_url}/api/messages/ws/{recipient}") as ws:
+                batch, frames = await self._receive_until(ws, has_message, timeout=3.0)
+                if not batch:
+                    print_error(f"Queued message not delivered in offline_batch: {frames}")
+                    return False
+                print_success(f"Received offline_batch with {len(batch['messages'])} message(s)")
+                await ws.send_json({"type": "ack", "ack": batch["ack"]})
+                # Chờ server xử lý ack trước khi đóng socket
+                await asyncio.sleep(0.5)
+            
+            async with self.session.ws_connect(f"{ws_url}/api/messages/ws/{recipient}") as ws:
+                batch, _ = await self._receive_until(ws, has_message, timeout=1.0)
+                if batch:
+                    print_error("Acked message was delivered again")
+                    return False
+                print_success("Acked messages are not redelivered")
+        except Exception as e:
+            print_error(f"Offline delivery error: {e}")
+            return False
+        
+        return True
+
+    async def test_message_search(self) -> bool:
+        """Test full-text search (không phân biệt dấu) trong hội thoại 1-1"""
+        print_header("Testing Message Search")
+        sender, recipient = TEST_USERS[0]["username"], TEST_USERS[1]["username"]
+        marker = f"tk{uuid.uuid4().hex[:8]}"
+        content = f"Hẹn gặp ở thư viện {marker}"
+        
+        try:
+            async with self.session.post(
+                f"{self.base_url}/api/messages/send?username={sender}",
+                json={"recipient": recipient, "content": content, "message_type": "TEXT"}
+            ) as response:
+                if response.status not in [200, 201]:
+                    print_error(f"Send message for search failed: {await response.text()}")
+                    return False
+            
+            async with self.session.get(
+                f"{self.base_url}/api/search",
+                params={"username": recipient, "with_user": sender, "q": f"thu vien {marker}"}
+            ) as response:
+                if response.status == 404:
+                    print_info("Message search disabled on this server, skipped")
+                    return True
+                data = await response.json()
+                if response.status != 200:
+                    print_error(f"Search failed: {data}")
+                    return False
+                results = data.get("results", [])
+                if not results or results[0].get("content") != content or data.get("total", 0) < 1:
+                    print_error(f"Unaccented query did not find the message: {data}")
+                    return False
+                print_success(f"Search found {data['total']} result(s), top score {results[0].get('score')}")
+            
+            async with self.session.get(
+                f"{self.base_url}/api/search",
+                params={"username": recipient, "q": marker}
+            ) as response:
+                if response.status != 400:
+                    print_error(f"Search without scope accepted: {response.status}")
+                    return False
+                print_success("Search without room_id/with_user rejected")
+        except Exception as e:
+            print_error(f"Message search error: {e}")
+            return False
+        
+        return True
+
+    async def test_username_search(self) -> bool:
+        """Test tìm username theo tiền tố (không phân biệt hoa thường)"""
+        print_header("Testing Username Search")
+        expected = sorted(user["username"] for user in TEST_USERS)
+        
+        try:
+            async with self.session.get(f"{self.base_url}/api/users/search", params={"q": "TestUser"}) as response:
+                if response.status == 404:
+                    print_info("Username search disabled on this server, skipped")
+                    return True
+                names = await response.json()
+                if response.status != 200 or not set(expected) <= set(names) or names != sorted(names):
+                    print_error(f"Username search failed: {names}")
+                    return False
+                print_success(f"Prefix 'TestUser': {len(names)} username(s)")
+            
+            async with self.session.get(f"{self.base_url}/api/users/search", params={"q": expected[0], "limit": 1}) as response:
+                names = await response.json()
+                if response.status != 200 or names != [expected[0]]:
+                    print_error(f"Username search with limit failed: {names}")
+                    return False
+                print_success(f"Exact prefix with limit=1: {names}")
+            
+            async with self.session.get(f"{self.base_url}/api/users/search", params={"q": " "}) as response:
+                if response.status != 400:
+                    print_error(f"Empty username query accepted: {response.status}")
+                    return False
+                print_success("Empty query rejected")
+        except Exception as e:
+            print_error(f"Username search error: {e}")
+            return False
+        
+        return True
+
+    async def test_message_batch(self) -> bool:
+        """Test gửi nhiều tin nhắn trong một request (kết quả theo từng tin)"""
+        print_header("Testing Batch Send")
+        
+        if not self.created_room_id:
+            print_error("No room ID available")
+            return False
+        
+        batch = {"messages": [
+            {"recipient": TEST_USERS[1]["username"], "content": "Batch direct message"},
+            {"room_id": self.created_room_id, "content": "Batch room message"},
+            {"recipient": f"nouser{uuid.uuid4().hex[:8]}", "content": "Batch message to nobody"},
+        ]}
+        
+        try:
+            async with self.session.post(
+                f"{self.base_url}/api/messages/send-batch?username={TEST_USERS[0]['username']}",
+                json=batch
+            ) as response:
+                data = await response.json()
+                if response.status != 200:
+                    print_error(f"Batch send failed: {data}")
+                    return False
+                results = data.get("results", [])
+                statuses = [r.get("status") for r in results]
+                if (data.get("sent"), data.get("failed")) != (2, 1) or statuses != ["sent", "sent", "failed"]:
+                    print_error(f"Unexpected batch result: {data}")
+                    return False
+                if [r.get("index") for r in results] != [0, 1, 2] or not all(r.get("message_id") for r in results[:2]):
+                    print_error(f"Batch results missing index/message_id: {results}")
+                    return False
+                print_success(f"Batch send: {data['sent']} sent, {data['failed']} failed ({results[2].get('error')})")
+            
+            async with self.session.post(
+                f"{self.base_url}/api/messages/send-batch?username={TEST_USERS[0]['username']}",
+                json={"messages": []}
+            ) as response:
+                if response.status != 422:
+                    print_error(f"Empty batch accepted: {response.status}")
+                    return False
+                print_success("Empty batch rejected")
+        except Exception as e:
+            print_error(f"Batch send error: {e}")
+            return False
+        
+        return True
+
+    async def test_bulk_membership(self) -> bool:
+        """Test thêm / xóa / xuất thành viên phòng hàng loạt"""
+        print_header("Testing Bulk Membership")
+        
+        if not self.created_room_id:
+            print_error("No room ID available")
+            return False
+        
+        creator, member = TEST_USERS[0]["username"], TEST_USERS[2]["username"]
+        missing = f"nouser{uuid.uuid4().hex[:8]}"
+        members_url = f"{self.base_url}/api/rooms/{self.created_room_id}/members"
+        
+        try:
+            async with self.session.post(
+                f"{members_url}/import?username={creator}", json={"usernames": [member, missing]}
+            ) as response:
+                data = await response.json()
+                if response.status != 200:
+                    print_error(f"Bulk import failed: {data}")
+                    return False
+                if member not in data.get("added", []) + data.get("already_members", []) or data.get("not_found") != [missing]:
+                    print_error(f"Unexpected import result: {data}")
+                    return False
+                print_success(f"Imported members: added={data['added']}, not_found={data['not_found']}, total={data['member_count']}")
+            
+            async with self.session.get(f"{members_url}/export") as response:
+                data = await response.json()
+                if response.status != 200 or member not in data.get("members", []):
+                    print_error(f"JSON export missing {member}: {data}")
+                    return False
+                print_success(f"Exported {len(data['members'])} members as JSON")
+            
+            async with self.session.get(f"{members_url}/export", params={"format": "csv"}) as response:
+                lines = (await response.text()).splitlines()
+                if response.status != 200 or not response.content_type.startswith("text/csv") or lines[:1] != ["username"] or member not in lines:
+                    print_error(f"CSV export failed: {response.status} {lines[:5]}")
+                    return False
+                print_success(f"Exported {len(lines) - 1} members as CSV")
+            
+            async with self.session.post(
+                f"{members_url}/remove?username={creator}", json={"usernames": [member]}
+            ) as response:
+                data = await response.json()
+                if response.status != 200 or data.get("removed") != [member]:
+                    print_error(f"Bulk remove failed: {data}")
+                    return False
+                print_success(f"Removed members: {data['removed']}, total={data['member_count']}")
+            
+            async with self.session.post(
+                f"{members_url}/remove?username={creator}", json={"usernames": [creator]}
+            ) as response:
+                if response.status != 400:
+                    print_error(f"Removing the creator was not rejected: {response.status}")
+                    return False
+                print_success("Removing the creator rejected")
+            
+            async with self.session.post(
+                f"{members_url}/import?username={TEST_USERS[1]['username']}", json={"usernames": [member]}
+            ) as response:
+                if response.status != 403:
+                    print_error(f"Import by non-creator was not rejected: {response.status}")
+                    return False
+                print_success("Import by non-creator rejected")
+        except Exception as e:
+            print_error(f"Bulk membership error: {e}")
+            return False
+        
+        return True
+
     async def cleanup_test_data(self):
         """Xóa dữ liệu test từ lần chạy trước"""
         print_header("Cleaning Up Old Test Data")
@@ -519,7 +947,7 @@ class RealChatTester:
             for user in TEST_USERS:
                 try:
                     async with self.session.delete(
-                        f"{BASE_URL}/api/users/{user['username']}"
+                        f"{self.base_url}/api/users/{user['username']}"
                     ) as response:
                         if response.status == 200:
                             print_success(f"Deleted user: {user['username']}")
@@ -550,6 +978,14 @@ class RealChatTester:
             "room_messages": await self.test_room_messages(),
             "private_messages": await self.test_private_messages(),
             "invitation_links": await self.test_invitation_links(),
+            "inbox": await self.test_inbox(),
+            "websocket_resume": await self.test_websocket_resume(),
+            "sync": await self.test_sync(),
+            "offline_delivery": await self.test_offline_delivery(),
+            "message_search": await self.test_message_search(),
+            "username_search": await self.test_username_search(),
+            "message_batch": await self.test_message_batch(),
+            "bulk_membership": await self.test_bulk_membership(),
             "logout": await self.test_auth_logout(),
         }
         
@@ -571,9 +1007,277 @@ class RealChatTester:
         return all(results.values())
 
 
+# ============ BENCHMARK MODE ============
+
+WORKLOADS = ["auth", "room", "private", "invite"]
+
+
+class LatencyRecorder:
+    """Ghi độ trễ và lỗi theo endpoint"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, seconds: float, status: int):
+        self.samples[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+        if status == 0 or status >= 400:
+            self.errors[endpoint] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            stats = summarize(samples, elapsed)
+            stats["errors"] = self.errors.get(endpoint, 0)
+            stats["statuses"] = {str(code): count for code, count in sorted(self.statuses[endpoint].items())}
+            result[endpoint] = stats
+        return result
+
+
+class RealChatBenchmark:
+    """Chạy workload đồng thời và đo throughput + p50/p95/p99 theo endpoint"""
+
+    def __init__(self, base_url: str, concurrency: int, duration: float, users: int):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.duration = duration
+        self.user_count = max(users, 2)
+        self.run_id = uuid.uuid4().hex[:6]
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.users: List[str] = []
+        self.room_ids: List[str] = []
+        self.recorder = LatencyRecorder()
+        self._counter = 0
+
+    def _next(self) -> int:
+        self._counter += 1
+        return self._counter
+
+    async def request(self, method: str, endpoint: str, path: str, **kwargs) -> Tuple[int, Any]:
+        """Gửi request, ghi độ trễ dưới nhãn endpoint"""
+        started = time.perf_counter()
+        status = 0
+        data: Any = None
+        try:
+            async with self.session.request(method, f"{self.base_url}{path}", **kwargs) as response:
+                status = response.status
+                body = await response.read()
+                if body and response.content_type == "application/json":
+                    data = json.loads(body)
+        except Exception as e:
+            data = str(e)
+        self.recorder.record(endpoint, time.perf_counter() - started, status)
+        return status, data
+
+    # ---------- setup ----------
+
+    async def setup(self):
+        print_header("Benchmark Setup")
+        connector = aiohttp.TCPConnector(limit=self.concurrency * 2)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+        self.users = [f"bn{self.run_id}u{i}" for i in range(self.user_count)]
+        await asyncio.gather(*[
+            self.request("POST", "setup", "/api/auth/register",
+                         json={"username": u, "password": "password123"})
+            for u in self.users
+        ])
+        print_success(f"Registered {len(self.users)} users (run {self.run_id})")
+
+        for i in range(max(1, self.user_count // 10)):
+            creator = self.users[i % len(self.users)]
+            status, room = await self.request(
+                "POST", "setup", f"/api/rooms/?username={creator}",
+                json={"room_name": f"Bench {self.run_id} {i}", "members": self.users},
+            )
+            if status == 201:
+                self.room_ids.append(room["_id"])
+        print_success(f"Created {len(self.room_ids)} rooms")
+        if not self.room_ids:
+            raise RuntimeError("Không tạo được phòng benchmark (server có đang chạy?)")
+        # Kết quả setup không tính vào benchmark
+        self.recorder = LatencyRecorder()
+
+    async def teardown(self):
+        if self.session:
+            await self.session.close()
+
+    # ---------- workloads ----------
+
+    async def op_auth(self, worker: int):
+        """Mix đăng ký/đăng nhập (1 register : 4 login)"""
+        n = self._next()
+        if n % 5 == 0:
+            await self.request("POST", "POST /api/auth/register", "/api/auth/register",
+                               json={"username": f"bn{self.run_id}r{n}", "password": "password123"})
+        else:
+            user = self.users[n % len(self.users)]
+            await self.request("POST", "POST /api/auth/login", "/api/auth/login",
+                               json={"username": user, "password": "password123"})
+
+    async def op_room(self, worker: int):
+        """Gửi và đọc tin nhắn phòng (1 send : 3 read)"""
+        n = self._next()
+        room_id = self.room_ids[n % len(self.room_ids)]
+        if n % 4 == 0:
+            await self.request("POST", "POST /api/rooms/{id}/messages", f"/api/rooms/{room_id}/messages",
+                               json={"room_id": room_id, "sender": self.users[n % len(self.users)],
+                                     "content": f"bench message {n}"})
+        else:
+            await self.request("GET", "GET /api/rooms/{id}/messages", f"/api/rooms/{room_id}/messages")
+
+    async def op_private(self, worker: int):
+        """Gửi tin nhắn riêng và đọc lịch sử hội thoại (1 send : 1 read)"""
+        n = self._next()
+        sender = self.users[n % len(self.users)]
+        recipient = self.users[(n + 1) % len(self.users)]
+        if n % 2 == 0:
+            await self.request("POST", "POST /api/messages/send", f"/api/messages/send?username={sender}",
+                               json={"recipient": recipient, "content": f"bench dm {n}"})
+        else:
+            await self.request("GET", "GET /api/messages/private/{u}",
+                               f"/api/messages/private/{sender}?other_user={recipient}")
+
+    async def op_invite(self, worker: int):
+        """Tạo invitation link rồi join qua link"""
+        n = self._next()
+        room_index = n % len(self.room_ids)
+        room_id = self.room_ids[room_index]
+        creator = self.users[room_index % len(self.users)]
+        status, invite = await self.request(
+            "POST", "POST /api/rooms/{id}/invite", f"/api/rooms/{room_id}/invite?username={creator}",
+            json={"expires_in_hours": 1},
+        )
+        if status == 201:
+            await self.request("POST", "POST /api/rooms/invite/join", "/api/rooms/invite/join",
+                               json={"invite_code": invite["invite_code"],
+                                     "username": self.users[n % len(self.users)]})
+
+    async def run_workload(self, name: str) -> Dict[str, Any]:
+        op: Callable[[int], Awaitable[None]] = getattr(self, f"op_{name}")
+        self.recorder = LatencyRecorder()
+        deadline = time.perf_counter() + self.duration
+        ops = 0
+
+        async def worker(worker_id: int):
+            nonlocal ops
+            while time.perf_counter() < deadline:
+                await op(worker_id)
+                ops += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(i) for i in range(self.concurrency)])
+        elapsed = time.perf_counter() - started
+        return {
+            "elapsed_s": elapsed,
+            "operations": ops,
+            "ops_per_sec": ops / elapsed if elapsed else 0.0,
+            "endpoints": self.recorder.summary(elapsed),
+        }
+
+    async def run(self, workloads: List[str]) -> Dict[str, Any]:
+        await self.setup()
+        results = {}
+        try:
+            for name in workloads:
+                print_header(f"Workload: {name}")
+                results[name] = await self.run_workload(name)
+                print_workload(results[name])
+        finally:
+            await self.teardown()
+        return results
+
+
+def git_commit() -> Optional[str]:
+    """Commit hiện tại để so sánh kết quả giữa các lần chạy"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def print_workload(result: Dict[str, Any]):
+    print_info(f"{result['operations']} ops in {result['elapsed_s']:.1f}s ({result['ops_per_sec']:.1f} ops/s)")
+    print(f"{'endpoint':<36}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for endpoint, stats in result["endpoints"].items():
+        print(
+            f"{endpoint:<36}{stats['ops_per_sec']:>9.1f}{stats['p50_ms']:>9.2f}"
+            f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['errors']:>8}"
+        )
+
+
+def print_comparison(current: Dict[str, Any], baseline: Dict[str, Any]):
+    """So sánh req/s và p95 với một file kết quả trước đó"""
+    print_header(f"Compare vs {baseline['meta'].get('commit') or 'baseline'}")
+    print(f"{'endpoint':<36}{'req/s Δ%':>10}{'p95 Δ%':>10}")
+    for workload, result in current["results"].items():
+        old = baseline["results"].get(workload)
+        if not old:
+            continue
+        for endpoint, stats in result["endpoints"].items():
+            prev = old["endpoints"].get(endpoint)
+            if not prev:
+                continue
+            rps = (stats["ops_per_sec"] / prev["ops_per_sec"] - 1) * 100 if prev["ops_per_sec"] else 0.0
+            p95 = (stats["p95_ms"] / prev["p95_ms"] - 1) * 100 if prev["p95_ms"] else 0.0
+            print(f"{endpoint:<36}{rps:>+10.1f}{p95:>+10.1f}")
+
+
+async def run_benchmark(args: argparse.Namespace):
+    bench = RealChatBenchmark(args.base_url, args.concurrency, args.duration, args.users)
+    started_at = datetime.now().isoformat(timespec="seconds")
+    results = await bench.run(args.workloads)
+    report = {
+        "meta": {
+            "started_at": started_at,
+            "commit": git_commit(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "users": args.users,
+            "workloads": args.workloads,
+        },
+        "results": results,
+    }
+
+    output = args.output or os.path.join(
+        "bench_results", f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['meta']['commit'] or 'nogit'}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print_success(f"Saved results to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="RealChat smoke tests / HTTP benchmark")
+    parser.add_argument("--bench", action="store_true", help="Chạy benchmark thay vì smoke test")
+    parser.add_argument("--base-url", default=BASE_URL, help="URL server cho cả smoke test lẫn benchmark")
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="Số giây cho mỗi workload")
+    parser.add_argument("--users", type=int, default=50, help="Số user tạo sẵn cho benchmark")
+    parser.add_argument("--output", help="File JSON kết quả (mặc định bench_results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="File JSON kết quả trước đó để so sánh")
+    return parser.parse_args(argv)
+
+
 async def main():
     """Main entry point"""
-    tester = RealChatTester()
+    args = parse_args()
+    if args.bench:
+        await run_benchmark(args)
+        return
+
+    tester = RealChatTester(args.base_url)
     success = await tester.run_all_tests()
     
     if success:
@@ -0,0 +1,95 @@
+"""
+Message Search cho RealChat - inverted index tự duy trì, bỏ dấu tiếng Việt
+
+- Văn bản được chuẩn hóa: chữ thường, bỏ dấu (NFD + bỏ combining mark, "đ" -> "d"),
+  tách token theo \\w+, nên "tieng viet" khớp "Tiếng Việt"
+- Mỗi (scope, term, message) là một posting trong "search_postings"; "search_terms" giữ
+  df của term và số tin đã index theo scope (phòng: "room:<id>", 1-1: "conv:<a>|<b>")
+- save_message index tin mới, delete_message gỡ index. Dữ liệu có sẵn: POST /api/admin/search/rebuild
+- Truy vấn: mọi term phải khớp (AND), bắt đầu từ term hiếm nhất (tối đa SEARCH_MAX_CANDIDATES
+  tin gần nhất), xếp hạng tf-idf rồi tới độ mới. Không bao giờ quét "messages" bằng $regex.
+"""
+from collections import Counter
+from typing import Dict, List
+from metrics import registry
+import html
+import math
+import re
+import unicodedata
+
+MAX_TERM_LENGTH = 32
+_TOKEN = re.compile(r"\w+")
+# Chữ không tách được bằng NFD
+_FOLD_EXTRA = {"đ": "d", "Đ": "d", "ð": "d"}
+
+
+def _build_fold_table() -> Dict[int, str]:
+    """Bảng chữ Latin dựng sẵn (gồm mọi chữ tiếng Việt) -> chữ không dấu, cho str.translate"""
+    table = {ord(ch): base for ch, base in _FOLD_EXTRA.items()}
+    for codepoint in (*range(0xC0, 0x250), *range(0x1E00, 0x1F00)):
+        base = "".join(c for c in unicodedata.normalize("NFD", chr(codepoint)) if not unicodedata.combining(c))
+        if base and base != chr(codepoint):
+            table[codepoint] = base
+    return table
+
+
+_FOLD_TABLE = _build_fold_table()
+
+
+def fold(text: str) -> str:
+    """Chữ thường, bỏ dấu: "Tiếng Việt Đẹp" -> "tieng viet dep" """
+    if text.isascii():
+        return text.lower()
+    folded = text.lower().translate(_FOLD_TABLE)
+    if folded.isascii():
+        return folded
+    # Dấu rời (văn bản dạng NFD) hoặc chữ ngoài bảng
+    decomposed = unicodedata.normalize("NFD", folded)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    """Danh sách term đã chuẩn hóa (giữ thứ tự, có lặp)"""
+    # Nội dung đã qua sanitize_input (html.escape): không index "amp", "quot"...
+    return [token[:MAX_TERM_LENGTH] for token in _TOKEN.findall(fold(html.unescape(text)))]
+
+
+def term_frequencies(text: str) -> Dict[str, int]:
+    return dict(Counter(tokenize(text)))
+
+
+def query_terms(query: str) -> List[str]:
+    """Term duy nhất của câu truy vấn (giữ thứ tự)"""
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def idf(total: int, df: int) -> float:
+    return math.log(1 + max(total, df) / max(df, 1))
+
+
+def score(tfs: Dict[str, int], idfs: Dict[str, float]) -> float:
+    """tf-idf với tf bão hòa (1 + log tf) để tin lặp từ không lấn át"""
+    return sum((1 + math.log(tf)) * idfs[term] for term, tf in tfs.items())
+
+
+class SearchStats:
+    def __init__(self):
+        self.indexed = 0
+        self.postings = 0
+        self.queries = 0
+
+
+search_stats = SearchStats()
+
+registry.counter(
+    "realchat_search_indexed_messages_total", "Messages added to the search index",
+    callback=lambda: {(): search_stats.indexed},
+)
+registry.counter(
+    "realchat_search_postings_total", "Postings written to the search index",
+    callback=lambda: {(): search_stats.postings},
+)
+registry.counter(
+    "realchat_search_queries_total", "Search queries executed",
+    callback=lambda: {(): search_stats.queries},
+)
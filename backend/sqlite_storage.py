@@ -0,0 +1,922 @@
+"""
+SQLite Storage cho RealChat - storage engine nhúng cho triển khai nhỏ (STORAGE_ENGINE="sqlite")
+
+- Một file database (SQLITE_PATH), WAL mode: đọc không chặn ghi, ghi không chặn đọc
+- Một connection ghi duy nhất (SQLite chỉ có một writer) với write batcher: các thao tác ghi
+  đến cùng lúc được gom vào MỘT transaction (group commit), mỗi thao tác có SAVEPOINT riêng
+  nên lỗi của một thao tác (vd. trùng username) không ảnh hưởng các thao tác khác trong lô
+- Pool SQLITE_READ_CONNECTIONS connection đọc; mọi lệnh SQLite chạy trong thread pool
+  nên event loop không bị chặn
+- Index cho lịch sử phòng (room_id, id), hội thoại 1-1 (conversation, id), tin chưa đọc,
+  thành viên phòng theo user và inbox theo (owner, last_activity)
+
+id là ObjectId dạng hex: sắp theo chuỗi cũng là sắp theo thời gian tạo, document trả ra
+có cùng dạng với MongoDB. Thời gian lưu dạng ISO 8601 (luôn có micro giây để so sánh chuỗi đúng).
+"""
+from bson import decode, encode
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+from etags import conversation_key
+from metrics import registry
+from replay import message_stream
+from storage import INBOX_DIRECT, INBOX_ROOM, StorageEngine
+import asyncio
+import json
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+Operation = Callable[[sqlite3.Connection], Any]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT UNIQUE,
+    password_hash TEXT NOT NULL,
+    is_online INTEGER NOT NULL DEFAULT 0,
+    last_login TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS users_created_at ON users (created_at);
+CREATE INDEX IF NOT EXISTS users_online ON users (is_online) WHERE is_online = 1;
+
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    room_id TEXT,
+    conversation TEXT,
+    sender TEXT NOT NULL,
+    recipient TEXT,
+    content TEXT NOT NULL,
+    message_type TEXT NOT NULL,
+    is_read INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER,
+    timestamp TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_room ON messages (room_id, id) WHERE room_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation, id) WHERE conversation IS NOT NULL;
+CREATE INDEX IF NOT EXISTS messages_unread ON messages (recipient, sender) WHERE is_read = 0;
+
+CREATE TABLE IF NOT EXISTS counters (
+    stream TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rooms (
+    id TEXT PRIMARY KEY,
+    room_name TEXT NOT NULL UNIQUE,
+    description TEXT,
+    creator TEXT NOT NULL,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS rooms_created_at ON rooms (created_at);
+
+-- rowid giữ thứ tự tham gia (members[0] là creator)
+CREATE TABLE IF NOT EXISTS room_members (
+    room_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (room_id, username)
+);
+CREATE INDEX IF NOT EXISTS room_members_user ON room_members (username, room_id);
+
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    recipient TEXT,
+    room_id TEXT,
+    file_size INTEGER NOT NULL DEFAULT 0,
+    file_data TEXT,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_sender ON files (sender, timestamp);
+CREATE INDEX IF NOT EXISTS files_recipient ON files (recipient, timestamp);
+
+CREATE TABLE IF NOT EXISTS invitation_links (
+    id TEXT PRIMARY KEY,
+    invite_code TEXT NOT NULL UNIQUE,
+    room_id TEXT NOT NULL,
+    room_name TEXT,
+    creator TEXT,
+    created_by TEXT,
+    created_at TEXT,
+    expires_at TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    used_by TEXT NOT NULL DEFAULT '[]',
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS invitation_links_room ON invitation_links (room_id, created_at);
+
+CREATE TABLE IF NOT EXISTS inbox (
+    owner TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    title TEXT,
+    last_message BLOB,
+    last_activity TEXT NOT NULL,
+    unread INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner, kind, conversation_id)
+);
+CREATE INDEX IF NOT EXISTS inbox_activity ON inbox (owner, last_activity);
+CREATE INDEX IF NOT EXISTS inbox_conversation ON inbox (kind, conversation_id);
+"""
+
+PREVIEW_FIELDS = ("_id", "sender", "recipient", "room_id", "content", "message_type", "is_read", "timestamp", "seq")
+
+
+def _ts(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat(timespec="microseconds") if value is not None else None
+
+
+def _dt(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def _now() -> str:
+    return _ts(datetime.now(timezone.utc))
+
+
+def _valid_id(value: Any) -> Optional[str]:
+    """id hex hợp lệ (chữ thường) hoặc None"""
+    try:
+        return str(ObjectId(value))
+    except (InvalidId, TypeError):
+        return None
+
+
+def _placeholders(values: List[Any]) -> str:
+    return ",".join("?" * len(values))
+
+
+def _user(row: sqlite3.Row) -> Dict[str, Any]:
+    user = {
+        "_id": ObjectId(row["id"]),
+        "username": row["username"],
+        "email": row["email"],
+        "is_online": bool(row["is_online"]),
+        "last_login": _dt(row["last_login"]),
+        "created_at": _dt(row["created_at"]),
+        "updated_at": _dt(row["updated_at"]),
+    }
+    if "password_hash" in row.keys():
+        user["password_hash"] = row["password_hash"]
+    return user
+
+
+def _message(row: sqlite3.Row) -> Dict[str, Any]:
+    message = {
+        "_id": ObjectId(row["id"]),
+        "sender": row["sender"],
+        "recipient": row["recipient"],
+        "room_id": ObjectId(row["room_id"]) if row["room_id"] else None,
+        "content": row["content"],
+        "message_type": row["message_type"],
+        "is_read": bool(row["is_read"]),
+        "timestamp": _dt(row["timestamp"]),
+        "seq": row["seq"],
+    }
+    if row["updated_at"] is not None:
+        message["updated_at"] = _dt(row["updated_at"])
+    return message
+
+
+def _file(row: sqlite3.Row) -> Dict[str, Any]:
+    file_obj = {
+        "_id": ObjectId(row["id"]),
+        "filename": row["filename"],
+        "sender": row["sender"],
+        "recipient": row["recipient"],
+        "room_id": row["room_id"],
+        "file_size": row["file_size"],
+        "timestamp": _dt(row["timestamp"]),
+    }
+    if "file_data" in row.keys():
+        file_obj["file_data"] = row["file_data"]
+    return file_obj
+
+
+def _invitation(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "_id": ObjectId(row["id"]),
+        "room_id": row["room_id"],
+        "room_name": row["room_name"],
+        "creator": row["creator"],
+        "invite_code": row["invite_code"],
+        "created_by": row["created_by"],
+        "created_at": _dt(row["created_at"]),
+        "expires_at": _dt(row["expires_at"]),
+        "is_active": bool(row["is_active"]),
+        "used_by": json.loads(row["used_by"]),
+        "updated_at": _dt(row["updated_at"]),
+    }
+
+
+def _inbox_entry(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "owner": row["owner"],
+        "kind": row["kind"],
+        "conversation_id": row["conversation_id"],
+        "title": row["title"],
+        "last_message": decode(row["last_message"]) if row["last_message"] else None,
+        "last_activity": _dt(row["last_activity"]),
+        "unread": row["unread"],
+    }
+
+
+def _rooms_with_members(conn: sqlite3.Connection, rows: List[sqlite3.Row]) -> List[Dict[str, Any]]:
+    """Ghép danh sách thành viên (theo thứ tự tham gia) vào các phòng"""
+    if not rows:
+        return []
+    ids = [row["id"] for row in rows]
+    members: Dict[str, List[str]] = {room_id: [] for room_id in ids}
+    for member in conn.execute(
+        f"SELECT room_id, username FROM room_members WHERE room_id IN ({_placeholders(ids)}) ORDER BY rowid", ids
+    ):
+        members[member["room_id"]].append(member["username"])
+    return [
+        {
+            "_id": ObjectId(row["id"]),
+            "room_name": row["room_name"],
+            "description": row["description"],
+            "creator": row["creator"],
+            "members": members[row["id"]],
+            "created_at": _dt(row["created_at"]),
+            "updated_at": _dt(row["updated_at"]),
+        }
+        for row in rows
+    ]
+
+
+def _room(conn: sqlite3.Connection, room_id: str) -> Optional[Dict[str, Any]]:
+    rooms = _rooms_with_members(conn, conn.execute("SELECT * FROM rooms WHERE id = ?", (room_id,)).fetchall())
+    return rooms[0] if rooms else None
+
+
+def _add_room_inbox(conn: sqlite3.Connection, room_id: str, title: Optional[str], usernames: List[str]):
+    """Entry inbox của phòng cho các thành viên mới (đã có thì chỉ cập nhật title)"""
+    now = _now()
+    conn.executemany(
+        "INSERT INTO inbox (owner, kind, conversation_id, title, last_message, last_activity, unread) "
+        "VALUES (?, ?, ?, ?, NULL, ?, 0) "
+        "ON CONFLICT (owner, kind, conversation_id) DO UPDATE SET title = excluded.title",
+        [(username, INBOX_ROOM, room_id, title, now) for username in usernames],
+    )
+
+
+def _insert_message(conn: sqlite3.Connection, message: Dict[str, Any], message_id: ObjectId) -> Optional[int]:
+    """Ghi tin nhắn + tăng seq của stream + cập nhật inbox; trả về seq"""
+    stream = message_stream(message)
+    room_id = str(message["room_id"]) if message.get("room_id") else None
+    conversation = stream if not room_id and message.get("recipient") else None
+    seq = None
+    if stream:
+        conn.execute(
+            "INSERT INTO counters (stream, seq) VALUES (?, 1) "
+            "ON CONFLICT (stream) DO UPDATE SET seq = seq + 1",
+            (stream,),
+        )
+        seq = conn.execute("SELECT seq FROM counters WHERE stream = ?", (stream,)).fetchone()[0]
+    conn.execute(
+        "INSERT INTO messages (id, room_id, conversation, sender, recipient, content, message_type, "
+        "is_read, seq, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            str(message_id), room_id, conversation, message["sender"], message.get("recipient"),
+            message["content"], message["message_type"], int(message.get("is_read", False)),
+            seq, _ts(message["timestamp"]),
+        ),
+    )
+    preview = encode({**{field: message.get(field) for field in PREVIEW_FIELDS}, "_id": message_id, "seq": seq})
+    activity = _ts(message["timestamp"])
+    if room_id:
+        conn.execute(
+            "UPDATE inbox SET last_message = ?, last_activity = ?, unread = unread + (owner != ?) "
+            "WHERE kind = ? AND conversation_id = ?",
+            (preview, activity, message["sender"], INBOX_ROOM, room_id),
+        )
+    elif conversation:
+        sender, recipient = message["sender"], message["recipient"]
+        conn.executemany(
+            "INSERT INTO inbox (owner, kind, conversation_id, title, last_message, last_activity, unread) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (owner, kind, conversation_id) DO UPDATE SET "
+            "last_message = excluded.last_message, last_activity = excluded.last_activity, "
+            "unread = unread + excluded.unread",
+            [
+                (sender, INBOX_DIRECT, recipient, recipient, preview, activity, 0),
+                (recipient, INBOX_DIRECT, sender, sender, preview, activity, 1),
+            ],
+        )
+    return seq
+
+
+class SQLiteStats:
+    def __init__(self):
+        self.writes = 0
+        self.batches = 0
+        self.failed_writes = 0
+        self.reads = 0
+
+
+sqlite_stats = SQLiteStats()
+
+
+class SQLiteStorage(StorageEngine):
+    """Lưu trữ bằng SQLite (file, WAL)"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, read_connections: int = 4, write_batch_size: int = 256):
+        self.path = path
+        self.read_connections = max(1, read_connections)
+        self.write_batch_size = max(1, write_batch_size)
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.writer: Optional[sqlite3.Connection] = None
+        self.readers: Optional[asyncio.Queue] = None
+        self.pending: List[Tuple[Operation, asyncio.Future]] = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.writer_task: Optional[asyncio.Task] = None
+        self.closing = False
+
+    def _open(self) -> sqlite3.Connection:
+        # isolation_level=None: tự quản lý transaction (BEGIN / SAVEPOINT / COMMIT)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _setup(self):
+        self.writer = self._open()
+        self.writer.execute("PRAGMA journal_mode = WAL")
+        self.writer.executescript(SCHEMA)
+        return [self._open() for _ in range(self.read_connections)]
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(self.read_connections + 1, thread_name_prefix="sqlite")
+        self.readers = asyncio.Queue()
+        for conn in await loop.run_in_executor(self.executor, self._setup):
+            self.readers.put_nowait(conn)
+        self.wakeup = asyncio.Event()
+        self.closing = False
+        self.writer_task = asyncio.create_task(self._run_writer())
+        logger.info(f"✅ SQLite storage ready: {self.path} (WAL, {self.read_connections} read connections)")
+
+    async def close(self):
+        if self.writer_task is None:
+            return
+        # Ghi nốt các thao tác đang chờ rồi mới đóng connection
+        self.closing = True
+        self.wakeup.set()
+        await self.writer_task
+        self.writer_task = None
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
+        self.writer.close()
+        self.executor.shutdown(wait=True)
+        logger.info("SQLite storage closed")
+
+    # ---------- connection pool / write batcher ----------
+
+    async def _read(self, operation: Operation) -> Any:
+        """Chạy operation(conn) trên một connection đọc của pool"""
+        conn = await self.readers.get()
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(operation, conn)
+        # Trả connection về pool khi thread chạy xong (kể cả khi caller bị cancel giữa chừng)
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.readers.put_nowait, conn))
+        sqlite_stats.reads += 1
+        return await asyncio.wrap_future(future)
+
+    async def _write(self, operation: Operation) -> Any:
+        """Đưa operation(conn) vào hàng đợi ghi; chờ tới khi transaction chứa nó đã commit"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((operation, future))
+        self.wakeup.set()
+        return await future
+
+    def _apply(self, operations: List[Operation]) -> List[Tuple[bool, Any]]:
+        """Chạy một lô thao tác ghi trong một transaction (chạy trong thread pool)"""
+        conn = self.writer
+        results: List[Tuple[bool, Any]] = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for operation in operations:
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append((True, operation(conn)))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return results
+
+    async def _run_writer(self):
+        """Task ghi: thao tác đến trong lúc lô trước đang commit được gom vào lô sau"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                batch = self.pending[:self.write_batch_size]
+                del self.pending[:self.write_batch_size]
+                try:
+                    results = await loop.run_in_executor(self.executor, self._apply, [op for op, _ in batch])
+                except Exception as e:
+                    logger.error(f"SQLite write batch failed: {e}")
+                    results = [(False, e)] * len(batch)
+                sqlite_stats.batches += 1
+                for (_, future), (ok, value) in zip(batch, results):
+                    sqlite_stats.writes += 1
+                    if not ok:
+                        sqlite_stats.failed_writes += 1
+                    if future.done():
+                        continue
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+            if self.closing:
+                return
+
+    # ---------- users ----------
+
+    async def create_user(self, user: Dict[str, Any]):
+        user_id = ObjectId()
+
+        def insert(conn: sqlite3.Connection):
+            conn.execute(
+                "INSERT INTO users (id, username, email, password_hash, is_online, last_login, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(user_id), user["username"], user.get("email"), user["password_hash"],
+                    int(user.get("is_online", False)), _ts(user.get("last_login")),
+                    _ts(user.get("created_at")), _ts(user.get("updated_at")),
+                ),
+            )
+
+        try:
+            await self._write(insert)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Username '{user['username']}' hoặc email đã tồn tại")
+        user["_id"] = user_id
+
+    async def user_exists(self, username: str) -> bool:
+        return await self._read(
+            lambda conn: conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is not None
+        )
+
+    async def existing_usernames(self, usernames: List[str]) -> Set[str]:
+        # json_each: một tham số cho cả danh sách (không vướng giới hạn số biến của SQLite)
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT username FROM users WHERE username IN (SELECT value FROM json_each(?))", (json.dumps(usernames),)
+        ).fetchall())
+        return {row[0] for row in rows}
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        row = await self._read(lambda conn: conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone())
+        return _user(row) if row else None
+
+    async def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        user_id = str(ObjectId(user_id))
+        row = await self._read(lambda conn: conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone())
+        return _user(row) if row else None
+
+    async def get_all_users(self) -> List[Dict[str, Any]]:
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT id, username, email, is_online, last_login, created_at, updated_at FROM users"
+        ).fetchall())
+        return [_user(row) for row in rows]
+
+    async def get_online_users(self) -> List[Dict[str, Any]]:
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT id, username, email, is_online, last_login, created_at, updated_at FROM users WHERE is_online = 1"
+        ).fetchall())
+        return [_user(row) for row in rows]
+
+    async def update_user_online_status(self, username: str, is_online: bool) -> bool:
+        now = _now()
+        return await self._write(lambda conn: conn.execute(
+            "UPDATE users SET is_online = ?, last_login = ?, updated_at = ? WHERE username = ?",
+            (int(is_online), now if is_online else None, now, username),
+        ).rowcount > 0)
+
+    async def count_users(self) -> int:
+        return await self._read(lambda conn: conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+
+    async def iter_usernames(self, since: Optional[datetime] = None) -> AsyncIterator[Tuple[str, Optional[datetime]]]:
+        if since is None:
+            query, params = "SELECT username, created_at FROM users", ()
+        else:
+            query, params = "SELECT username, created_at FROM users WHERE created_at >= ?", (_ts(since),)
+        for row in await self._read(lambda conn: conn.execute(query, params).fetchall()):
+            yield row["username"], _dt(row["created_at"])
+
+    # ---------- messages ----------
+
+    async def save_message(self, message: Dict[str, Any]):
+        message_id = ObjectId()
+        seq = await self._write(lambda conn: _insert_message(conn, message, message_id))
+        message["_id"] = message_id
+        if seq is not None:
+            message["seq"] = seq
+
+    async def save_messages(self, messages: List[Dict[str, Any]]):
+        # Cả lô trong một thao tác ghi: một transaction, không chen giữa các thao tác khác
+        message_ids = [ObjectId() for _ in messages]
+        seqs = await self._write(lambda conn: [
+            _insert_message(conn, message, message_id) for message, message_id in zip(messages, message_ids)
+        ])
+        for message, message_id, seq in zip(messages, message_ids, seqs):
+            message["_id"] = message_id
+            if seq is not None:
+                message["seq"] = seq
+
+    async def get_stream_seqs(self, streams: List[str]) -> Dict[str, int]:
+        if not streams:
+            return {}
+        rows = await self._read(lambda conn: conn.execute(
+            f"SELECT stream, seq FROM counters WHERE stream IN ({_placeholders(streams)})", streams
+        ).fetchall())
+        return {row["stream"]: row["seq"] for row in rows}
+
+    async def get_private_messages(self, user1: str, user2: str, limit: int) -> List[Dict[str, Any]]:
+        conversation = conversation_key(user1, user2)
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT * FROM messages WHERE conversation = ? ORDER BY id DESC LIMIT ?", (conversation, limit)
+        ).fetchall())
+        return [_message(row) for row in reversed(rows)]
+
+    async def get_room_messages(self, room_id: str, limit: int, before: Optional[str]) -> List[Dict[str, Any]]:
+        room_id = _valid_id(room_id)
+        before_id = _valid_id(before) if before else None
+        if room_id is None or (before and before_id is None):
+            return []
+        if before_id:
+            query, params = "SELECT * FROM messages WHERE room_id = ? AND id < ? ORDER BY id DESC LIMIT ?", (room_id, before_id, limit)
+        else:
+            query, params = "SELECT * FROM messages WHERE room_id = ? ORDER BY id DESC LIMIT ?", (room_id, limit)
+        rows = await self._read(lambda conn: conn.execute(query, params).fetchall())
+        return [_message(row) for row in reversed(rows)]
+
+    async def mark_message_as_read(self, message_id: str) -> Optional[Dict[str, Any]]:
+        message_id = str(ObjectId(message_id))
+
+        def mark(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute(
+                "SELECT sender, recipient, room_id, is_read FROM messages WHERE id = ?", (message_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if not row["is_read"]:
+                conn.execute("UPDATE messages SET is_read = 1, updated_at = ? WHERE id = ?", (_now(), message_id))
+                if row["recipient"] and not row["room_id"]:
+                    conn.execute(
+                        "UPDATE inbox SET unread = unread - 1 "
+                        "WHERE owner = ? AND kind = ? AND conversation_id = ? AND unread > 0",
+                        (row["recipient"], INBOX_DIRECT, row["sender"]),
+                    )
+            return {
+                "_id": ObjectId(message_id),
+                "sender": row["sender"],
+                "recipient": row["recipient"],
+                "room_id": ObjectId(row["room_id"]) if row["room_id"] else None,
+                "is_read": bool(row["is_read"]),
+            }
+
+        return await self._write(mark)
+
+    async def delete_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        message_id = str(ObjectId(message_id))
+
+        def delete(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute("SELECT * FROM messages WHERE id = ?", (message_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+            return _message(row)
+
+        return await self._write(delete)
+
+    async def get_unread_messages(self, username: str) -> List[Dict[str, Any]]:
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT * FROM messages WHERE recipient = ? AND is_read = 0 ORDER BY timestamp DESC", (username,)
+        ).fetchall())
+        return [_message(row) for row in rows]
+
+    # ---------- rooms ----------
+
+    async def create_room(self, room: Dict[str, Any]):
+        room_id = ObjectId()
+
+        def insert(conn: sqlite3.Connection):
+            conn.execute(
+                "INSERT INTO rooms (id, room_name, description, creator, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    str(room_id), room["room_name"], room.get("description"), room["creator"],
+                    _ts(room.get("created_at")), _ts(room.get("updated_at")),
+                ),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO room_members (room_id, username) VALUES (?, ?)",
+                [(str(room_id), member) for member in room["members"]],
+            )
+            _add_room_inbox(conn, str(room_id), room["room_name"], room["members"])
+
+        try:
+            await self._write(insert)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Phòng '{room['room_name']}' đã tồn tại")
+        room["_id"] = room_id
+
+    async def get_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        room_id = _valid_id(room_id)
+        if room_id is None:
+            return None
+        return await self._read(lambda conn: _room(conn, room_id))
+
+    async def get_all_rooms(self) -> List[Dict[str, Any]]:
+        return await self._read(lambda conn: _rooms_with_members(
+            conn, conn.execute("SELECT * FROM rooms ORDER BY created_at DESC").fetchall()
+        ))
+
+    async def join_room(self, room_id: str, username: str) -> bool:
+        return (await self.add_room_member(room_id, username))[1]
+
+    async def leave_room(self, room_id: str, username: str) -> bool:
+        return (await self.remove_room_member(room_id, username))[1]
+
+    async def add_room_member(self, room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        room_id = _valid_id(room_id)
+        if room_id is None:
+            return None, False
+
+        def add(conn: sqlite3.Connection) -> Tuple[Optional[Dict[str, Any]], bool]:
+            row = conn.execute("SELECT room_name FROM rooms WHERE id = ?", (room_id,)).fetchone()
+            if row is None:
+                return None, False
+            joined = conn.execute(
+                "INSERT OR IGNORE INTO room_members (room_id, username) VALUES (?, ?)", (room_id, username)
+            ).rowcount > 0
+            conn.execute("UPDATE rooms SET updated_at = ? WHERE id = ?", (_now(), room_id))
+            if joined:
+                _add_room_inbox(conn, room_id, row["room_name"], [username])
+            return _room(conn, room_id), joined
+
+        return await self._write(add)
+
+    async def remove_room_member(self, room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        room_id = _valid_id(room_id)
+        if room_id is None:
+            return None, False
+
+        def remove(conn: sqlite3.Connection) -> Tuple[Optional[Dict[str, Any]], bool]:
+            if conn.execute("SELECT 1 FROM rooms WHERE id = ?", (room_id,)).fetchone() is None:
+                return None, False
+            left = conn.execute(
+                "DELETE FROM room_members WHERE room_id = ? AND username = ?", (room_id, username)
+            ).rowcount > 0
+            conn.execute("UPDATE rooms SET updated_at = ? WHERE id = ?", (_now(), room_id))
+            if left:
+                conn.execute(
+                    "DELETE FROM inbox WHERE owner = ? AND kind = ? AND conversation_id = ?",
+                    (username, INBOX_ROOM, room_id),
+                )
+            return _room(conn, room_id), left
+
+        return await self._write(remove)
+
+    async def add_room_members(self, room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        room_id = _valid_id(room_id)
+        if room_id is None:
+            return None, []
+
+        def add(conn: sqlite3.Connection) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+            row = conn.execute("SELECT room_name FROM rooms WHERE id = ?", (room_id,)).fetchone()
+            if row is None:
+                return None, []
+            members = {r[0] for r in conn.execute("SELECT username FROM room_members WHERE room_id = ?", (room_id,))}
+            added = [username for username in dict.fromkeys(usernames) if username not in members]
+            conn.executemany(
+                "INSERT INTO room_members (room_id, username) VALUES (?, ?)", [(room_id, username) for username in added]
+            )
+            conn.execute("UPDATE rooms SET updated_at = ? WHERE id = ?", (_now(), room_id))
+            _add_room_inbox(conn, room_id, row["room_name"], added)
+            return _room(conn, room_id), added
+
+        return await self._write(add)
+
+    async def remove_room_members(self, room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        room_id = _valid_id(room_id)
+        if room_id is None:
+            return None, []
+        leaving = json.dumps(usernames)
+
+        def remove(conn: sqlite3.Connection) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+            if conn.execute("SELECT 1 FROM rooms WHERE id = ?", (room_id,)).fetchone() is None:
+                return None, []
+            removed = [r[0] for r in conn.execute(
+                "SELECT username FROM room_members WHERE room_id = ? AND username IN (SELECT value FROM json_each(?)) "
+                "ORDER BY rowid",
+                (room_id, leaving),
+            )]
+            conn.execute(
+                "DELETE FROM room_members WHERE room_id = ? AND username IN (SELECT value FROM json_each(?))",
+                (room_id, leaving),
+            )
+            conn.execute(
+                "DELETE FROM inbox WHERE kind = ? AND conversation_id = ? AND owner IN (SELECT value FROM json_each(?))",
+                (INBOX_ROOM, room_id, leaving),
+            )
+            conn.execute("UPDATE rooms SET updated_at = ? WHERE id = ?", (_now(), room_id))
+            return _room(conn, room_id), removed
+
+        return await self._write(remove)
+
+    async def get_room_members(self, room_id: str) -> Optional[List[str]]:
+        room_id = _valid_id(room_id)
+        if room_id is None:
+            return None
+
+        def members(conn: sqlite3.Connection) -> Optional[List[str]]:
+            if conn.execute("SELECT 1 FROM rooms WHERE id = ?", (room_id,)).fetchone() is None:
+                return None
+            return [row[0] for row in conn.execute(
+                "SELECT username FROM room_members WHERE room_id = ? ORDER BY rowid", (room_id,)
+            )]
+
+        return await self._read(members)
+
+    async def get_member_room_ids(self, username: str, object_ids: List[Any]) -> List[str]:
+        ids = [str(object_id) for object_id in object_ids]
+        rows = await self._read(lambda conn: conn.execute(
+            f"SELECT room_id FROM room_members WHERE username = ? AND room_id IN ({_placeholders(ids)})",
+            [username, *ids],
+        ).fetchall())
+        return [row[0] for row in rows]
+
+    async def get_user_room_ids(self, username: str) -> List[str]:
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT room_id FROM room_members WHERE username = ?", (username,)
+        ).fetchall())
+        return [row[0] for row in rows]
+
+    async def get_user_rooms(self, username: str) -> List[Dict[str, Any]]:
+        return await self._read(lambda conn: _rooms_with_members(conn, conn.execute(
+            "SELECT rooms.* FROM rooms JOIN room_members ON room_members.room_id = rooms.id "
+            "WHERE room_members.username = ? ORDER BY rooms.created_at DESC",
+            (username,),
+        ).fetchall()))
+
+    # ---------- files ----------
+
+    async def save_file(self, file_obj: Dict[str, Any]):
+        file_id = ObjectId()
+        await self._write(lambda conn: conn.execute(
+            "INSERT INTO files (id, filename, sender, recipient, room_id, file_size, file_data, timestamp) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                str(file_id), file_obj["filename"], file_obj["sender"], file_obj.get("recipient"),
+                file_obj.get("room_id"), file_obj.get("file_size", 0), file_obj.get("file_data", ""),
+                _ts(file_obj["timestamp"]),
+            ),
+        ))
+        file_obj["_id"] = file_id
+
+    async def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        file_id = str(ObjectId(file_id))
+        row = await self._read(lambda conn: conn.execute("SELECT * FROM files WHERE id = ?", (file_id,)).fetchone())
+        return _file(row) if row else None
+
+    async def get_user_files(self, username: str, limit: int) -> List[Dict[str, Any]]:
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT id, filename, sender, recipient, room_id, file_size, timestamp FROM files "
+            "WHERE sender = ? OR recipient = ? ORDER BY timestamp DESC LIMIT ?",
+            (username, username, limit),
+        ).fetchall())
+        return [_file(row) for row in rows]
+
+    # ---------- invitation links ----------
+
+    async def create_invitation_link(self, invitation: Dict[str, Any]):
+        link_id = ObjectId()
+        await self._write(lambda conn: conn.execute(
+            "INSERT INTO invitation_links (id, invite_code, room_id, room_name, creator, created_by, created_at, "
+            "expires_at, is_active, used_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                str(link_id), invitation["invite_code"], invitation["room_id"], invitation.get("room_name"),
+                invitation.get("creator"), invitation.get("created_by"), _ts(invitation.get("created_at")),
+                _ts(invitation["expires_at"]), int(invitation.get("is_active", True)),
+                json.dumps(invitation.get("used_by", [])),
+            ),
+        ))
+        invitation["_id"] = link_id
+
+    async def get_invitation_link(self, invite_code: str) -> Optional[Dict[str, Any]]:
+        row = await self._read(lambda conn: conn.execute(
+            "SELECT * FROM invitation_links WHERE invite_code = ?", (invite_code,)
+        ).fetchone())
+        return _invitation(row) if row else None
+
+    @staticmethod
+    def _add_used_by(conn: sqlite3.Connection, row: sqlite3.Row, username: str, now: datetime):
+        used_by = json.loads(row["used_by"])
+        if username not in used_by:
+            used_by.append(username)
+        conn.execute(
+            "UPDATE invitation_links SET used_by = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(used_by), _ts(now), row["id"]),
+        )
+
+    async def use_invitation_link(self, invite_code: str, username: str) -> bool:
+        def use(conn: sqlite3.Connection) -> bool:
+            row = conn.execute("SELECT * FROM invitation_links WHERE invite_code = ?", (invite_code,)).fetchone()
+            if row is None:
+                return False
+            self._add_used_by(conn, row, username, datetime.utcnow())
+            return True
+
+        return await self._write(use)
+
+    async def redeem_invitation_link(self, invite_code: str, username: str, now: datetime) -> Optional[Dict[str, Any]]:
+        def redeem(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute(
+                "SELECT * FROM invitation_links WHERE invite_code = ? AND is_active = 1 AND expires_at > ?",
+                (invite_code, _ts(now)),
+            ).fetchone()
+            if row is None:
+                return None
+            # Trả về trạng thái trước khi cập nhật, như find_one_and_update
+            self._add_used_by(conn, row, username, now)
+            return _invitation(row)
+
+        return await self._write(redeem)
+
+    async def get_room_invitation_links(self, room_id: str) -> List[Dict[str, Any]]:
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT * FROM invitation_links WHERE room_id = ? ORDER BY created_at DESC", (room_id,)
+        ).fetchall())
+        return [_invitation(row) for row in rows]
+
+    async def disable_invitation_link(self, invite_code: str) -> bool:
+        now = _ts(datetime.utcnow())
+        return await self._write(lambda conn: conn.execute(
+            "UPDATE invitation_links SET is_active = 0, updated_at = ? WHERE invite_code = ?", (now, invite_code)
+        ).rowcount > 0)
+
+    # ---------- inbox ----------
+
+    async def get_inbox(self, username: str, limit: int) -> List[Dict[str, Any]]:
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT * FROM inbox WHERE owner = ? ORDER BY last_activity DESC LIMIT ?", (username, limit)
+        ).fetchall())
+        return [_inbox_entry(row) for row in rows]
+
+    async def mark_inbox_read(self, username: str, kind: str, conversation_id: str) -> Optional[int]:
+        def mark(conn: sqlite3.Connection) -> Optional[int]:
+            updated = conn.execute(
+                "UPDATE inbox SET unread = 0 WHERE owner = ? AND kind = ? AND conversation_id = ?",
+                (username, kind, conversation_id),
+            ).rowcount
+            if not updated:
+                return None
+            if kind != INBOX_DIRECT:
+                return 0
+            return conn.execute(
+                "UPDATE messages SET is_read = 1, updated_at = ? WHERE recipient = ? AND sender = ? AND is_read = 0",
+                (_now(), username, conversation_id),
+            ).rowcount
+
+        return await self._write(mark)
+
+
+registry.counter(
+    "realchat_sqlite_writes_total", "SQLite write operations by outcome",
+    ("outcome",),
+    callback=lambda: {
+        ("ok",): sqlite_stats.writes - sqlite_stats.failed_writes,
+        ("failed",): sqlite_stats.failed_writes,
+    },
+)
+registry.counter(
+    "realchat_sqlite_write_batches_total", "SQLite write transactions (each commits a batch of writes)",
+    callback=lambda: {(): sqlite_stats.batches},
+)
+registry.counter(
+    "realchat_sqlite_reads_total", "SQLite read operations",
+    callback=lambda: {(): sqlite_stats.reads},
+)
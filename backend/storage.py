@@ -0,0 +1,248 @@
+"""
+Storage Engine cho RealChat - interface lưu trữ dùng chung cho mọi engine
+
+database.py giữ các hàm public (routes gọi), phần ghi/đọc dữ liệu được chuyển cho engine
+chọn bằng STORAGE_ENGINE:
+- "mongodb": MongoStorage trong database.py (mặc định, kèm inbox/change log/search/archive)
+- "sqlite": SQLiteStorage trong sqlite_storage.py (một file, WAL, cho triển khai nhỏ)
+- "memory": MemoryStorage trong memory_storage.py (không cần database, dùng cho dev và
+  đo overhead của API tách khỏi độ trễ MongoDB)
+
+Quy ước chung:
+- Document có cùng dạng với MongoDB: "_id" là ObjectId, room_id của tin nhắn là ObjectId,
+  utils.format_* dùng được cho mọi engine
+- Các hàm create_* / save_* nhận document đã dựng sẵn và gán "_id" (và "seq" với tin nhắn)
+- Cache trong process (ETag, room cache, username filter, replay buffer) do database.py cập nhật,
+  engine chỉ lo phần lưu trữ
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+# Loại hội thoại trong inbox
+INBOX_ROOM = "room"
+INBOX_DIRECT = "direct"
+
+
+class StorageEngine(ABC):
+    """
+    Interface các thao tác user, message, room, file, invitation link và inbox.
+    Engine thiếu hàm nào sẽ lỗi ngay khi khởi tạo (TypeError) thay vì khi route gọi tới
+    """
+
+    name = "base"
+
+    async def connect(self):
+        """Mở kết nối / nạp dữ liệu khi startup"""
+
+    async def close(self):
+        """Đóng kết nối khi shutdown"""
+
+    # ---------- users ----------
+
+    @abstractmethod
+    async def create_user(self, user: Dict[str, Any]):
+        """Lưu user mới; ValueError nếu username hoặc email đã tồn tại"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def user_exists(self, username: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def existing_usernames(self, usernames: List[str]) -> Set[str]:
+        """Những username trong danh sách đã tồn tại (một query cho cả danh sách)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_all_users(self) -> List[Dict[str, Any]]:
+        """Tất cả users, không kèm password_hash"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_online_users(self) -> List[Dict[str, Any]]:
+        """Users đang online, không kèm password_hash"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_user_online_status(self, username: str, is_online: bool) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def count_users(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_usernames(self, since: Optional[datetime] = None) -> AsyncIterator[Tuple[str, Optional[datetime]]]:
+        """(username, created_at) của user tạo từ since (None = tất cả), cho username filter / index"""
+        raise NotImplementedError
+
+    # ---------- messages ----------
+
+    @abstractmethod
+    async def save_message(self, message: Dict[str, Any]):
+        """Lưu tin nhắn mới; gán "_id" và "seq" (số thứ tự trong phòng / hội thoại)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def save_messages(self, messages: List[Dict[str, Any]]):
+        """Lưu một lô tin nhắn bằng một lần ghi; gán "_id" và "seq" như save_message"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_stream_seqs(self, streams: List[str]) -> Dict[str, int]:
+        """seq mới nhất của các stream (room_key / conversation_key)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_private_messages(self, user1: str, user2: str, limit: int) -> List[Dict[str, Any]]:
+        """limit tin mới nhất của hội thoại, cũ -> mới"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_room_messages(self, room_id: str, limit: int, before: Optional[str]) -> List[Dict[str, Any]]:
+        """limit tin mới nhất của phòng có _id < before, cũ -> mới"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def mark_message_as_read(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Đánh dấu đã đọc; trả về trạng thái TRƯỚC đó (sender, recipient, room_id, is_read) hoặc None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Xóa tin nhắn; trả về tin đã xóa (ít nhất sender, recipient, room_id) hoặc None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_unread_messages(self, username: str) -> List[Dict[str, Any]]:
+        """Tin nhắn 1-1 chưa đọc gửi tới user, mới -> cũ"""
+        raise NotImplementedError
+
+    # ---------- rooms ----------
+
+    @abstractmethod
+    async def create_room(self, room: Dict[str, Any]):
+        """Lưu phòng mới; ValueError nếu tên phòng đã tồn tại"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_all_rooms(self) -> List[Dict[str, Any]]:
+        """Tất cả phòng, mới tạo trước"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def join_room(self, room_id: str, username: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def leave_room(self, room_id: str, username: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_room_member(self, room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """(phòng sau khi thêm hoặc None nếu không tồn tại, có phải thành viên mới không)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove_room_member(self, room_id: str, username: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """(phòng sau khi xóa hoặc None nếu không tồn tại, user có thực sự rời phòng không)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_room_members(self, room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """Thêm nhiều thành viên bằng một lần ghi: (phòng sau khi thêm hoặc None, những user mới vào phòng)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove_room_members(self, room_id: str, usernames: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """Xóa nhiều thành viên bằng một lần ghi: (phòng sau khi xóa hoặc None, những user thực sự rời phòng)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_room_members(self, room_id: str) -> Optional[List[str]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_member_room_ids(self, username: str, object_ids: List[Any]) -> List[str]:
+        """Trong các phòng object_ids (ObjectId), những phòng mà user là thành viên"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user_room_ids(self, username: str) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user_rooms(self, username: str) -> List[Dict[str, Any]]:
+        """Phòng của user, mới tạo trước"""
+        raise NotImplementedError
+
+    # ---------- files ----------
+
+    @abstractmethod
+    async def save_file(self, file_obj: Dict[str, Any]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user_files(self, username: str, limit: int) -> List[Dict[str, Any]]:
+        """File user gửi hoặc nhận, mới -> cũ, không kèm file_data"""
+        raise NotImplementedError
+
+    # ---------- invitation links ----------
+
+    @abstractmethod
+    async def create_invitation_link(self, invitation: Dict[str, Any]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_invitation_link(self, invite_code: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def use_invitation_link(self, invite_code: str, username: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def redeem_invitation_link(self, invite_code: str, username: str, now: datetime) -> Optional[Dict[str, Any]]:
+        """Ghi nhận user dùng link nếu link còn active và chưa hết hạn (một thao tác nguyên tử)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_room_invitation_links(self, room_id: str) -> List[Dict[str, Any]]:
+        """Links của phòng, mới tạo trước"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def disable_invitation_link(self, invite_code: str) -> bool:
+        raise NotImplementedError
+
+    # ---------- inbox ----------
+
+    @abstractmethod
+    async def get_inbox(self, username: str, limit: int) -> List[Dict[str, Any]]:
+        """Entry inbox của user (phòng + chat 1-1), hoạt động gần nhất trước"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def mark_inbox_read(self, username: str, kind: str, conversation_id: str) -> Optional[int]:
+        """
+        Đặt unread = 0; chat 1-1 đồng thời đánh dấu đã đọc tin nhắn từ người kia.
+        Trả về số tin nhắn vừa được đánh dấu, None nếu không có entry
+        """
+        raise NotImplementedError
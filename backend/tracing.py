@@ -0,0 +1,165 @@
+"""
+Request Tracing cho RealChat - span trong process, export ra file
+
+- Span gắn với request qua contextvars (đúng cả với asyncio.gather / task con)
+- Span đã kết thúc được giữ trong ring buffer (TRACE_BUFFER_SIZE)
+- Export theo Chrome Trace Event Format (JSON), mở bằng Perfetto
+  (ui.perfetto.dev) hoặc chrome://tracing, không cần collector bên ngoài
+
+Khi TRACING_ENABLED=False, decorator @traced trả về nguyên hàm gốc (không tốn chi phí).
+"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, Iterator, List, Optional
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+from config import settings
+from metrics import route_label
+import itertools
+import json
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, trace_id: int, span_id: int, parent_id: Optional[int], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("realchat_current_span", default=None)
+
+
+class Tracer:
+    def __init__(self, buffer_size: int):
+        self.spans: deque = deque(maxlen=buffer_size)
+        self._ids = itertools.count(1)
+        # Mốc để đổi perf_counter_ns sang thời gian thực khi export
+        self._wall_offset_ns = time.time_ns() - time.perf_counter_ns()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Mở span con của span hiện tại (hoặc trace mới nếu chưa có)"""
+        parent = _current_span.get()
+        span_id = next(self._ids)
+        span = Span(
+            name,
+            parent.trace_id if parent else span_id,
+            span_id,
+            parent.span_id if parent else None,
+            attributes,
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            span.end_ns = time.perf_counter_ns()
+            _current_span.reset(token)
+            self.spans.append(span)
+
+    def export(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        """Chrome Trace Event Format: mỗi trace một track (tid)"""
+        spans: List[Span] = list(self.spans)
+        if limit:
+            spans = spans[-limit:]
+        pid = os.getpid()
+        events = []
+        for span in spans:
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(" ", 1)[0].split(".", 1)[0],
+                "ph": "X",
+                "ts": (span.start_ns + self._wall_offset_ns) / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.trace_id,
+                "args": {
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    **{k: v if isinstance(v, (int, float, bool)) or v is None else str(v)
+                       for k, v in span.attributes.items()},
+                },
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, directory: Optional[str] = None) -> str:
+        """Ghi ring buffer ra file JSON, trả về đường dẫn"""
+        directory = directory or settings.TRACE_OUTPUT_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"trace-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.export(), f)
+        logger.info(f"Trace exported to {path} ({len(self.spans)} spans)")
+        return path
+
+
+tracer = Tracer(settings.TRACE_BUFFER_SIZE)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator bọc coroutine function trong một span"""
+    def decorator(func):
+        if not settings.TRACING_ENABLED:
+            return func
+        span_name = name or func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_span(name: str, **attributes: Any):
+    """Span thủ công; trả về context rỗng khi tracing tắt"""
+    if not settings.TRACING_ENABLED:
+        return _noop_span()
+    return tracer.span(name, **attributes)
+
+
+@contextmanager
+def _noop_span() -> Iterator[None]:
+    yield None
+
+
+class TracingMiddleware:
+    """Span gốc cho mỗi HTTP request, đặt tên theo route template (ASGI thuần)"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_paths: Dict[object, str] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with tracer.span(f"http {scope['method']}", path=scope["path"]) as span:
+            async def send_with_status(message: Message):
+                if message["type"] == "http.response.start":
+                    span.attributes["status"] = message["status"]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                span.name = f"http {scope['method']} {route_label(scope, self._route_paths)}"
@@ -0,0 +1,113 @@
+"""
+Username Filter cho RealChat - Bloom filter trong bộ nhớ cho câu hỏi "username có tồn tại?"
+
+- "Không có" là chắc chắn -> register/send bỏ qua được query MongoDB
+- "Có thể có" phải được xác minh lại bằng MongoDB (false positive ~ USERNAME_FILTER_FP_RATE)
+- Không hỗ trợ xóa (app không xóa user); nạp lúc startup, cập nhật trong create_user
+  và làm mới định kỳ để thấy user do worker khác tạo
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+from config import settings
+from metrics import registry
+import hashlib
+import math
+
+
+class BloomFilter:
+    """Bloom filter trên bytearray, k vị trí từ một digest blake2b (double hashing)"""
+
+    def __init__(self, capacity: int, fp_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size = self.size
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % size
+
+    def add(self, value: str):
+        bits = self.bits
+        for position in self._positions(value):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        bits = self.bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+
+class UsernameFilter:
+    """Bloom filter của username + mốc created_at để làm mới tăng dần"""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self.fp_rate = fp_rate
+        self.bloom = BloomFilter(capacity, fp_rate)
+        self.loaded = False
+        self.watermark: Optional[datetime] = None
+        self.negatives = 0
+        self.positives = 0
+        self.false_positives = 0
+
+    def reset(self, expected: int):
+        """Tạo filter mới đủ chỗ cho `expected` username (dư gấp đôi để tăng trưởng)"""
+        self.bloom = BloomFilter(max(expected * 2, settings.USERNAME_FILTER_CAPACITY), self.fp_rate)
+        self.loaded = False
+        self.watermark = None
+
+    def add(self, username: str, created_at: Optional[datetime] = None):
+        # Lần làm mới quét chồng lấn nên gặp lại username cũ: không đếm lại vào count
+        if username not in self.bloom:
+            self.bloom.add(username)
+        if created_at is not None and (self.watermark is None or created_at > self.watermark):
+            self.watermark = created_at
+
+    def add_many(self, usernames: Iterable[str]):
+        for username in usernames:
+            self.bloom.add(username)
+
+    def might_exist(self, username: str) -> bool:
+        """False = chắc chắn không tồn tại. Khi chưa nạp xong luôn trả True (phải hỏi DB)"""
+        if not self.loaded:
+            return True
+        if username in self.bloom:
+            self.positives += 1
+            return True
+        self.negatives += 1
+        return False
+
+    @property
+    def over_capacity(self) -> bool:
+        return self.bloom.count > self.bloom.capacity
+
+
+username_filter = UsernameFilter(settings.USERNAME_FILTER_CAPACITY, settings.USERNAME_FILTER_FP_RATE)
+
+registry.counter(
+    "realchat_username_filter_lookups_total", "Username filter lookups by result",
+    ("result",),
+    callback=lambda: {
+        ("negative",): username_filter.negatives,
+        ("positive",): username_filter.positives,
+        ("false_positive",): username_filter.false_positives,
+    },
+)
+registry.gauge(
+    "realchat_username_filter_bytes", "Memory used by the username Bloom filter bit array",
+    callback=lambda: {(): username_filter.bloom.memory_bytes},
+)
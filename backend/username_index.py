@@ -0,0 +1,84 @@
+"""
+Username Index cho RealChat - tìm username theo tiền tố trong bộ nhớ (GET /api/users/search)
+
+- Mảng đã sắp xếp các username đã chuẩn hóa (chữ thường, bỏ dấu như search.fold),
+  tìm bằng binary search (bisect) rồi đọc tuần tự K phần tử: O(log n + K), vài micro giây
+- Mỗi user là MỘT chuỗi: "<key>" nếu username đã ở dạng chuẩn, ngược lại "<key>\\0<username>"
+  (key trùng nhau vẫn giữ đủ, vd. "Đức" và "duc")
+- Nạp lúc startup, cập nhật trong create_user và làm mới định kỳ cùng username filter
+"""
+from bisect import bisect_left
+from datetime import datetime
+from typing import Iterable, List, Optional
+from metrics import registry
+from search import fold
+import sys
+
+SEPARATOR = "\0"
+
+
+def _entry(username: str) -> str:
+    key = fold(username)
+    return key if key == username else f"{key}{SEPARATOR}{username}"
+
+
+def _username(entry: str) -> str:
+    return entry.rpartition(SEPARATOR)[2]
+
+
+class UsernameIndex:
+    def __init__(self):
+        self.entries: List[str] = []
+        self.bytes = sys.getsizeof(self.entries)
+        self.loaded = False
+        self.watermark: Optional[datetime] = None
+        self.lookups = 0
+
+    def reset(self, usernames: Iterable[str]):
+        """Dựng lại toàn bộ index (sắp xếp một lần)"""
+        self.entries = sorted(_entry(username) for username in usernames)
+        self.bytes = sys.getsizeof(self.entries) + sum(sys.getsizeof(entry) for entry in self.entries)
+
+    def add(self, username: str, created_at: Optional[datetime] = None):
+        """Thêm username (bỏ qua nếu đã có)"""
+        entry = _entry(username)
+        position = bisect_left(self.entries, entry)
+        if position == len(self.entries) or self.entries[position] != entry:
+            self.entries.insert(position, entry)
+            self.bytes += sys.getsizeof(entry) + 8
+        if created_at is not None and (self.watermark is None or created_at > self.watermark):
+            self.watermark = created_at
+
+    def search(self, prefix: str, limit: int) -> List[str]:
+        """Tối đa limit username có tiền tố (không phân biệt hoa thường / dấu), theo thứ tự chữ cái"""
+        self.lookups += 1
+        key = fold(prefix).replace(SEPARATOR, "")
+        entries = self.entries
+        position = bisect_left(entries, key)
+        results = []
+        while position < len(entries) and len(results) < limit:
+            entry = entries[position]
+            if not entry.startswith(key):
+                break
+            results.append(_username(entry))
+            position += 1
+        return results
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+username_index = UsernameIndex()
+
+registry.gauge(
+    "realchat_username_index_entries", "Usernames in the prefix search index",
+    callback=lambda: {(): len(username_index)},
+)
+registry.gauge(
+    "realchat_username_index_bytes", "Estimated memory used by the username prefix index",
+    callback=lambda: {(): username_index.bytes},
+)
+registry.counter(
+    "realchat_username_index_lookups_total", "Prefix username searches",
+    callback=lambda: {(): username_index.lookups},
+)
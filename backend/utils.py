@@ -128,12 +128,14 @@ def validate_room_name(room_name: str) -> Tuple[bool, str]:
 # ============ FORMATTING FUNCTIONS ============
 
 def format_user_response(user: Dict[str, Any]) -> Dict[str, Any]:
-    """Format user response (loại bỏ mật khẩu)"""
+    """Format user response (loại bỏ mật khẩu, đủ field của UserResponse)"""
+    is_online = user.get("is_online", False)
     return {
         "_id": str(user.get("_id", "")),
         "username": user.get("username"),
         "email": user.get("email"),
-        "is_online": user.get("is_online", False),
+        "is_online": is_online,
+        "status": "ONLINE" if is_online else "OFFLINE",
         "last_login": user.get("last_login"),
         "created_at": user.get("created_at"),
     }
@@ -155,11 +157,12 @@ def format_message_response(message: Dict[str, Any]) -> Dict[str, Any]:
         "message_type": message.get("message_type", "TEXT"),
         "is_read": message.get("is_read", False),
         "timestamp": message.get("timestamp"),
+        "seq": message.get("seq"),
     }
 
 
 def format_room_response(room: Dict[str, Any]) -> Dict[str, Any]:
-    """Format room response"""
+    """Format room response (đủ field của RoomResponse)"""
     return {
         "_id": str(room.get("_id", "")),
         "room_name": room.get("room_name"),
@@ -167,6 +170,20 @@ def format_room_response(room: Dict[str, Any]) -> Dict[str, Any]:
         "creator": room.get("creator"),
         "members": room.get("members", []),
         "created_at": room.get("created_at"),
+        "invite_link": room.get("invite_link"),
+        "invite_code": room.get("invite_code"),
+    }
+
+def format_inbox_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Format inbox entry (đủ field của InboxEntry)"""
+    last_message = entry.get("last_message")
+    return {
+        "kind": entry.get("kind"),
+        "conversation_id": entry.get("conversation_id"),
+        "title": entry.get("title"),
+        "last_message": format_message_response(last_message) if last_message else None,
+        "last_activity": entry.get("last_activity"),
+        "unread": entry.get("unread", 0),
     }
 
 def format_invitation_link_response(link: Dict[str, Any]) -> Dict[str, Any]:
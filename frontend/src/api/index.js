@@ -32,6 +32,10 @@ export const userAPI = {
     return api.get("/users/online");
   },
 
+  searchUsers(q, limit) {
+    return api.get("/users/search", { params: { q, limit } });
+  },
+
   getUserProfile(username) {
     return api.get(`/users/${username}`);
   },
@@ -54,6 +58,13 @@ export const messageAPI = {
     });
   },
 
+  // messages: [{ recipient | room_id, content, message_type }]
+  sendBatch(username, messages) {
+    return api.post("/messages/send-batch", { messages }, {
+      params: { username },
+    });
+  },
+
   markAsRead(messageId) {
     return api.put(`/messages/mark-read/${messageId}`);
   },
@@ -86,6 +97,24 @@ export const roomAPI = {
     });
   },
 
+  importMembers(roomId, username, usernames) {
+    return api.post(`/rooms/${roomId}/members/import`, { usernames }, {
+      params: { username },
+    });
+  },
+
+  removeMembers(roomId, username, usernames) {
+    return api.post(`/rooms/${roomId}/members/remove`, { usernames }, {
+      params: { username },
+    });
+  },
+
+  exportMembers(roomId, format = "json") {
+    return api.get(`/rooms/${roomId}/members/export`, {
+      params: { format },
+    });
+  },
+
   getRoomMessages(roomId, limit = 50) {
     return api.get(`/rooms/${roomId}/messages`, {
       params: { limit },
@@ -96,3 +125,24 @@ export const roomAPI = {
     return api.post(`/rooms/${roomId}/messages`, data);
   },
 };
+
+export const inboxAPI = {
+  getInbox(username, limit = 100) {
+    return api.get(`/inbox/${username}`, {
+      params: { limit },
+    });
+  },
+
+  markRead(username, kind, conversationId) {
+    return api.put(`/inbox/${username}/${kind}/${conversationId}/read`);
+  },
+};
+
+export const searchAPI = {
+  // scope: { room_id } hoặc { with_user }
+  search(username, q, scope, offset = 0, limit = 20) {
+    return api.get("/search", {
+      params: { username, q, ...scope, offset, limit },
+    });
+  },
+};
@@ -1,11 +1,12 @@
 import { defineStore } from "pinia";
 import { ref } from "vue";
-import { messageAPI, userAPI } from "@/api";
+import { inboxAPI, messageAPI, userAPI } from "@/api";
 
 export const useChatStore = defineStore("chat", () => {
   const messages = ref([]);
   const users = ref([]);
   const onlineUsers = ref([]);
+  const inbox = ref([]);
   const currentChat = ref(null);
   const isLoading = ref(false);
   const error = ref(null);
@@ -58,6 +59,15 @@ export const useChatStore = defineStore("chat", () => {
     }
   }
 
+  async function loadInbox(username) {
+    try {
+      const response = await inboxAPI.getInbox(username);
+      inbox.value = response.data;
+    } catch (err) {
+      console.error("Lỗi tải inbox:", err);
+    }
+  }
+
   function addMessage(message) {
     if (
       currentChat.value === message.sender ||
@@ -71,6 +81,7 @@ export const useChatStore = defineStore("chat", () => {
     messages,
     users,
     onlineUsers,
+    inbox,
     currentChat,
     isLoading,
     error,
@@ -78,6 +89,7 @@ export const useChatStore = defineStore("chat", () => {
     sendMessage,
     loadUsers,
     loadOnlineUsers,
+    loadInbox,
     addMessage,
   };
 });